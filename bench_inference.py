@@ -0,0 +1,137 @@
+# ===================================================================
+# bench_inference.py - ĐO COLD-START & ĐỘ TRỄ SUY LUẬN CỦA AIModelBundle
+# ===================================================================
+# - Mỗi định dạng (keras / tflite) chạy trong 1 tiến trình con riêng để đo
+#   đúng chi phí cold-start: import + load model + RSS đỉnh.
+# - Sau khi load, chấm điểm N cửa sổ 60 nến (1 cửa sổ / lần, giống ml_report)
+#   và báo cáo độ trễ p50/p95 cho LSTM + Transformer.
+# - --lgbm: so sánh LightGBM pickle (joblib, compress=3, dự đoán từ DataFrame 1 dòng)
+#   với booster gốc (.txt, dự đoán từ dòng float32) về thời gian load và độ trễ
+#   dự đoán 1 dòng, cho mọi SYMBOLS x INTERVALS.
+#
+# Chạy: python bench_inference.py ETHUSDT 1h [--runs 50]
+#       python bench_inference.py --lgbm [--runs 200]
+# ===================================================================
+
+import os, sys, json, time, subprocess
+import argparse
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def peak_rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"): return int(line.split()[1]) / 1024
+    except OSError: pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def percentile(values, q: float) -> float:
+    vals = sorted(values)
+    if not vals: return 0.0
+    k = (len(vals) - 1) * q
+    lo, hi = int(k), min(int(k) + 1, len(vals) - 1)
+    return vals[lo] + (vals[hi] - vals[lo]) * (k - lo)
+
+def run_child(symbol: str, interval: str, runs: int) -> dict:
+    """Chạy trong tiến trình con: AI_USE_TFLITE đã được set bởi tiến trình cha."""
+    t0 = time.perf_counter()
+    sys.path.append(BASE_DIR)
+    import numpy as np
+    from ml_report import AIModelBundle, SEQUENCE_LENGTH
+    t_import = time.perf_counter() - t0
+
+    t1 = time.perf_counter()
+    bundle = AIModelBundle(symbol, interval)
+    if not bundle.is_valid(): return {"error": f"Không load được model {symbol}-{interval}"}
+    t_load = time.perf_counter() - t1
+
+    rng = np.random.default_rng(42)
+    n_features = len(bundle.meta["features"])
+    windows = rng.standard_normal((runs + 1, 1, SEQUENCE_LENGTH, n_features)).astype(np.float32)
+    t2 = time.perf_counter()
+    for arch in ("lstm", "transformer"): bundle.predict_seq(arch, windows[0])
+    t_first = time.perf_counter() - t2
+
+    latencies = []
+    for w in windows[1:]:
+        t = time.perf_counter()
+        for arch in ("lstm", "transformer"): bundle.predict_seq(arch, w)
+        latencies.append((time.perf_counter() - t) * 1000)
+    backends = sorted({type(m).__name__ for m in [*bundle.multi.values(), bundle.clf_lstm, bundle.reg_lstm, bundle.clf_trans, bundle.reg_trans] if m is not None})
+    return {
+        "backends": backends, "import_s": round(t_import, 3), "load_s": round(t_load, 3), "first_predict_s": round(t_first, 3),
+        "cold_start_s": round(t_import + t_load + t_first, 3),
+        "p50_ms": round(percentile(latencies, 0.5), 2), "p95_ms": round(percentile(latencies, 0.95), 2),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+def _timeit_ms(fn, runs: int) -> list:
+    out = []
+    for _ in range(runs):
+        t = time.perf_counter(); fn(); out.append((time.perf_counter() - t) * 1000)
+    return out
+
+def bench_lgbm(runs: int):
+    sys.path.append(BASE_DIR)
+    import joblib
+    import numpy as np
+    import pandas as pd
+    from ml_report import SYMBOLS, INTERVALS, DATA_DIR, BoosterModel
+    print(f"--- ⏱️ LightGBM: pickle (joblib) vs booster gốc ({runs} lần dự đoán 1 dòng) ---")
+    print(f"  {'cặp':<16}{'load pkl':>10}{'load txt':>10}{'p50 pkl':>10}{'p50 txt':>10}{'p95 pkl':>10}{'p95 txt':>10}")
+    for symbol in SYMBOLS:
+        for interval in INTERVALS:
+            meta_path = os.path.join(DATA_DIR, f"meta_{symbol}_{interval}.json")
+            pkl_path = os.path.join(DATA_DIR, f"model_{symbol}_lgbm_clf_{interval}.pkl")
+            txt_path = os.path.join(DATA_DIR, f"model_{symbol}_lgbm_clf_{interval}.txt")
+            if not (os.path.exists(meta_path) and os.path.exists(pkl_path) and os.path.exists(txt_path)):
+                print(f"  {symbol + '-' + interval:<16} (thiếu file .pkl hoặc .txt)"); continue
+            meta = json.load(open(meta_path))
+            t = time.perf_counter(); clf_pkl = joblib.load(pkl_path); load_pkl = (time.perf_counter() - t) * 1000
+            t = time.perf_counter(); clf_txt = BoosterModel(txt_path, meta.get("lgbm_classes")); load_txt = (time.perf_counter() - t) * 1000
+            predict_pkl = getattr(clf_pkl, "predict_proba", clf_pkl.predict)  # Wrapper sklearn (model cũ) hoặc lgb.Booster
+            row = np.random.default_rng(0).standard_normal((1, len(meta["features"]))).astype(np.float32)
+            row_df = pd.DataFrame(row, columns=meta["features"])  # Cách cũ: DataFrame 1 dòng
+            lat_pkl = _timeit_ms(lambda: predict_pkl(row_df), runs)
+            lat_txt = _timeit_ms(lambda: clf_txt.predict_proba(row), runs)
+            print(f"  {symbol + '-' + interval:<16}{load_pkl:>9.1f}ms{load_txt:>8.1f}ms"
+                  f"{percentile(lat_pkl, 0.5):>8.2f}ms{percentile(lat_txt, 0.5):>8.2f}ms"
+                  f"{percentile(lat_pkl, 0.95):>8.2f}ms{percentile(lat_txt, 0.95):>8.2f}ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="So sánh cold-start / độ trễ suy luận Keras vs TFLite.")
+    parser.add_argument("symbol", nargs="?"); parser.add_argument("interval", nargs="?")
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--lgbm", action="store_true", help="So sánh LightGBM pickle vs booster gốc cho mọi cặp")
+    parser.add_argument("--child", choices=["keras", "tflite"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.lgbm:
+        bench_lgbm(args.runs); return
+    if not (args.symbol and args.interval): parser.error("Cần SYMBOL và INTERVAL (hoặc --lgbm).")
+    symbol, interval = args.symbol.upper(), args.interval.lower()
+
+    if args.child:
+        print(json.dumps(run_child(symbol, interval, args.runs)))
+        return
+
+    results = {}
+    for fmt in ("keras", "tflite"):
+        env = dict(os.environ, AI_USE_TFLITE="1" if fmt == "tflite" else "0", TF_CPP_MIN_LOG_LEVEL="3")
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), symbol, interval, "--runs", str(args.runs), "--child", fmt],
+                              env=env, capture_output=True, text=True)
+        try: results[fmt] = json.loads(proc.stdout.strip().splitlines()[-1])
+        except (ValueError, IndexError): results[fmt] = {"error": (proc.stderr or proc.stdout).strip()[-500:]}
+
+    print(f"--- ⏱️ Benchmark suy luận {symbol} [{interval}] ({args.runs} cửa sổ) ---")
+    for fmt, r in results.items():
+        if "error" in r: print(f"  {fmt:<7} ❌ {r['error']}"); continue
+        print(f"  {fmt:<7} backend={','.join(r['backends'])} | cold-start {r['cold_start_s']}s "
+              f"(import {r['import_s']}s, load {r['load_s']}s, 1st {r['first_predict_s']}s) | "
+              f"p50 {r['p50_ms']}ms p95 {r['p95_ms']}ms | RSS đỉnh {r['peak_rss_mb']}MB")
+    if "error" not in results["tflite"] and "LiteModel" not in results["tflite"]["backends"]:
+        print("  ⚠️ Không có file .tflite hợp lệ (train lại với TFLITE_EXPORT=1) — hai lần đo cùng dùng Keras.")
+
+if __name__ == "__main__":
+    main()
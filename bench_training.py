@@ -0,0 +1,103 @@
+# ===================================================================
+# bench_training.py - DÒ CẤU HÌNH LUỒNG / BATCH NHANH NHẤT CHO trainer.py
+# ===================================================================
+# - Mỗi tổ hợp (threads x batch x oneDNN x LSTM unroll) chạy 1 tiến trình
+#   `trainer.py SYMBOL INTERVAL --profile` riêng, được ghim vào `threads` core
+#   đầu tiên (giống 1 slot của train_orchestrator.py).
+# - --profile: train PROFILE_EPOCHS epoch vào thư mục tạm (không đè model thật),
+#   ghi thời gian từng giai đoạn, thời gian/epoch, mẫu/giây, RSS đỉnh mỗi model.
+# - Gộp kết quả vào 1 file JSON và đề xuất cấu hình có tổng thời gian train
+#   (LightGBM + LSTM + Transformer) thấp nhất. Chỉ đo tốc độ, không đo độ chính xác:
+#   đổi batch size có thể làm thay đổi chất lượng model.
+#
+# Chạy: python bench_training.py ETHUSDT 1h [--threads 1,2,4] [--batch 256,512,1024]
+#                                [--onednn 0,1] [--unroll 1,0] [--epochs 3]
+# ===================================================================
+
+import os, sys, json, time, itertools, argparse, subprocess, tempfile
+from datetime import datetime, timezone
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CONFIG = {"threads": 0, "batch_size": 512, "onednn": "0", "lstm_unroll": "1"}  # Cấu hình trainer.py hiện tại
+
+def _int_list(raw: str) -> list: return [int(x) for x in raw.split(",") if x.strip()]
+def _flag_list(raw: str) -> list: return [x.strip() for x in raw.split(",") if x.strip() in ("0", "1")]
+
+def run_profile(symbol: str, interval: str, config: dict, epochs: int) -> dict:
+    """Chạy 1 tiến trình trainer.py --profile với cấu hình cho trước, trả về báo cáo JSON của nó."""
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+    cores = cores[:config["threads"]] if config["threads"] else cores
+    fd, out_path = tempfile.mkstemp(prefix="train_profile_", suffix=".json"); os.close(fd)
+    n = str(config["threads"] or len(cores))
+    env = dict(os.environ, TRAINER_THREADS=str(config["threads"]), OMP_NUM_THREADS=n, OPENBLAS_NUM_THREADS=n, MKL_NUM_THREADS=n,
+               TRAIN_BATCH_SIZE=str(config["batch_size"]), TF_ENABLE_ONEDNN_OPTS=config["onednn"], LSTM_UNROLL=config["lstm_unroll"],
+               PROFILE_EPOCHS=str(epochs), PROFILE_OUT=out_path)
+    def pin():
+        if hasattr(os, "sched_setaffinity"): os.sched_setaffinity(0, cores)
+    t0 = time.perf_counter()
+    proc = subprocess.run([sys.executable, os.path.join(BASE_DIR, "trainer.py"), symbol, interval, "--profile"],
+                          cwd=BASE_DIR, env=env, capture_output=True, text=True, preexec_fn=pin)
+    wall_s = round(time.perf_counter() - t0, 1)
+    try:
+        with open(out_path) as f: report = json.load(f)
+    except (OSError, ValueError):
+        return {"config": config, "wall_s": wall_s, "error": (proc.stderr or proc.stdout).strip()[-500:] or f"exit={proc.returncode}"}
+    finally:
+        try: os.remove(out_path)
+        except OSError: pass
+    models = report.get("models", {})
+    return {"config": config, "wall_s": wall_s, "train_s": round(sum(m.get("fit_s", 0) for m in models.values()), 2),
+            "peak_rss_mb": report.get("peak_rss_mb"), "stages": report.get("stages"), "models": models}
+
+def main():
+    parser = argparse.ArgumentParser(description="Dò tổ hợp threads/batch/oneDNN/unroll cho trainer.py, đề xuất cấu hình nhanh nhất.")
+    parser.add_argument("symbol"); parser.add_argument("interval")
+    parser.add_argument("--threads", default="1,2,4", help="Danh sách số luồng (0 = mọi core)")
+    parser.add_argument("--batch", default="256,512,1024")
+    parser.add_argument("--onednn", default=DEFAULT_CONFIG["onednn"], help="TF_ENABLE_ONEDNN_OPTS: 0,1")
+    parser.add_argument("--unroll", default=DEFAULT_CONFIG["lstm_unroll"], help="LSTM_UNROLL: 1,0")
+    parser.add_argument("--epochs", type=int, default=3)
+    parser.add_argument("--out", default="")
+    args = parser.parse_args()
+    symbol, interval = args.symbol.upper(), args.interval.lower()
+    n_cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    threads = sorted({t for t in _int_list(args.threads) if t <= n_cores})
+    grid = [dict(zip(("threads", "batch_size", "onednn", "lstm_unroll"), combo))
+            for combo in itertools.product(threads, _int_list(args.batch), _flag_list(args.onednn), _flag_list(args.unroll))]
+    if DEFAULT_CONFIG not in grid: grid.insert(0, dict(DEFAULT_CONFIG))  # Luôn đo cấu hình hiện tại để tính speedup_vs_default
+
+    print(f"--- ⏱️ Profile train {symbol} [{interval}]: {len(grid)} cấu hình, {args.epochs} epoch/model ---")
+    runs = []
+    for i, config in enumerate(grid, 1):
+        r = run_profile(symbol, interval, config, args.epochs)
+        runs.append(r)
+        label = f"threads={config['threads'] or 'all'} batch={config['batch_size']} onednn={config['onednn']} unroll={config['lstm_unroll']}"
+        if "error" in r: print(f"  [{i}/{len(grid)}] {label} ❌ {r['error'][-200:]}"); continue
+        rates = ", ".join(f"{k} {m['samples_per_sec']}/s" for k, m in r["models"].items() if "samples_per_sec" in m)
+        print(f"  [{i}/{len(grid)}] {label} | train {r['train_s']}s | RSS đỉnh {r['peak_rss_mb']}MB | {rates}")
+
+    ok = [r for r in runs if "error" not in r]
+    best = min(ok, key=lambda r: r["train_s"]) if ok else None
+    baseline = next((r for r in ok if r["config"] == DEFAULT_CONFIG), None)
+    recommended = None
+    if best:
+        c = best["config"]
+        recommended = {"config": c, "train_s": best["train_s"], "peak_rss_mb": best["peak_rss_mb"],
+                       "speedup_vs_default": round(baseline["train_s"] / best["train_s"], 2) if baseline and best["train_s"] else None,
+                       "env": {"TRAINER_THREADS": str(c["threads"]), "TRAIN_BATCH_SIZE": str(c["batch_size"]),
+                               "TF_ENABLE_ONEDNN_OPTS": c["onednn"], "LSTM_UNROLL": c["lstm_unroll"]}}
+    report = {"symbol": symbol, "interval": interval, "created_at": datetime.now(timezone.utc).isoformat(), "epochs": args.epochs,
+              "cores": n_cores, "runs": runs, "recommended": recommended}
+    out = args.out or os.path.join(BASE_DIR, "log", f"profile_sweep_{symbol}_{interval}.json")
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w") as f: json.dump(report, f, indent=2)
+
+    if recommended:
+        print(f"--- 🏁 Nhanh nhất: {' '.join(f'{k}={v}' for k, v in recommended['env'].items())} "
+              f"({recommended['train_s']}s{', x' + str(recommended['speedup_vs_default']) + ' so với mặc định' if recommended['speedup_vs_default'] else ''}) ---")
+    else:
+        print("--- ❌ Không có cấu hình nào chạy thành công ---")
+    print(f"📊 Báo cáo: {out}")
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,16 @@
-# binance_connector.py (v2.3.1 - Sửa lỗi cú pháp)
+# binance_connector.py (v2.5 - Quản lý lệnh OCO)
 """
-BinanceConnector – Robust & Production-Ready v2.3.1
+BinanceConnector – Robust & Production-Ready v2.5
 ==================================================
-Phiên bản sửa lỗi cú pháp trong hàm get_open_orders.
+Giữ snapshot số dư tài khoản trong connector, cập nhật cục bộ từ response lệnh.
+
+CHANGELOG v2.5:
+- MỚI: get_order(), get_order_list(), get_open_order_lists(), cancel_order_list() để live_trade
+  đặt / hủy-thay / đối soát lệnh OCO bảo vệ (SL/TP nằm sẵn trên sàn).
+
+CHANGELOG v2.4:
+- MỚI: get_cached_balance()/refresh_balance(): số dư chỉ gọi /api/v3/account (weight 20) tại các điểm
+  đối soát; lệnh MARKET cập nhật snapshot từ executedQty/cummulativeQuoteQty/fills (phí).
 
 CHANGELOG v2.3.1:
 - SỬA LỖI: Sửa lại cú pháp không hợp lệ trong định nghĩa hàm get_open_orders.
@@ -18,6 +26,7 @@ import random
 import decimal
 import logging
 import json
+import threading
 from datetime import datetime, timedelta
 from typing import Any, Dict, List, Literal, Optional, TypedDict
 from urllib.parse import urlencode
@@ -114,6 +123,11 @@ class BinanceConnector:
         self._exchange_info: Dict[str, Any] = {}
         self._last_exchange_info_sync: datetime = datetime.min
 
+        # Snapshot số dư: asset -> {"free": Decimal, "locked": Decimal}. None = phải đọc lại từ sàn.
+        self._balance_lock = threading.Lock()
+        self._balances: Optional[Dict[str, Dict[str, decimal.Decimal]]] = None
+        self._balances_synced_at: float = 0.0
+
         self._time_offset_ms: int = 0
         self._last_sync: datetime = datetime.min
         self._sync_time()
@@ -237,7 +251,51 @@ class BinanceConnector:
 
 
     def get_account_balance(self) -> AccountInfo:
-        return self._request("GET", "/api/v3/account", signed=True)
+        """Luôn gọi sàn và làm mới snapshot số dư."""
+        data = self._request("GET", "/api/v3/account", signed=True)
+        if data and "balances" in data:
+            with self._balance_lock:
+                self._balances = {b["asset"]: {"free": decimal.Decimal(b["free"]), "locked": decimal.Decimal(b["locked"])} for b in data["balances"]}
+                self._balances_synced_at = time.monotonic()
+        return data
+
+    # --- Snapshot số dư (1 lần đọc / phiên, cập nhật theo lệnh khớp) ---
+    def refresh_balance(self, max_age: float = 0.0) -> AccountInfo:
+        """Điểm đối soát: đọc lại từ sàn, trừ khi snapshot mới hơn `max_age` giây."""
+        with self._balance_lock:
+            fresh = self._balances is not None and time.monotonic() - self._balances_synced_at <= max_age
+        return self.get_cached_balance() if fresh else self.get_account_balance()
+
+    def get_cached_balance(self) -> AccountInfo:
+        """Số dư từ snapshot (cùng định dạng get_account_balance); chưa có snapshot thì đọc từ sàn."""
+        with self._balance_lock:
+            if self._balances is not None:
+                return {"balances": [{"asset": a, "free": format(v["free"], "f"), "locked": format(v["locked"], "f")} for a, v in self._balances.items()]}
+        return self.get_account_balance()
+
+    def invalidate_balance(self) -> None:
+        with self._balance_lock: self._balances = None
+
+    def apply_order_fill(self, order: Optional[Dict[str, Any]]) -> bool:
+        """Cộng/trừ phần khớp của 1 lệnh vào snapshot. Thiếu dữ liệu hoặc số dư âm -> bỏ snapshot (lần sau đọc lại sàn)."""
+        info = self.get_exchange_info().get(order.get("symbol", "")) if order else None
+        try:
+            qty, quote = decimal.Decimal(order["executedQty"]), decimal.Decimal(order["cummulativeQuoteQty"])
+            sign = 1 if order["side"] == "BUY" else -1
+            base_asset, quote_asset = info["baseAsset"], info["quoteAsset"]
+            fees = [(f["commissionAsset"], decimal.Decimal(f["commission"])) for f in order.get("fills") or []]
+        except (KeyError, TypeError, decimal.InvalidOperation):
+            self.invalidate_balance(); return False
+        with self._balance_lock:
+            if self._balances is None: return False
+            deltas = [(base_asset, sign * qty), (quote_asset, -sign * quote)] + [(asset, -fee) for asset, fee in fees]
+            for asset, delta in deltas:
+                entry = self._balances.setdefault(asset, {"free": decimal.Decimal(0), "locked": decimal.Decimal(0)})
+                entry["free"] += delta
+                if entry["free"] < 0:
+                    self.logger.warning("Snapshot số dư %s âm sau lệnh %s, sẽ đọc lại từ sàn.", asset, order.get("orderId"))
+                    self._balances = None; return False
+        return True
 
     # <<< SỬA LỖI CÚ PHÁP TẠI ĐÂY >>>
     def get_open_orders(self, symbol: Optional[str] = None) -> List[Order]:
@@ -246,8 +304,24 @@ class BinanceConnector:
 
     def cancel_order(self, symbol: str, order_id: int) -> Order:
         params = {"symbol": symbol, "orderId": order_id}
+        self.invalidate_balance()
         return self._request("DELETE", "/api/v3/order", params, signed=True)
 
+    def get_order(self, symbol: str, order_id: int) -> Order:
+        return self._request("GET", "/api/v3/order", {"symbol": symbol, "orderId": order_id}, signed=True)
+
+    # --- Order list (OCO) ---
+    def get_open_order_lists(self) -> List[Dict[str, Any]]:
+        return self._request("GET", "/api/v3/openOrderList", signed=True)
+
+    def get_order_list(self, order_list_id: int) -> Dict[str, Any]:
+        return self._request("GET", "/api/v3/orderList", {"orderListId": order_list_id}, signed=True)
+
+    def cancel_order_list(self, symbol: str, order_list_id: int) -> Dict[str, Any]:
+        params = {"symbol": symbol, "orderListId": order_list_id}
+        self.invalidate_balance()  # Số dư locked -> free
+        return self._request("DELETE", "/api/v3/orderList", params, signed=True)
+
     def place_market_order(
         self,
         symbol: str,
@@ -265,7 +339,13 @@ class BinanceConnector:
             params['quoteOrderQty'] = quote_order_qty
 
         self.logger.info("➡️ Đặt lệnh MARKET: %s", params)
-        return self._request("POST", "/api/v3/order", params, signed=True)
+        try:
+            order = self._request("POST", "/api/v3/order", params, signed=True)
+        except Exception:
+            self.invalidate_balance()  # Không rõ lệnh đã khớp hay chưa
+            raise
+        self.apply_order_fill(order)
+        return order
 
     def create_oco_order(
         self,
@@ -289,6 +369,7 @@ class BinanceConnector:
             "stopLimitTimeInForce": "GTC"
         }
         self.logger.info("➡️ Đặt lệnh OCO: %s", params)
+        self.invalidate_balance()  # OCO chuyển số dư free -> locked
         return self._request("POST", "/api/v3/order/oco", params, signed=True)
 
     def test_connection(self) -> bool:
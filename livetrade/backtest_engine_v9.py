@@ -10,9 +10,10 @@
 import os
 import sys
 import pandas as pd
-import joblib
 import warnings
 import json
+import glob
+import hashlib
 from datetime import datetime
 from typing import Dict, List, Tuple
 import numpy as np
@@ -31,8 +32,8 @@ from livetrade.live_trade import (
 from indicator import calculate_indicators
 from trade_advisor import get_advisor_decision, FULL_CONFIG as ADVISOR_BASE_CONFIG
 from trainer import get_full_price_history, add_features # Cần 2 hàm này để lấy và xử lý dữ liệu
-import tensorflow as tf
-from keras.models import load_model
+from ml_report import AIModelBundle, predict_history, release_keras_memory, model_fingerprint
+from model_server import request_server
 
 # --- Các hằng số Backtest ---
 SYMBOLS_TO_TEST = ["ETHUSDT", "AVAXUSDT", "INJUSDT", "LINKUSDT", "SUIUSDT"] # Rút gọn để test nhanh hơn
@@ -69,60 +70,42 @@ def determine_market_zone_for_backtest(symbol: str, interval: str, candle: pd.Se
 def prepare_ai_predictions_for_history(df: pd.DataFrame, symbol: str, interval: str) -> pd.DataFrame:
     """
     Hàm quan trọng: Chạy các model AI hiện tại trên dữ liệu lịch sử.
+    Ưu tiên model_server (model đã load sẵn), nếu không có thì load model tại chỗ.
     """
     print(f"  -> Chuẩn bị AI cho {symbol}-{interval}...")
-    try:
-        # Tải tất cả model và scaler
-        meta = json.load(open(os.path.join(DATA_DIR, f"meta_{symbol}_{interval}.json")))
-        scaler = joblib.load(os.path.join(DATA_DIR, f"scaler_{symbol}_{interval}.pkl"))
-        clf_lgbm = joblib.load(os.path.join(DATA_DIR, f"model_{symbol}_lgbm_clf_{interval}.pkl"))
-        reg_lgbm = joblib.load(os.path.join(DATA_DIR, f"model_{symbol}_lgbm_reg_{interval}.pkl"))
-        clf_lstm = load_model(os.path.join(DATA_DIR, f"model_{symbol}_lstm_clf_{interval}.keras"), compile=False)
-        reg_lstm = load_model(os.path.join(DATA_DIR, f"model_{symbol}_lstm_reg_{interval}.keras"), compile=False)
-        clf_trans = load_model(os.path.join(DATA_DIR, f"model_{symbol}_transformer_clf_{interval}.keras"), compile=False)
-        reg_trans = load_model(os.path.join(DATA_DIR, f"model_{symbol}_transformer_clf_{interval}.keras"), compile=False)
-    except Exception as e:
-        print(f"     Lỗi: Không tìm thấy đủ bộ model cho {symbol}-{interval}. Bỏ qua AI. Lỗi: {e}")
-        df['ai_prob_buy'], df['ai_prob_sell'], df['ai_pct'] = 50.0, 0.0, 0.0
-        return df
-
-    features_to_use = meta['features']
-    df_scaled = df.copy()
-    df_scaled[features_to_use] = scaler.transform(df[features_to_use])
-
-    ai_results = []
-    for i in range(len(df)):
-        if i < SEQUENCE_LENGTH:
-            ai_results.append({'prob_buy': 50.0, 'prob_sell': 0.0, 'pct': 0.0})
-            continue
-
-        # Dữ liệu cho LGBM (dòng cuối)
-        latest_row = df[features_to_use].iloc[[i]]
-        # Dữ liệu cho LSTM/Transformer (chuỗi 60 dòng)
-        sequence_data = df_scaled[features_to_use].iloc[i-SEQUENCE_LENGTH:i].values
-        sequence_to_predict = sequence_data[np.newaxis, :, :]
-
-        # Dự báo
-        lgbm_prob = clf_lgbm.predict_proba(latest_row)[0]
-        lgbm_reg = reg_lgbm.predict(latest_row)[0]
-        lstm_prob = clf_lstm.predict(sequence_to_predict, verbose=0)[0]
-        lstm_reg = reg_lstm.predict(sequence_to_predict, verbose=0)[0][0]
-        trans_prob = clf_trans.predict(sequence_to_predict, verbose=0)[0]
-        trans_reg = reg_trans.predict(sequence_to_predict, verbose=0)[0][0]
-
-        # Ensemble
-        prob_buy = (lgbm_prob[2] * 0.25) + (lstm_prob[2] * 0.35) + (trans_prob[2] * 0.40)
-        prob_sell = (lgbm_prob[0] * 0.25) + (lstm_prob[0] * 0.35) + (trans_prob[0] * 0.40)
-        pct = (lgbm_reg * 0.25) + (lstm_reg * 0.35) + (trans_reg * 0.40)
-        
-        ai_results.append({'prob_buy': prob_buy * 100, 'prob_sell': prob_sell * 100, 'pct': pct})
-
-    ai_df = pd.DataFrame(ai_results, index=df.index)
-    df['ai_prob_buy'] = ai_df['prob_buy']
-    df['ai_prob_sell'] = ai_df['prob_sell']
-    df['ai_pct'] = ai_df['pct']
-    
-    tf.keras.backend.clear_session()
+    ai_cols = ['ai_prob_buy', 'ai_prob_sell', 'ai_pct']
+    # Kết quả phụ thuộc bộ model + đoạn dữ liệu -> cache theo cả hai, backtest lặp lại không cần chạy model
+    span = f"{model_fingerprint(symbol, interval)}|{df.index[0]}|{df.index[-1]}|{len(df)}" if len(df) else ""
+    ai_cache_file = os.path.join(CACHE_DIR, f"ai-{symbol}-{interval}-{hashlib.sha1(span.encode()).hexdigest()[:16]}.parquet")
+    if os.path.exists(ai_cache_file):
+        cached = pd.read_parquet(ai_cache_file)
+        if cached.index.equals(df.index):
+            print("     Dùng dự đoán AI đã cache.")
+            df[ai_cols] = cached[ai_cols]
+            return df
+
+    ai_df = None
+    meta_path = os.path.join(DATA_DIR, f"meta_{symbol}_{interval}.json")
+    if os.path.exists(meta_path):
+        features_to_use = json.load(open(meta_path))['features']
+        resp = request_server({"op": "history", "symbol": symbol, "interval": interval,
+                               "rows": df[features_to_use].values.tolist()})
+        if resp is not None and resp.get("result"):
+            ai_df = pd.DataFrame(resp["result"], index=df.index)
+
+    if ai_df is None:
+        bundle = AIModelBundle(symbol, interval)
+        if not bundle.is_valid():
+            print(f"     Lỗi: Không tìm thấy đủ bộ model cho {symbol}-{interval}. Bỏ qua AI.")
+            df['ai_prob_buy'], df['ai_prob_sell'], df['ai_pct'] = 50.0, 0.0, 0.0
+            return df
+        ai_df = predict_history(bundle, df)
+        del bundle
+        release_keras_memory()
+
+    df[ai_cols] = ai_df[ai_cols]
+    for old in glob.glob(os.path.join(CACHE_DIR, f"ai-{symbol}-{interval}-*.parquet")): os.remove(old)
+    ai_df[ai_cols].to_parquet(ai_cache_file)
     return df
 
 
@@ -0,0 +1,133 @@
+# livetrade/check_zone_parity.py
+# -*- coding: utf-8 -*-
+"""
+Zone Parity - đối chiếu classify_market_zones / RollingQuantile của live_trade với cách chấm từng cặp cũ (pandas)
+
+- Sinh ngẫu nhiên khung nến (NaN đầu chuỗi như EMA/BB lúc khởi động, close == ema_50 để có dấu 0, thiếu cột,
+  độ dài < 30 / < 100 / 300) và bộ chỉ báo; so vùng tính theo lô với legacy_market_zone() (giữ nguyên văn hàm cũ).
+- Phân vị bb_width: so bb_width_low_quantile (RollingQuantile cập nhật dần) với `.iloc[-100:].quantile(0.2)`
+  qua các kịch bản nạp dữ liệu: thêm nến, nến đang chạy đổi giá, nạp lại lịch sử dài hơn, mất nến giữa chừng.
+- So sánh chính xác (==), không dùng sai số. Có sai khác -> in chi tiết và thoát mã 1.
+- Khác biệt có chủ đích: hàm cũ ném IndexError với khung < 10 nến (iloc[-10]), nên khung sinh ra luôn >= 10 nến.
+
+Dùng: python livetrade/check_zone_parity.py [--symbols 200] [--rounds 2000] [--seed 0]
+"""
+import os
+import sys
+import argparse
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import live_trade as lt
+
+INTERVAL_MS = {"1h": 3_600_000, "4h": 14_400_000, "1d": 86_400_000}
+
+def legacy_market_zone(symbol: str, interval: str) -> str:
+    """determine_market_zone_with_scoring trước khi chuyển sang classify_market_zones."""
+    indicators = lt.indicator_results.get(symbol, {}).get(interval, {})
+    df = lt.price_dataframes.get(symbol, {}).get(interval)
+    if not indicators or df is None or df.empty: return lt.NOISE_ZONE
+    scores = {lt.LEADING_ZONE: 0, lt.COINCIDENT_ZONE: 0, lt.LAGGING_ZONE: 0, lt.NOISE_ZONE: 0}
+    adx, bb_width, rsi_14, trend = indicators.get('adx', 20), indicators.get('bb_width', 0), indicators.get('rsi_14', 50), indicators.get('trend', "sideways")
+    if adx < 20: scores[lt.NOISE_ZONE] += 3
+    if 'ema_50' in df.columns and np.sign(df['close'].iloc[-30:] - df['ema_50'].iloc[-30:]).diff().ne(0).sum() > 4:
+        scores[lt.NOISE_ZONE] += 2
+    if adx > 25: scores[lt.LAGGING_ZONE] += 2.5
+    if trend == "uptrend": scores[lt.LAGGING_ZONE] += 2
+    if 'ema_20' in df.columns and 'ema_50' in df.columns and not df['ema_20'].isna().all() and not df['ema_50'].isna().all():
+        if trend == "uptrend" and df['ema_20'].iloc[-1] > df['ema_50'].iloc[-1] and df['ema_20'].iloc[-10] > df['ema_50'].iloc[-10]:
+            scores[lt.LAGGING_ZONE] += 1.5
+    if 'bb_width' in df.columns and not df['bb_width'].isna().all() and bb_width < df['bb_width'].iloc[-100:].quantile(0.20):
+        scores[lt.LEADING_ZONE] += 2.5
+    htf_trend = lt.indicator_results.get(symbol, {}).get('4h' if interval == '1h' else '1d', {}).get('trend', 'sideway')
+    if htf_trend == 'uptrend' and rsi_14 < 45: scores[lt.LEADING_ZONE] += 2
+    if indicators.get('breakout_signal', "none") != "none": scores[lt.COINCIDENT_ZONE] += 3
+    if indicators.get('macd_cross', "neutral") not in ["neutral", "no_cross"]: scores[lt.COINCIDENT_ZONE] += 2
+    if indicators.get('vol_ma20', 1) > 0 and indicators.get('volume', 0) > indicators.get('vol_ma20', 1) * 2:
+        scores[lt.COINCIDENT_ZONE] += 1.5
+    if adx > 28: scores[lt.LEADING_ZONE] -= 2
+    return max(scores, key=scores.get) if scores and any(v > 0 for v in scores.values()) else lt.NOISE_ZONE
+
+def make_frame(rng: np.random.Generator, n: int, interval: str) -> pd.DataFrame:
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, n)))
+    index = pd.to_datetime(1_600_000_000_000 + np.arange(n) * INTERVAL_MS[interval], unit="ms")
+    df = pd.DataFrame({"close": close}, index=index)
+    df["ema_20"] = df["close"].ewm(span=20, adjust=False).mean().where(np.arange(n) >= 19)
+    df["ema_50"] = df["close"].ewm(span=50, adjust=False).mean().where(np.arange(n) >= 49)
+    df["bb_width"] = 4 * df["close"].rolling(20).std() / df["close"].rolling(20).mean()
+    touch = rng.random(n) < 0.05  # close == ema_50 -> sign 0
+    df.loc[touch, "close"] = df.loc[touch, "ema_50"].fillna(df.loc[touch, "close"])
+    if rng.random() < 0.05: df["bb_width"] = np.nan
+    if rng.random() < 0.05: df["ema_20"] = np.nan
+    for col in ("ema_20", "ema_50", "bb_width"):
+        if rng.random() < 0.05: df = df.drop(columns=col)
+    return df
+
+def make_indicators(rng: np.random.Generator, df: pd.DataFrame) -> dict:
+    ind = {
+        "adx": float(rng.uniform(10, 40)), "rsi_14": float(rng.uniform(20, 80)),
+        "trend": str(rng.choice(["uptrend", "downtrend", "sideways"])),
+        "breakout_signal": str(rng.choice(["none", "none", "bullish"])),
+        "macd_cross": str(rng.choice(["neutral", "no_cross", "bullish", "bearish"])),
+        "volume": float(rng.uniform(0, 300)), "vol_ma20": float(rng.choice([0.0, 50.0, 100.0])),
+    }
+    if "bb_width" in df.columns: ind["bb_width"] = float(df["bb_width"].iloc[-1]) if rng.random() < 0.7 else float(rng.uniform(0, 0.1))
+    for key in list(ind):
+        if rng.random() < 0.03: del ind[key]  # Thiếu chỉ báo -> giá trị mặc định
+    return ind
+
+def check_zones(rng: np.random.Generator, n_symbols: int) -> int:
+    lt.indicator_results.clear(); lt.price_dataframes.clear(); lt._bb_width_quantiles.clear()
+    pairs = []
+    for i in range(n_symbols):
+        symbol = f"SYM{i}USDT"
+        for interval in INTERVAL_MS:
+            df = make_frame(rng, int(rng.choice([10, 25, 40, 120, 300])), interval)
+            lt.price_dataframes.setdefault(symbol, {})[interval] = df
+            if rng.random() > 0.02: lt.indicator_results.setdefault(symbol, {})[interval] = make_indicators(rng, df)
+            pairs.append((symbol, interval))
+    batch = lt.classify_market_zones(pairs)
+    mismatches = [(p, legacy_market_zone(*p), batch[p]) for p in pairs if legacy_market_zone(*p) != batch[p]]
+    for (symbol, interval), old, new in mismatches[:20]: print(f"  ❌ {symbol}-{interval}: cũ {old} | lô {new}")
+    counts = pd.Series([batch[p] for p in pairs]).value_counts().to_dict()
+    print(f"Vùng thị trường: {len(pairs)} cặp, {len(mismatches)} sai khác. Phân bố: {counts}")
+    return len(mismatches)
+
+def check_quantile_sync(rng: np.random.Generator, rounds: int) -> int:
+    master = make_frame(rng, 3000, "1h").assign(bb_width=lambda d: d["close"].rolling(20).std() / d["close"].rolling(20).mean())
+    master.loc[rng.random(len(master)) < 0.02, "bb_width"] = np.nan
+    key, start, end, mismatches = ("QTEST", "1h"), 500, 540, 0
+    lt._bb_width_quantiles.pop(key, None)
+    for step in range(rounds):
+        roll = rng.random()
+        if roll < 0.05: start = max(0, start - int(rng.integers(20, 200)))   # Nạp lại lịch sử dài hơn
+        elif roll < 0.10: start = min(end - 1, start + int(rng.integers(1, 50)))  # Cắt bớt đầu (tail(limit))
+        end = min(len(master), end + int(rng.integers(0, 3)))
+        df = master.iloc[start:end]
+        if rng.random() < 0.5:  # Nến đang chạy: giá trị cuối khác bản đã đóng
+            df = df.copy(); df.iloc[-1, df.columns.get_loc("bb_width")] = float(rng.uniform(0, 0.05))
+        if rng.random() < 0.03 and len(df) > 10:  # Mất vài nến giữa chừng
+            df = df.drop(df.index[rng.choice(np.arange(1, len(df) - 1), size=min(3, len(df) - 2), replace=False)])
+        got = lt.bb_width_low_quantile(*key, df)
+        want = df["bb_width"].iloc[-100:].quantile(0.20)
+        if not (got == want or (np.isnan(got) and np.isnan(want))):
+            mismatches += 1
+            if mismatches <= 20: print(f"  ❌ bước {step}: [{start}:{end}] RollingQuantile {got!r} | pandas {want!r}")
+        if end == len(master): break
+    print(f"Phân vị bb_width: {step + 1} lần cập nhật, {mismatches} sai khác.")
+    return mismatches
+
+def main():
+    parser = argparse.ArgumentParser(description="Đối chiếu phân vùng thị trường theo lô với cách chấm từng cặp cũ.")
+    parser.add_argument("--symbols", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    rng = np.random.default_rng(args.seed)
+    failures = check_zones(rng, args.symbols) + check_quantile_sync(rng, args.rounds)
+    print("✅ Khớp hoàn toàn." if failures == 0 else f"❌ {failures} sai khác.")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
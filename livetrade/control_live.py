@@ -35,9 +35,11 @@ try:
         indicator_results, price_dataframes,
         get_price_data_with_cache,
         close_trade_on_binance,
-        export_trade_history_to_csv
+        export_trade_history_to_csv,
+        STATE_BACKEND, SESSION_TEMP_KEYS, get_state_store
     )
     from trade_advisor import get_advisor_decision, FULL_CONFIG as ADVISOR_BASE_CONFIG
+    from state_lock import StateLock
 except ImportError as e:
     sys.exit(f"❌ Lỗi: Không thể import module cần thiết: {e}.")
 
@@ -46,6 +48,7 @@ DATA_DIR = os.path.join(BASE_DIR, "data")
 STATE_FILE = os.path.join(DATA_DIR, "live_trade_state.json")
 TRADE_HISTORY_CSV_FILE = os.path.join(DATA_DIR, "live_trade_history.csv")
 LOCK_FILE = STATE_FILE + ".lock"
+_state_lock = StateLock(LOCK_FILE)
 ENV_FILE = os.path.join(PROJECT_ROOT, ".env")
 VIETNAM_TZ = pytz.timezone('Asia/Ho_Chi_Minh')
 TACTICS = list(TACTICS_LAB.keys())
@@ -61,28 +64,31 @@ def format_price_dynamically(price: float) -> str:
     except (ValueError, TypeError):
         return "N/A"
 
-def acquire_lock(timeout=120):
-    start_time = time.time()
-    print("⏳ Đang chờ quyền truy cập file trạng thái...", end='', flush=True)
-    while os.path.exists(LOCK_FILE):
-        if time.time() - start_time > timeout:
-            print(f"\r❌ Lỗi: Không thể chiếm quyền điều khiển file sau {timeout} giây.")
-            return False
-        time.sleep(0.5); print(".", end='', flush=True)
-    try:
-        with open(LOCK_FILE, 'w') as f: f.write(str(os.getpid()))
-        print("\r✅ Đã có quyền truy cập.                                       ")
-        return True
-    except IOError as e: print(f"\r❌ Lỗi I/O khi tạo file lock: {e}"); return False
+def acquire_lock(timeout=120, shared=False):
+    if _state_lock.acquire(timeout=0, shared=shared): return True
+    holder = _state_lock.holder_pid()
+    print(f"⏳ Đang chờ quyền truy cập file trạng thái{f' (PID {holder} đang giữ)' if holder else ''}...", flush=True)
+    try: ok = _state_lock.acquire(timeout=timeout, shared=shared)
+    except OSError as e: print(f"❌ Lỗi I/O khi lấy file lock: {e}"); return False
+    print("✅ Đã có quyền truy cập." if ok else f"❌ Lỗi: Không thể chiếm quyền điều khiển file sau {timeout} giây.")
+    return ok
 
 def release_lock():
-    if os.path.exists(LOCK_FILE):
-        try: os.remove(LOCK_FILE)
-        except OSError as e: print(f"❌ Lỗi khi giải phóng file lock: {e}")
+    try: _state_lock.release()
+    except OSError as e: print(f"❌ Lỗi khi giải phóng file lock: {e}")
+
+def load_state_shared(timeout=30):
+    """Đọc state để xem (dashboard/báo cáo): khóa chia sẻ, chỉ chờ khi có phiên đang ghi."""
+    if not acquire_lock(timeout, shared=True): return None
+    try: return load_state()
+    finally: release_lock()
 
 def create_backup(state_file_path):
     try:
-        if os.path.exists(state_file_path):
+        if STATE_BACKEND == "sqlite":  # Sao lưu dạng JSON cũ, khôi phục bằng: python livetrade/state_store.py import <file>
+            get_state_store().export_json(state_file_path + ".backup")
+            print("📋 Đã tạo bản sao lưu an toàn (`.backup`).")
+        elif os.path.exists(state_file_path):
             shutil.copy2(state_file_path, state_file_path + ".backup")
             print("📋 Đã tạo bản sao lưu an toàn (`.backup`).")
     except Exception as e: print(f"⚠️ Cảnh báo: Không thể tạo file sao lưu. Lỗi: {e}")
@@ -116,6 +122,9 @@ def get_usdt_fund(bnc: BinanceConnector):
     except Exception as e: print(f"⚠️ Lỗi không thể lấy số dư USDT: {e}"); return 0.0, 0.0
 
 def load_state():
+    if STATE_BACKEND == "sqlite":
+        try: return get_state_store().load()
+        except Exception as e: print(f"❌ Lỗi khi đọc state (SQLite): {e}"); return None
     if not os.path.exists(STATE_FILE): return {"active_trades": [], "trade_history": []}
     try:
         with open(STATE_FILE, 'r', encoding='utf-8') as f:
@@ -125,8 +134,10 @@ def load_state():
 
 def save_state(state):
     try:
-        temp_keys = ['temp_newly_opened_trades', 'temp_newly_closed_trades', 'temp_money_spent_on_trades', 'temp_pnl_from_closed_trades', 'session_has_events']
-        state_to_save = {k: v for k, v in state.items() if k not in temp_keys}
+        if STATE_BACKEND == "sqlite":
+            changes = get_state_store().save(state, skip_keys=SESSION_TEMP_KEYS)
+            print(f"\n✅ Đã lưu lại trạng thái (SQLite, {changes} dòng thay đổi) thành công!"); return
+        state_to_save = {k: v for k, v in state.items() if k not in SESSION_TEMP_KEYS}
         with open(STATE_FILE, 'w', encoding='utf-8') as f: json.dump(state_to_save, f, indent=4, ensure_ascii=False)
         print("\n✅ Đã lưu lại trạng thái (state.json) thành công!")
     except Exception as e: print(f"❌ Lỗi khi lưu file trạng thái: {e}")
@@ -178,7 +189,7 @@ def refresh_market_data_for_panel():
 def show_full_dashboard(bnc: BinanceConnector):
     print("\n" + "="*80)
     print(f"📊 BÁO CÁO TỔNG QUAN & RADAR THỊ TRƯỜNG - {datetime.now(VIETNAM_TZ).strftime('%H:%M %d-%m-%Y')} 📊")
-    state = load_state()
+    state = load_state_shared()
     if not state:
         print("❌ Không thể tải file trạng thái.")
         return
@@ -389,7 +400,7 @@ def view_csv_history():
 
 def manual_report(bnc: BinanceConnector):
     print("\n" + "📜" * 10 + " TẠO BÁO CÁO THỦ CÔNG " + "📜" * 10)
-    state = load_state()
+    state = load_state_shared()
     if not state: print("❌ Không thể tải file trạng thái."); return
     print("... Đang tính toán dữ liệu báo cáo...")
     available_usdt, total_usdt = get_usdt_fund(bnc)
@@ -586,6 +597,7 @@ def close_manual_trade(bnc: BinanceConnector):
             return
 
         create_backup(STATE_FILE)
+        bnc.refresh_balance(max_age=30)  # Số dư có thể đã cũ trong lúc chờ người dùng chọn lệnh
         print(f"⚡️ Đang yêu cầu đóng lệnh {trade_to_close['symbol']}...")
 
         # Hàm close_trade_on_binance bên live_trade.py sẽ tự lo việc ghi CSV
@@ -621,6 +633,7 @@ def close_all_trades(bnc: BinanceConnector):
             return
 
         create_backup(STATE_FILE)
+        bnc.refresh_balance(max_age=30)
         closed_for_csv = []
         for trade in list(valid_trades):
             if close_trade_on_binance(bnc, trade, "Panel Close All", state, close_pct=1.0):
@@ -25,13 +25,21 @@ import sys
 import json
 import uuid
 import time
+import signal
+import threading
+import queue
+import multiprocessing
 import requests
 import pytz
 import pandas as pd
 from datetime import datetime, timedelta, timezone
-from typing import Dict, List, Any, Tuple, Optional, Literal
+from typing import Callable, Dict, List, Any, Tuple, Optional, Literal
 from dotenv import load_dotenv
 import traceback
+from contextlib import contextmanager, nullcontext
+from collections import deque
+from bisect import bisect_left, insort
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, TimeoutError as FuturesTimeoutError
 import numpy as np
 import ta
 
@@ -44,7 +52,10 @@ sys.path.append(PROJECT_ROOT)
 try:
     from binance_connector import BinanceConnector
     from indicator import calculate_indicators
-    from trade_advisor import get_advisor_decision, FULL_CONFIG as ADVISOR_BASE_CONFIG
+    from trade_advisor import get_advisor_decision, rescore_decision, FULL_CONFIG as ADVISOR_BASE_CONFIG
+    from state_store import StateStore
+    from state_lock import StateLock
+    from trigger_engine import TriggerEngine, PriceStream, TradeLevels, TriggerHit
 except ImportError as e:
     sys.exit(f"Lỗi: Không thể import module cần thiết: {e}.")
 
@@ -65,6 +76,11 @@ GENERAL_CONFIG = {
     "CRON_JOB_INTERVAL_MINUTES": 1,           # [Hệ thống] - Tần suất chạy bot, phải khớp với crontab của bạn.
     "PENDING_TRADE_RETRY_LIMIT": 3,           # [Hệ thống] - Số lần thử lại nếu lệnh MUA thất bại.
     "CLOSE_TRADE_RETRY_LIMIT": 3,             # [Hệ thống] - Số lần thử lại nếu lệnh BÁN thất bại.
+    "EXIT_MAX_WORKERS": 5,                    # [Hệ thống] - Số lệnh đóng (SL/TP/EC) gửi lên sàn song song trong 1 phiên.
+    "ORDER_RATE_LIMIT_PER_SEC": 8,            # [Sàn giao dịch] - Giãn cách lệnh gửi đi (Binance giới hạn 10 lệnh/giây/tài khoản).
+    "HEAVY_IO_WORKERS": 6,                    # [Hệ thống] - Số luồng tải nến song song khi quét thị trường.
+    "HEAVY_COMPUTE_WORKERS": 0,               # [Hệ thống] - Số tiến trình tính chỉ báo (0 = số core - 1).
+    "HEAVY_COMPUTE_TIMEOUT_SECONDS": 120,     # [Hệ thống] - Quá hạn mà process pool chưa tính xong thì bỏ pool, tính tuần tự.
     "CRITICAL_ERROR_ALERT_COOLDOWN_MINUTES": 45, # [Hệ thống] - Chờ 45p trước khi báo lại lỗi nghiêm trọng giống nhau.
     "RECONCILIATION_QTY_THRESHOLD": 0.95,     # [Hệ thống] - Ngưỡng phát hiện lệnh bị đóng thủ công.
     "MIN_ORDER_VALUE_USDT": 11.0,             # [Sàn giao dịch] - Giá trị lệnh tối thiểu của Binance.
@@ -84,6 +100,14 @@ GENERAL_CONFIG = {
         }
     },
 
+    # --- OCO bảo vệ trên sàn (SL/TP vẫn khớp khi bot không chạy) ---
+    "EXCHANGE_OCO_PROTECTION": {
+        "ENABLED": False,                     # [An toàn] - Mỗi lệnh đang mở có 1 OCO bán (TP limit + SL stop-limit) nằm sẵn trên sàn.
+        "STOP_LIMIT_BUFFER_PCT": 0.5,         # [Sàn giao dịch] - Giá limit của chân SL thấp hơn stopPrice 0.5% để vẫn khớp khi giá rơi nhanh.
+        "REPLACE_MIN_SL_CHANGE_PCT": 0.15,    # [Hệ thống] - Trailing SL chỉ hủy/đặt lại OCO khi SL dịch > 0.15% (đỡ tốn lượt gọi API).
+        "RETRY_AFTER_MINUTES": 15,            # [Hệ thống] - Đặt OCO lỗi thì chờ 15 phút mới thử lại cho lệnh đó.
+    },
+
     # --- Động cơ Vốn Năng động ---
     "DEPOSIT_DETECTION_MIN_USD": 10.0,
     "DEPOSIT_DETECTION_THRESHOLD_PCT": 0.01,
@@ -318,7 +342,7 @@ TACTICS_LAB = {
         "ENABLE_PARTIAL_TP": True, "TP1_RR_RATIO": 1.0, "TP1_PROFIT_PCT": 0.5, # Chốt phần lớn ở TP1.
         "USE_MOMENTUM_FILTER": False,                 # [LOGIC] - Khi bắt đáy, động lượng thường đang yếu.
         "USE_EXTREME_ZONE_FILTER": True,
-        "USE_PRICE_ACTION_MOMENTUM": FALSE,
+        "USE_PRICE_ACTION_MOMENTUM": False,
     },
     # == TACTIC 4: Chuyên Gia Chớp Nhoáng ==
     "AI_Aggressor": {
@@ -359,39 +383,41 @@ VIETNAM_TZ = pytz.timezone('Asia/Ho_Chi_Minh')
 LOG_FILE = os.path.join(LIVE_DATA_DIR, "live_trade_log.txt")
 ERROR_LOG_FILE = os.path.join(LIVE_DATA_DIR, "error_log.txt")
 STATE_FILE = os.path.join(LIVE_DATA_DIR, "live_trade_state.json")
+STATE_DB_FILE = os.path.join(LIVE_DATA_DIR, "live_trade_state.db")
+STATE_BACKEND = os.getenv("LIVE_STATE_BACKEND", "sqlite").lower()  # "sqlite" (ghi từng dòng thay đổi) | "json" (file cũ)
 LOCK_FILE = STATE_FILE + ".lock"
 TRADE_HISTORY_CSV_FILE = os.path.join(LIVE_DATA_DIR, "live_trade_history.csv")
+DAEMON_PID_FILE = os.path.join(LIVE_DATA_DIR, "live_trade_daemon.pid")
+DAEMON_TICK_OFFSET_SECONDS = 2  # Chạy phiên ở giây thứ 2 của mỗi phút (như cron + thời gian khởi động)
+BALANCE_SNAPSHOT_MAX_AGE_SECONDS = 10  # Snapshot số dư mới hơn mức này coi như vừa đối soát
+TRIGGER_ENGINE_ENABLED = os.getenv("LIVE_TRIGGER_ENGINE", "1") == "1"  # Daemon: bắt SL/TP theo websocket giữa các phiên
+TRIGGER_RETRY_SECONDS = 5       # Hit chưa xử lý được (chưa có connector / state đang bị khóa) thì chờ rồi mới bắt lại
+DAEMON_MODE = False             # True khi chạy `live_trade.py --daemon`: connector, state, dữ liệu giá được giữ trong RAM
 indicator_results, price_dataframes = {}, {}
 SESSION_TEMP_KEYS = ['temp_newly_opened_trades', 'temp_newly_closed_trades', 'temp_money_spent_on_trades', 'temp_pnl_from_closed_trades', 'session_has_events']
 
-# --- CÁC HÀM KHÓA FILE (FILE LOCKING) ---
-def acquire_lock(timeout=55):
-    LOCK_STALE_MINUTES = 5
-    if os.path.exists(LOCK_FILE):
-        try:
-            file_mod_time = os.path.getmtime(LOCK_FILE)
-            if (time.time() - file_mod_time) / 60 > LOCK_STALE_MINUTES:
-                log_message(f"⚠️ Phát hiện file lock tồn tại hơn {LOCK_STALE_MINUTES} phút. Tự động xóa.")
-                release_lock()
-        except Exception as e:
-            log_error(f"Lỗi khi kiểm tra file lock bị kẹt: {e}")
-    start_time = time.time()
-    while os.path.exists(LOCK_FILE):
-        if time.time() - start_time > timeout:
-            timestamp = datetime.now(VIETNAM_TZ).strftime('%Y-%m-%d %H:%M:%S')
-            log_entry = f"[{timestamp}] (LiveTrade) ⏳ Bỏ qua phiên này, file trạng thái đang được khóa."
-            print(log_entry)
-            with open(LOG_FILE, "a", encoding="utf-8") as f: f.write(log_entry + "\n")
-            return False
-        time.sleep(1)
+# --- CÁC HÀM KHÓA FILE (flock: kernel nhả khóa khi tiến trình chết, người chờ được đánh thức ngay) ---
+class _ThreadStateLock(threading.local):
+    """Mỗi luồng 1 StateLock (1 file descriptor riêng): flock giữa 2 fd của cùng tiến trình vẫn loại trừ nhau,
+    nên luồng trigger của daemon và phiên chính dùng chung 1 khóa state như 2 tiến trình."""
+    def __init__(self): self.lock = StateLock(LOCK_FILE)
+
+_state_locks = _ThreadStateLock()
+
+def acquire_lock(timeout=55, shared=False):
     try:
-        with open(LOCK_FILE, 'w') as f: f.write(str(os.getpid()))
-        return True
-    except IOError: return False
+        if _state_locks.lock.acquire(timeout=timeout, shared=shared): return True
+    except OSError as e:
+        log_error(f"Lỗi khi lấy file lock: {e}"); return False
+    holder = _state_locks.lock.holder_pid()
+    timestamp = datetime.now(VIETNAM_TZ).strftime('%Y-%m-%d %H:%M:%S')
+    log_entry = f"[{timestamp}] (LiveTrade) ⏳ Bỏ qua phiên này, file trạng thái đang được khóa{f' (PID {holder})' if holder else ''}."
+    print(log_entry)
+    with open(LOG_FILE, "a", encoding="utf-8") as f: f.write(log_entry + "\n")
+    return False
 
 def release_lock():
-    try:
-        if os.path.exists(LOCK_FILE): os.remove(LOCK_FILE)
+    try: _state_locks.lock.release()
     except OSError as e: log_error(f"Lỗi khi giải phóng file lock: {e}")
 
 # --- CÁC HÀM TIỆN ÍCH ---
@@ -435,6 +461,40 @@ def save_json_file(path: str, data: Any):
     with open(temp_path, "w", encoding="utf-8") as f: json.dump(data_to_save, f, indent=4, ensure_ascii=False)
     os.replace(temp_path, path)
 
+# --- STATE (SQLite WAL mặc định, JSON cũ khi LIVE_STATE_BACKEND=json) ---
+# Daemon giữ bản đã lưu trong RAM, chỉ đọc lại khi state bị sửa từ bên ngoài (vd: control_live).
+DEFAULT_STATE = {"active_trades": [], "trade_history": [], "initial_capital": 0.0, "money_spent_on_trades_last_session": 0.0, "pnl_closed_last_session": 0.0}
+_saved_state: Dict[str, Any] = {}  # {"key": phiên bản state sau lần lưu, "data": state}
+_state_store: Optional[StateStore] = None
+
+def get_state_store() -> StateStore:
+    """1 kết nối SQLite / tiến trình. Lần đầu tự nhập live_trade_state.json cũ nếu DB rỗng."""
+    global _state_store
+    if _state_store is None: _state_store = StateStore(STATE_DB_FILE, legacy_json=STATE_FILE)
+    return _state_store
+
+def _state_file_key() -> Optional[Tuple[int, int]]:
+    if STATE_BACKEND == "sqlite": return get_state_store().version(), 0  # data_version chỉ đổi khi kết nối KHÁC commit
+    try:
+        st = os.stat(STATE_FILE)
+        return st.st_mtime_ns, st.st_size
+    except OSError: return None
+
+def load_state() -> Dict:
+    # pop: phiên kết thúc mà không lưu thì phiên sau đọc lại, giống hệt khi chạy bằng cron
+    saved = _saved_state.pop("data", None)
+    if DAEMON_MODE and saved is not None and _saved_state.pop("key", None) == _state_file_key():
+        for key in SESSION_TEMP_KEYS: saved.pop(key, None)
+        return saved
+    default = {k: (v.copy() if isinstance(v, list) else v) for k, v in DEFAULT_STATE.items()}
+    if STATE_BACKEND == "sqlite": return get_state_store().load(default)
+    return load_json_file(STATE_FILE, default)
+
+def save_state(state: Dict):
+    if STATE_BACKEND == "sqlite": get_state_store().save(state, skip_keys=SESSION_TEMP_KEYS)
+    else: save_json_file(STATE_FILE, state)
+    if DAEMON_MODE: _saved_state.update(key=_state_file_key(), data=state)
+
 _last_discord_send_time = None
 def can_send_discord_now(force: bool = False) -> bool:
     global _last_discord_send_time
@@ -482,7 +542,7 @@ def get_realtime_price(symbol: str) -> Optional[float]:
 
 def get_usdt_fund(bnc: BinanceConnector) -> Tuple[float, float]:
     try:
-        balance_info = bnc.get_account_balance()
+        balance_info = bnc.get_cached_balance()  # Snapshot phiên, đã cập nhật theo các lệnh khớp
         usdt_balance = next((b for b in balance_info.get("balances", []) if b["asset"] == "USDT"), None)
         if usdt_balance: return float(usdt_balance['free']), float(usdt_balance['free']) + float(usdt_balance['locked'])
     except Exception as e:
@@ -605,38 +665,215 @@ def get_price_data_with_cache(symbol: str, interval: str, limit: int) -> Optiona
         return final_df
     return existing_df if existing_df is not None else None
 
-def close_trade_on_binance(bnc: BinanceConnector, trade: Dict, reason: str, state: Dict, close_pct: float = 1.0) -> bool:
+class OrderRateLimiter:
+    """Giãn cách các lệnh gửi lên sàn (dùng chung giữa các luồng): tối đa `per_second` lệnh/giây."""
+    def __init__(self, per_second: float):
+        self.interval = 1.0 / max(per_second, 1e-6)
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now: time.sleep(slot - now)
+
+ORDER_RATE_LIMITER = OrderRateLimiter(GENERAL_CONFIG.get("ORDER_RATE_LIMIT_PER_SEC", 8))
+
+def run_order_requests(request: Callable[[Any], Any], items: List[Any]) -> List[Tuple[Any, Optional[Exception]]]:
+    """Gửi 1 yêu cầu lệnh cho mỗi phần tử song song (giới hạn luồng + tốc độ), giữ thứ tự. Không đụng tới state."""
+    def call(item):
+        ORDER_RATE_LIMITER.wait()
+        try: return request(item), None
+        except Exception as e: return None, e
+    if len(items) <= 1: return [call(i) for i in items]
+    with ThreadPoolExecutor(max_workers=min(len(items), GENERAL_CONFIG.get("EXIT_MAX_WORKERS", 5))) as pool:
+        return list(pool.map(call, items))
+
+# --- OCO BẢO VỆ TRÊN SÀN: trade['oco'] = {order_list_id, quantity, trade_quantity, sl, tp} của OCO đang nằm trên Binance ---
+def settle_finished_oco(bnc: BinanceConnector, trade: Dict, state: Dict) -> bool:
+    """OCO của lệnh không còn mở trên sàn: 1 chân đã khớp -> ghi như lệnh đóng (SL_OCO/TP_OCO);
+    bị hủy mà không khớp -> bỏ đánh dấu để phiên sau đặt lại. Trả về True nếu lệnh đã đóng toàn bộ."""
+    symbol, oco = trade['symbol'], trade.pop('oco')
+    try:
+        order_list = bnc.get_order_list(oco['order_list_id'])
+        legs = [bnc.get_order(symbol, leg['orderId']) for leg in order_list.get('orders', [])]
+    except Exception as e:
+        trade['oco'] = oco  # Giữ lại, phiên sau kiểm tra tiếp
+        log_error(f"Không đọc được trạng thái OCO {symbol} (#{oco['order_list_id']}).", error_details=str(e), state=state)
+        return False
+    if not any(float(o.get('executedQty', 0)) > 0 for o in legs):
+        log_message(f"ℹ️ OCO {symbol} (#{oco['order_list_id']}) đã bị hủy trên sàn mà không khớp. Sẽ đặt lại.", state=state)
+        return False
+    return record_oco_fill(bnc, trade, legs, state)
+
+def record_oco_fill(bnc: BinanceConnector, trade: Dict, legs: List[Dict], state: Dict) -> bool:
+    """Ghi phần đã khớp của OCO (chân có executedQty > 0) như lệnh đóng SL_OCO/TP_OCO, kể cả khớp một phần trước khi bị hủy.
+    Trả về True nếu lệnh đã đóng toàn bộ."""
+    filled = next((o for o in legs if float(o.get('executedQty', 0)) > 0), None)
+    if filled is None: return False
+    bnc.invalidate_balance()  # Phần khớp nằm trong số dư locked, không cộng trừ snapshot được
+    reason = "SL_OCO" if filled.get('type') == "STOP_LOSS_LIMIT" else "TP_OCO"
+    qty_in_state, executed_qty = float(trade.get('quantity', 0)), float(filled['executedQty'])
+    close_pct = 1.0 if executed_qty >= qty_in_state * GENERAL_CONFIG.get("RECONCILIATION_QTY_THRESHOLD", 0.95) else executed_qty / qty_in_state
+    log_message(f"🛡️ OCO {trade['symbol']} đã khớp trên sàn ({reason}): {executed_qty:.8f} @ ~{format_price_dynamically(float(filled['cummulativeQuoteQty']) / executed_qty)}", state=state)
+    return apply_close_result(trade, reason, state, close_pct, filled) and close_pct >= 0.999
+
+def settle_exchange_protection(bnc: BinanceConnector, state: Dict):
+    """Đối soát: OCO nào không còn mở trên sàn thì xử lý (khớp = đóng lệnh, bị hủy = đặt lại sau)."""
+    protected = [t for t in state.get('active_trades', []) if t.get('oco')]
+    if not protected: return
+    try: open_ids = {ol['orderListId'] for ol in bnc.get_open_order_lists()}
+    except Exception as e:
+        log_error("Không lấy được danh sách OCO đang mở để đối soát.", error_details=str(e), state=state); return
+    for trade in protected:
+        if trade['oco']['order_list_id'] not in open_ids: settle_finished_oco(bnc, trade, state)
+
+def release_exchange_protection(bnc: BinanceConnector, trades: List[Dict], state: Dict) -> List[Dict]:
+    """Trước khi bán MARKET: hủy OCO của các lệnh (OCO khóa số dư, prepare_close_quantity chỉ thấy số dư free).
+    Trả về các lệnh bán được. OCO đã khớp thì ghi đóng luôn; hủy lỗi thì hoãn bán lệnh đó tới phiên sau."""
+    protected = [t for t in trades if t.get('oco')]
+    if not protected: return list(trades)
+    try: open_ids = {ol['orderListId'] for ol in bnc.get_open_order_lists()}
+    except Exception as e:
+        log_error("Không lấy được danh sách OCO đang mở. Hoãn đóng các lệnh có OCO.", error_details=str(e), state=state)
+        return [t for t in trades if not t.get('oco')]
+    to_cancel = [t for t in protected if t['oco']['order_list_id'] in open_ids]
+    results = run_order_requests(lambda t: bnc.cancel_order_list(t['symbol'], t['oco']['order_list_id']), to_cancel)
+    cancel_results = {t['trade_id']: result for t, result in zip(to_cancel, results)}
+    sellable = []
+    for trade in trades:
+        if not trade.get('oco'): sellable.append(trade)
+        elif trade['trade_id'] in cancel_results:
+            response, error = cancel_results[trade['trade_id']]
+            if error is None:
+                trade.pop('oco')  # Phần đã khớp trước khi hủy nằm trong orderReports -> ghi trước khi bán phần còn lại
+                if not record_oco_fill(bnc, trade, (response or {}).get('orderReports', []), state): sellable.append(trade)
+            else: log_error(f"Không hủy được OCO {trade['symbol']} (có thể vừa khớp). Hoãn đóng lệnh.", error_details=str(error), state=state)
+        elif not settle_finished_oco(bnc, trade, state) and not trade.get('oco'): sellable.append(trade)
+    return sellable
+
+def desired_oco_levels(bnc: BinanceConnector, trade: Dict) -> Tuple[float, float]:
+    """(SL, TP) đã làm tròn theo tickSize của sàn."""
+    return float(bnc._format_price(trade['symbol'], trade['sl'])), float(bnc._format_price(trade['symbol'], trade['tp']))
+
+def oco_needs_replace(bnc: BinanceConnector, trade: Dict, cfg: Dict) -> bool:
+    oco = trade['oco']
+    sl, tp = desired_oco_levels(bnc, trade)
+    sl_change_pct = abs(sl - oco['sl']) / oco['sl'] * 100 if oco['sl'] > 0 else float('inf')
+    return (tp != oco['tp'] or sl_change_pct > cfg.get("REPLACE_MIN_SL_CHANGE_PCT", 0.15)
+            or float(trade['quantity']) != oco['trade_quantity'])
+
+def sync_exchange_protection(bnc: BinanceConnector, state: Dict):
+    """Đưa OCO trên sàn về đúng SL/TP/số lượng hiện tại của từng lệnh (trailing SL, TP1, DCA, đóng một phần):
+    gom tất cả lệnh cần hủy -> hủy song song -> đọc số dư 1 lần -> đặt lại song song."""
+    cfg = GENERAL_CONFIG.get("EXCHANGE_OCO_PROTECTION", {})
+    enabled = cfg.get("ENABLED", False)
+    trades = state.get('active_trades', [])
+    if not enabled and not any(t.get('oco') for t in trades): return
+    now = datetime.now(VIETNAM_TZ)
+    to_cancel = [t for t in trades if t.get('oco') and (not enabled or oco_needs_replace(bnc, t, cfg))]
+    results = run_order_requests(lambda t: bnc.cancel_order_list(t['symbol'], t['oco']['order_list_id']), to_cancel)
+    for trade, (response, error) in zip(to_cancel, results):
+        if error is None: trade.pop('oco'); record_oco_fill(bnc, trade, (response or {}).get('orderReports', []), state)
+        else: log_error(f"Không hủy được OCO cũ của {trade['symbol']} (có thể vừa khớp, sẽ đối soát phiên sau).", error_details=str(error), state=state)
+    if not enabled: return
+    trades = state.get('active_trades', [])  # Lệnh đã đóng hết do OCO khớp trước khi hủy không còn trong danh sách
+    to_place = [t for t in trades if not t.get('oco') and not (t.get('oco_retry_after') and now < datetime.fromisoformat(t['oco_retry_after']))]
+    if not to_place: return
+    try: balances = {b['asset']: float(b['free']) for b in bnc.get_cached_balance().get("balances", [])}
+    except Exception as e:
+        log_error("Không lấy được số dư để đặt OCO.", error_details=str(e), state=state); return
+    min_order_value = GENERAL_CONFIG.get("MIN_ORDER_VALUE_USDT", 11.0)
+    buffer = cfg.get("STOP_LIMIT_BUFFER_PCT", 0.5) / 100
+    jobs = []
+    for trade in to_place:
+        asset_code = trade['symbol'].replace("USDT", "")
+        quantity = float(bnc._format_quantity(trade['symbol'], min(float(trade['quantity']), balances.get(asset_code, 0.0))))
+        sl, tp = desired_oco_levels(bnc, trade)
+        if quantity * sl * (1 - buffer) < min_order_value: continue  # Quá nhỏ để đặt lệnh, để bot tự quản lý SL/TP
+        balances[asset_code] = balances.get(asset_code, 0.0) - quantity
+        jobs.append((trade, quantity, sl, tp))
+    results = run_order_requests(lambda job: bnc.create_oco_order(symbol=job[0]['symbol'], side="SELL", quantity=job[1], price=job[3],
+                                                                    stop_price=job[2], stop_limit_price=job[2] * (1 - buffer)), jobs)
+    for (trade, quantity, sl, tp), (response, error) in zip(jobs, results):
+        if error is None and response and 'orderListId' in response:
+            trade['oco'] = {"order_list_id": response['orderListId'], "quantity": quantity, "trade_quantity": float(trade['quantity']), "sl": sl, "tp": tp}
+            trade.pop('oco_retry_after', None)
+        else:
+            trade['oco_retry_after'] = (now + timedelta(minutes=cfg.get("RETRY_AFTER_MINUTES", 15))).isoformat()
+            log_error(f"Không đặt được OCO bảo vệ cho {trade['symbol']} (SL {format_price_dynamically(sl)}, TP {format_price_dynamically(tp)}).", error_details=str(error or response), state=state)
+
+def prepare_close_quantity(bnc: BinanceConnector, trade: Dict, state: Dict, close_pct: float = 1.0, reserved: Optional[Dict[str, float]] = None) -> float:
+    """Đối soát số lượng cần bán với số dư trên sàn. `reserved`: số lượng đã dành cho các lệnh đóng khác cùng đợt (cùng coin)."""
     symbol = trade['symbol']
-    side = "SELL"
     qty_in_state = float(trade.get('quantity', 0))
     final_quantity_to_sell = 0.0
     try:
         asset_code = symbol.replace("USDT", "")
-        balances = bnc.get_account_balance().get("balances", [])
+        balances = bnc.get_cached_balance().get("balances", [])
         asset_on_binance = next((b for b in balances if b["asset"] == asset_code), None)
-        if not asset_on_binance or float(asset_on_binance.get('free', 0)) <= 0:
+        qty_on_binance = float(asset_on_binance.get('free', 0)) - (reserved or {}).get(asset_code, 0.0) if asset_on_binance else 0.0
+        if qty_on_binance <= 0:
             log_error(f"Lỗi Đối soát: Không tìm thấy {asset_code} hoặc số dư = 0 trên sàn. Hủy đóng lệnh.", state=state)
-            return False
-        qty_on_binance = float(asset_on_binance['free'])
+            return 0.0
         log_message(f"ℹ️ Đối soát {symbol}: Bot ghi {qty_in_state:.8f}, Sàn có {qty_on_binance:.8f}", state)
         final_quantity_to_sell = min(qty_in_state, qty_on_binance) * close_pct
     except Exception as e:
         log_error(f"Lỗi API nghiêm trọng khi lấy số dư {symbol} để đóng lệnh. Hủy để đảm bảo an toàn.", error_details=str(e), state=state, send_to_discord=True)
-        return False
+        return 0.0
     if final_quantity_to_sell <= 0:
         log_message(f"⚠️ Bỏ qua đóng lệnh {symbol} vì số lượng tính toán là zero hoặc âm.", state=state)
-        return False
+        return 0.0
+    if reserved is not None: reserved[asset_code] = reserved.get(asset_code, 0.0) + final_quantity_to_sell
+    return final_quantity_to_sell
+
+def submit_close_order(bnc: BinanceConnector, symbol: str, quantity: float) -> Tuple[Optional[Dict], Optional[Exception]]:
+    """Chỉ gửi lệnh MARKET SELL (an toàn khi chạy song song): không đụng tới state, không ghi log."""
+    ORDER_RATE_LIMITER.wait()
+    try: return bnc.place_market_order(symbol=symbol, side="SELL", quantity=quantity), None
+    except Exception as e: return None, e
+
+def close_trade_on_binance(bnc: BinanceConnector, trade: Dict, reason: str, state: Dict, close_pct: float = 1.0) -> bool:
+    if not release_exchange_protection(bnc, [trade], state):
+        return all(t['trade_id'] != trade['trade_id'] for t in state.get('active_trades', []))  # True nếu OCO đã đóng lệnh
+    quantity = prepare_close_quantity(bnc, trade, state, close_pct)
+    if quantity <= 0: return False
+    market_close_order, error = submit_close_order(bnc, trade['symbol'], quantity)
+    return apply_close_result(trade, reason, state, close_pct, market_close_order, error)
+
+def close_trades_concurrently(bnc: BinanceConnector, exits: List[Tuple[Dict, str]], state: Dict) -> set:
+    """Đóng toàn bộ nhiều lệnh trong cùng 1 tick: đối soát tuần tự -> gửi lệnh song song (giới hạn luồng + tốc độ)
+    -> ghi state tuần tự theo đúng thứ tự `exits`. Trả về trade_id của các lệnh đã đóng."""
+    sellable = {t['trade_id'] for t in release_exchange_protection(bnc, [trade for trade, _ in exits], state)}
+    active_ids = {t['trade_id'] for t in state.get('active_trades', [])}
+    closed_by_oco = {trade['trade_id'] for trade, _ in exits if trade['trade_id'] not in active_ids}
+    reserved: Dict[str, float] = {}
+    jobs = [(trade, reason, qty) for trade, reason in exits
+            if trade['trade_id'] in sellable and (qty := prepare_close_quantity(bnc, trade, state, 1.0, reserved)) > 0]
+    if not jobs: return closed_by_oco
+    submit = lambda job: submit_close_order(bnc, job[0]['symbol'], job[2])
+    if len(jobs) == 1: results = [submit(jobs[0])]
+    else:
+        with ThreadPoolExecutor(max_workers=min(len(jobs), GENERAL_CONFIG.get("EXIT_MAX_WORKERS", 5))) as pool:
+            results = list(pool.map(submit, jobs))  # map giữ nguyên thứ tự
+    return closed_by_oco | {trade['trade_id'] for (trade, reason, _), (order, error) in zip(jobs, results)
+                            if apply_close_result(trade, reason, state, 1.0, order, error)}
+
+def apply_close_result(trade: Dict, reason: str, state: Dict, close_pct: float, market_close_order: Optional[Dict], error: Optional[Exception] = None) -> bool:
+    """Ghi kết quả lệnh đóng vào trade/state (PnL, lịch sử, thống kê, cooldown, CSV). Luôn chạy trên luồng chính."""
+    symbol = trade['symbol']
+    qty_in_state = float(trade.get('quantity', 0))
     trade.setdefault('close_retry_count', 0)
-    try:
-        market_close_order = bnc.place_market_order(symbol=symbol, side=side, quantity=final_quantity_to_sell)
-        trade['close_retry_count'] = 0
-    except Exception as e:
+    if error is not None:
         trade['close_retry_count'] += 1
-        log_error(f"Lỗi kết nối khi đóng lệnh {symbol} (Lần thử #{trade['close_retry_count']})", error_details=str(e), state=state)
+        log_error(f"Lỗi kết nối khi đóng lệnh {symbol} (Lần thử #{trade['close_retry_count']})", error_details=str(error), state=state)
         if trade['close_retry_count'] >= GENERAL_CONFIG.get("CLOSE_TRADE_RETRY_LIMIT", 3):
-            log_error(message=f"Không thể đóng lệnh {symbol} sau {trade['close_retry_count']} lần thử. CẦN CAN THIỆP THỦ CÔNG!", error_details=traceback.format_exc(), send_to_discord=True, force_discord=True, state=state)
+            log_error(message=f"Không thể đóng lệnh {symbol} sau {trade['close_retry_count']} lần thử. CẦN CAN THIỆP THỦ CÔNG!", error_details="".join(traceback.format_exception(type(error), error, error.__traceback__)), send_to_discord=True, force_discord=True, state=state)
             trade['close_retry_count'] = 0
         return False
+    trade['close_retry_count'] = 0
     if not (market_close_order and float(market_close_order.get('executedQty', 0)) > 0):
         log_error(f"Lệnh đóng {symbol} được gửi nhưng không khớp. Kiểm tra trên sàn.", state=state)
         return False
@@ -720,21 +957,28 @@ def check_and_manage_open_positions(bnc: BinanceConnector, state: Dict, realtime
     active_trades = state.get("active_trades", [])[:]
     if not active_trades: return
     min_order_value = GENERAL_CONFIG.get("MIN_ORDER_VALUE_USDT", 11.0)
+    # 1) Gom các lệnh phải đóng toàn bộ (SL/TP/EC_Abs) rồi gửi song song, thay vì đóng lần lượt từng lệnh
+    trade_prices, precise_prices, full_exits = {}, {}, []
     for trade in active_trades:
-        symbol, tactic_name = trade['symbol'], trade.get('opened_by_tactic')
-        tactic_cfg = TACTICS_LAB.get(tactic_name, {})
+        symbol = trade['symbol']
         current_price = realtime_prices.get(symbol)
         if not current_price: continue
-        precise_price_for_sl = get_realtime_price(symbol)
-        if precise_price_for_sl is not None:
-            current_price = precise_price_for_sl
-        if current_price <= trade['sl']:
-            if close_trade_on_binance(bnc, trade, "SL", state): continue
-        if current_price >= trade['tp']:
-            if close_trade_on_binance(bnc, trade, "TP", state): continue
+        if symbol not in precise_prices: precise_prices[symbol] = get_realtime_price(symbol)
+        if precise_prices[symbol] is not None:
+            current_price = precise_prices[symbol]
+        trade_prices[trade['trade_id']] = current_price
+        last_score = trade.get('last_score', 5.0)
+        if current_price <= trade['sl']: full_exits.append((trade, "SL"))
+        elif current_price >= trade['tp']: full_exits.append((trade, "TP"))
+        elif last_score < ACTIVE_TRADE_MANAGEMENT_CONFIG['EARLY_CLOSE_ABSOLUTE_THRESHOLD']: full_exits.append((trade, f"EC_Abs_{last_score:.1f}"))
+    closed_ids = close_trades_concurrently(bnc, full_exits, state)
+    # 2) Quản lý các lệnh còn mở (đóng một phần, TP1, bảo vệ lợi nhuận, trailing SL)
+    for trade in active_trades:
+        if trade['trade_id'] in closed_ids or trade['trade_id'] not in trade_prices: continue
+        symbol, tactic_name = trade['symbol'], trade.get('opened_by_tactic')
+        tactic_cfg = TACTICS_LAB.get(tactic_name, {})
+        current_price = trade_prices[trade['trade_id']]
         last_score, entry_score = trade.get('last_score', 5.0), trade.get('entry_score', 5.0)
-        if last_score < ACTIVE_TRADE_MANAGEMENT_CONFIG['EARLY_CLOSE_ABSOLUTE_THRESHOLD']:
-            if close_trade_on_binance(bnc, trade, f"EC_Abs_{last_score:.1f}", state): continue
         if last_score < entry_score and not trade.get('is_in_warning_zone', False):
             trade['is_in_warning_zone'] = True
         if trade.get('is_in_warning_zone', False) and not trade.get('partial_closed_by_score', False):
@@ -929,30 +1173,133 @@ def is_momentum_confirmed(symbol: str, interval: str, direction: str = "LONG") -
         return True
 
 
+ZONE_NOISE_LOOKBACK = 30         # Số nến đếm số lần close cắt ema_50
+BB_WIDTH_QUANTILE_WINDOW = 100   # Cửa sổ tính phân vị 20% của bb_width
+
+class RollingQuantile:
+    """Phân vị trên `window` nến cuối, cập nhật dần theo mốc thời gian nến: giữ deque (ts, value) + list đã sắp xếp,
+    mỗi nến mới / nến đang chạy thay đổi chỉ tốn 1 lần bisect thay vì sort lại cả cửa sổ. NaN bị bỏ qua (như pandas)."""
+    def __init__(self, window: int = BB_WIDTH_QUANTILE_WINDOW):
+        self.window = window
+        self._items: deque = deque()
+        self._sorted: List[float] = []
+
+    def _push(self, ts: int, value: float):
+        self._items.append((ts, value))
+        if value == value: insort(self._sorted, value)
+        if len(self._items) > self.window: self._discard(*self._items.popleft())
+
+    def _discard(self, ts: int, value: float):
+        if value == value: del self._sorted[bisect_left(self._sorted, value)]
+
+    def sync(self, timestamps: np.ndarray, values: np.ndarray) -> "RollingQuantile":
+        n = len(timestamps)
+        start = None
+        if self._items and n:
+            pos = int(np.searchsorted(timestamps, self._items[-1][0]))
+            first = pos - len(self._items) + 1  # Vị trí nến đầu cửa sổ cũ trong dữ liệu mới
+            # Chỉ nạp tiếp khi cửa sổ cũ khớp đúng vị trí trong dữ liệu mới và không thiếu lịch sử phía trước
+            if (pos < n and timestamps[pos] == self._items[-1][0] and n - pos <= self.window and first >= 0
+                    and timestamps[first] == self._items[0][0] and (len(self._items) == self.window or first == 0)): start = pos
+        if start is None:  # Lần đầu hoặc dữ liệu bị nạp lại/nhảy cóc: dựng lại từ đuôi
+            self._items.clear(); self._sorted = []
+            start = max(n - self.window, 0)
+        else:  # Nến cuối đã thấy có thể là nến đang chạy (giá trị đã đổi / vừa đóng) -> thay bằng giá trị mới
+            self._discard(*self._items.pop())
+        for i in range(start, n): self._push(int(timestamps[i]), float(values[i]))
+        return self
+
+    def quantile(self, q: float) -> float:
+        """Nội suy tuyến tính giống pandas/numpy quantile (method='linear')."""
+        m = len(self._sorted)
+        if m == 0: return float('nan')
+        pos = q * (m - 1)
+        lo = int(np.floor(pos)); hi = min(lo + 1, m - 1); t = pos - lo
+        a, b = self._sorted[lo], self._sorted[hi]
+        return b - (b - a) * (1 - t) if t >= 0.5 else a + (b - a) * t
+
+_bb_width_quantiles: Dict[Tuple[str, str], RollingQuantile] = {}  # Daemon: sống qua các phiên, chỉ nạp thêm nến mới
+
+def bb_width_low_quantile(symbol: str, interval: str, df: pd.DataFrame, q: float = 0.20) -> float:
+    values = df['bb_width'].to_numpy(dtype=float)
+    timestamps = getattr(df.index, "asi8", None)
+    if timestamps is None: return RollingQuantile().sync(np.arange(len(values)), values).quantile(q)
+    return _bb_width_quantiles.setdefault((symbol, interval), RollingQuantile()).sync(timestamps, values).quantile(q)
+
+def classify_market_zones(pairs: List[Tuple[str, str]]) -> Dict[Tuple[str, str], str]:
+    """Phân vùng thị trường cho nhiều (symbol, interval) trong 1 lần gọi: gom dữ liệu thành mảng (n, 30) và các
+    vector (n,), chấm điểm 4 zone bằng phép toán numpy. Kết quả giống hệt cách chấm từng cặp trước đây."""
+    zones = {}
+    rows = []
+    for symbol, interval in pairs:
+        indicators = indicator_results.get(symbol, {}).get(interval, {})
+        df = price_dataframes.get(symbol, {}).get(interval)
+        if not indicators or df is None or df.empty: zones[(symbol, interval)] = NOISE_ZONE
+        else: rows.append((symbol, interval, indicators, df))
+    if not rows: return zones
+
+    n, w = len(rows), ZONE_NOISE_LOOKBACK
+    close_gap, gap_valid = np.full((n, w), np.nan), np.zeros((n, w), dtype=bool)
+    has_ema50, ema_stack_up, bb_low_q = np.zeros(n, dtype=bool), np.zeros(n, dtype=bool), np.full(n, np.nan)
+    for i, (symbol, interval, _, df) in enumerate(rows):
+        if 'ema_50' in df.columns:
+            gap = df['close'].to_numpy(dtype=float)[-w:] - df['ema_50'].to_numpy(dtype=float)[-w:]
+            close_gap[i, w - len(gap):], gap_valid[i, w - len(gap):], has_ema50[i] = gap, True, True
+        if 'ema_20' in df.columns and 'ema_50' in df.columns and len(df) >= 10:
+            ema20, ema50 = df['ema_20'].to_numpy(dtype=float), df['ema_50'].to_numpy(dtype=float)
+            if not np.isnan(ema20).all() and not np.isnan(ema50).all():
+                ema_stack_up[i] = ema20[-1] > ema50[-1] and ema20[-10] > ema50[-10]
+        if 'bb_width' in df.columns and not df['bb_width'].isna().all():
+            bb_low_q[i] = bb_width_low_quantile(symbol, interval, df)
+
+    ind = lambda key, default: np.array([float(r[2].get(key, default)) for r in rows])
+    adx, bb_width, rsi_14 = ind('adx', 20), ind('bb_width', 0), ind('rsi_14', 50)
+    volume, vol_ma20 = ind('volume', 0), ind('vol_ma20', 1)
+    uptrend = np.array([r[2].get('trend', "sideways") == "uptrend" for r in rows])
+    htf_uptrend = np.array([indicator_results.get(r[0], {}).get('4h' if r[1] == '1h' else '1d', {}).get('trend', 'sideway') == 'uptrend' for r in rows])
+    breakout = np.array([r[2].get('breakout_signal', "none") != "none" for r in rows])
+    macd_cross = np.array([r[2].get('macd_cross', "neutral") not in ["neutral", "no_cross"] for r in rows])
+
+    # Số lần đổi dấu (close - ema_50): phần tử đầu của diff() là NaN nên luôn được đếm, cặp có NaN cũng được đếm
+    sign_diff = np.diff(np.sign(close_gap), axis=1)
+    crossings = (gap_valid[:, 1:] & gap_valid[:, :-1] & ~(sign_diff == 0)).sum(axis=1) + gap_valid.any(axis=1)
+    with np.errstate(invalid='ignore'):
+        scores = np.stack([  # Cột theo thứ tự ZONES: hòa điểm thì argmax lấy zone đứng trước, như max() trên dict cũ
+            2.5 * (bb_width < bb_low_q) + 2 * (htf_uptrend & (rsi_14 < 45)) - 2 * (adx > 28),                      # LEADING
+            3 * breakout + 2 * macd_cross + 1.5 * ((vol_ma20 > 0) & (volume > vol_ma20 * 2)),                     # COINCIDENT
+            2.5 * (adx > 25) + 2 * uptrend + 1.5 * (uptrend & ema_stack_up),                                     # LAGGING
+            3 * (adx < 20) + 2 * (has_ema50 & (crossings > 4)),                                                  # NOISE
+        ], axis=1)
+    best = np.where((scores > 0).any(axis=1), scores.argmax(axis=1), ZONES.index(NOISE_ZONE))
+    for (symbol, interval, _, _), k in zip(rows, best): zones[(symbol, interval)] = ZONES[k]
+    return zones
+
 def determine_market_zone_with_scoring(symbol: str, interval: str) -> str:
-    indicators = indicator_results.get(symbol, {}).get(interval, {})
-    df = price_dataframes.get(symbol, {}).get(interval)
-    if not indicators or df is None or df.empty: return NOISE_ZONE
-    scores = {LEADING_ZONE: 0, COINCIDENT_ZONE: 0, LAGGING_ZONE: 0, NOISE_ZONE: 0}
-    adx, bb_width, rsi_14, trend = indicators.get('adx', 20), indicators.get('bb_width', 0), indicators.get('rsi_14', 50), indicators.get('trend', "sideways")
-    if adx < 20: scores[NOISE_ZONE] += 3
-    if 'ema_50' in df.columns and np.sign(df['close'].iloc[-30:] - df['ema_50'].iloc[-30:]).diff().ne(0).sum() > 4:
-        scores[NOISE_ZONE] += 2
-    if adx > 25: scores[LAGGING_ZONE] += 2.5
-    if trend == "uptrend": scores[LAGGING_ZONE] += 2
-    if 'ema_20' in df.columns and 'ema_50' in df.columns and not df['ema_20'].isna().all() and not df['ema_50'].isna().all():
-        if trend == "uptrend" and df['ema_20'].iloc[-1] > df['ema_50'].iloc[-1] and df['ema_20'].iloc[-10] > df['ema_50'].iloc[-10]:
-            scores[LAGGING_ZONE] += 1.5
-    if 'bb_width' in df.columns and not df['bb_width'].isna().all() and bb_width < df['bb_width'].iloc[-100:].quantile(0.20):
-        scores[LEADING_ZONE] += 2.5
-    htf_trend = indicator_results.get(symbol, {}).get('4h' if interval == '1h' else '1d', {}).get('trend', 'sideway')
-    if htf_trend == 'uptrend' and rsi_14 < 45: scores[LEADING_ZONE] += 2
-    if indicators.get('breakout_signal', "none") != "none": scores[COINCIDENT_ZONE] += 3
-    if indicators.get('macd_cross', "neutral") not in ["neutral", "no_cross"]: scores[COINCIDENT_ZONE] += 2
-    if indicators.get('vol_ma20', 1) > 0 and indicators.get('volume', 0) > indicators.get('vol_ma20', 1) * 2:
-        scores[COINCIDENT_ZONE] += 1.5
-    if adx > 28: scores[LEADING_ZONE] -= 2
-    return max(scores, key=scores.get) if scores and any(v > 0 for v in scores.values()) else NOISE_ZONE
+    return classify_market_zones([(symbol, interval)])[(symbol, interval)]
+
+def score_pair_for_scan(symbol: str, interval: str, market_zone: Optional[str] = None) -> Dict:
+    """Phần chấm điểm KHÔNG phụ thuộc tactic của 1 cặp (symbol, interval): vùng thị trường, quyết định gốc của
+    advisor (tech/context/AI) và các hệ số MTF/EZ/PAM. Tính 1 lần / chu kỳ quét thay vì 1 lần / tactic."""
+    if market_zone is None: market_zone = determine_market_zone_with_scoring(symbol, interval)
+    tactics = []
+    for tactic_name, tactic_cfg in TACTICS_LAB.items():
+        optimal_zones = tactic_cfg.get("OPTIMAL_ZONE", [])
+        if not isinstance(optimal_zones, list): optimal_zones = [optimal_zones]
+        if market_zone in optimal_zones: tactics.append((tactic_name, tactic_cfg))
+    indicators = indicator_results.get(symbol, {}).get(interval)
+    if not (tactics and indicators and indicators.get('price', 0) > 0):
+        return {"zone": market_zone, "tactics": [], "mtf": 1.0, "ez": 1.0, "pam": 1.0}
+    return {
+        "zone": market_zone, "tactics": tactics,
+        "base_decision": get_advisor_decision(symbol, interval, indicators, ADVISOR_BASE_CONFIG),
+        "mtf": get_mtf_adjustment_coefficient(symbol, interval),
+        "ez": get_extreme_zone_adjustment_coefficient(indicators, interval) if any(c.get("USE_EXTREME_ZONE_FILTER", False) for _, c in tactics) else 1.0,
+        "pam": get_price_action_momentum_coefficient(symbol, interval) if any(c.get("USE_PRICE_ACTION_MOMENTUM", False) for _, c in tactics) else 1.0,
+    }
+
+def tactic_coefficients(pair: Dict, tactic_cfg: Dict) -> Tuple[float, float, float]:
+    return (pair["mtf"], pair["ez"] if tactic_cfg.get("USE_EXTREME_ZONE_FILTER", False) else 1.0,
+            pair["pam"] if tactic_cfg.get("USE_PRICE_ACTION_MOMENTUM", False) else 1.0)
 
 def find_and_open_new_trades(bnc: BinanceConnector, state: Dict, available_usdt: float, total_usdt_fund: float):
     if len(state.get("active_trades", [])) >= RISK_RULES_CONFIG["MAX_ACTIVE_TRADES"]: return
@@ -960,8 +1307,11 @@ def find_and_open_new_trades(bnc: BinanceConnector, state: Dict, available_usdt:
     now_vn = datetime.now(VIETNAM_TZ)
     cooldown_map = state.get('cooldown_until', {})
     timeframe_levels = {"1h": 1, "4h": 2, "1d": 3}
+    scan_memo: Dict[Tuple[str, str], Dict] = {}  # (symbol, interval) -> score_pair_for_scan(), chỉ sống trong 1 chu kỳ quét
+    active_symbols = {t['symbol'] for t in state.get("active_trades", [])}
+    zones = classify_market_zones([(s, i) for s in SYMBOLS_TO_SCAN if s not in active_symbols for i in INTERVALS_TO_SCAN])
     for symbol in SYMBOLS_TO_SCAN:
-        if any(t['symbol'] == symbol for t in state.get("active_trades", [])): continue
+        if symbol in active_symbols: continue
         symbol_cooldowns = cooldown_map.get(symbol, {})
         for interval in INTERVALS_TO_SCAN:
             is_in_cooldown = False
@@ -972,34 +1322,18 @@ def find_and_open_new_trades(bnc: BinanceConnector, state: Dict, available_usdt:
                         is_in_cooldown = True
                         cooldown_source = source_tf
                         break
-            market_zone = determine_market_zone_with_scoring(symbol, interval)
-            for tactic_name, tactic_cfg in TACTICS_LAB.items():
-                optimal_zones = tactic_cfg.get("OPTIMAL_ZONE", [])
-                if not isinstance(optimal_zones, list): optimal_zones = [optimal_zones]
-                if market_zone in optimal_zones:
-                    indicators = indicator_results.get(symbol, {}).get(interval)
-                    if not (indicators and indicators.get('price', 0) > 0): continue
-
-                    decision = get_advisor_decision(symbol, interval, indicators, ADVISOR_BASE_CONFIG, weights_override=tactic_cfg.get("WEIGHTS"))
-                    raw_score = decision.get("final_score", 0.0)
-
-                    mtf_coeff = get_mtf_adjustment_coefficient(symbol, interval)
-
-                    ez_coeff = 1.0
-                    if tactic_cfg.get("USE_EXTREME_ZONE_FILTER", False):
-                        ez_coeff = get_extreme_zone_adjustment_coefficient(indicators, interval)
-
-                    pam_coeff = 1.0
-                    if tactic_cfg.get("USE_PRICE_ACTION_MOMENTUM", False):
-                        pam_coeff = get_price_action_momentum_coefficient(symbol, interval)
-
-                    contextual_score = raw_score * mtf_coeff * ez_coeff * pam_coeff
-
-                    if is_in_cooldown:
-                        if contextual_score >= GENERAL_CONFIG["OVERRIDE_COOLDOWN_SCORE"]:
-                            log_message(f"🔥 {symbol}-{interval} có điểm {contextual_score:.2f}, phá vỡ cooldown từ {cooldown_source}.", state)
-                        else: continue
-                    potential_opportunities.append({"decision": decision, "tactic_name": tactic_name, "tactic_cfg": tactic_cfg, "score": contextual_score, "symbol": symbol, "interval": interval, "zone": market_zone})
+            pair = scan_memo[(symbol, interval)] = score_pair_for_scan(symbol, interval, zones[(symbol, interval)])
+            # Phần riêng của từng tactic chỉ còn: chấm lại theo WEIGHTS + nhân các hệ số đã tính sẵn
+            for tactic_name, tactic_cfg in pair["tactics"]:
+                decision = rescore_decision(pair["base_decision"], ADVISOR_BASE_CONFIG, tactic_cfg.get("WEIGHTS"))
+                mtf_coeff, ez_coeff, pam_coeff = tactic_coefficients(pair, tactic_cfg)
+                contextual_score = decision.get("final_score", 0.0) * mtf_coeff * ez_coeff * pam_coeff
+
+                if is_in_cooldown:
+                    if contextual_score >= GENERAL_CONFIG["OVERRIDE_COOLDOWN_SCORE"]:
+                        log_message(f"🔥 {symbol}-{interval} có điểm {contextual_score:.2f}, phá vỡ cooldown từ {cooldown_source}.", state)
+                    else: continue
+                potential_opportunities.append({"decision": decision, "tactic_name": tactic_name, "tactic_cfg": tactic_cfg, "score": contextual_score, "symbol": symbol, "interval": interval, "zone": pair["zone"]})
 
     log_message("---[🔍 Quét Cơ Hội Mới 🔍]---", state=state)
     if not potential_opportunities:
@@ -1021,16 +1355,8 @@ def find_and_open_new_trades(bnc: BinanceConnector, state: Dict, available_usdt:
 
         raw_score_val = opportunity['decision'].get('final_score', 0.0)
 
-        # Lấy lại hệ số để logging
-        indicators_log = indicator_results.get(opportunity['symbol'], {}).get(opportunity['interval'], {})
-        mtf_log_coeff = get_mtf_adjustment_coefficient(opportunity['symbol'], opportunity['interval'])
-        ez_log_coeff = 1.0
-        if tactic_cfg.get("USE_EXTREME_ZONE_FILTER", False) and indicators_log:
-            ez_log_coeff = get_extreme_zone_adjustment_coefficient(indicators_log, opportunity['interval'])
-
-        pam_log_coeff = 1.0
-        if tactic_cfg.get("USE_PRICE_ACTION_MOMENTUM", False):
-            pam_log_coeff = get_price_action_momentum_coefficient(opportunity['symbol'], opportunity['interval'])
+        # Hệ số để logging: lấy lại từ memo của chu kỳ quét, không tính lại
+        mtf_log_coeff, ez_log_coeff, pam_log_coeff = tactic_coefficients(scan_memo[(opportunity['symbol'], opportunity['interval'])], tactic_cfg)
 
         # Dòng log chính
         log_message(f"  #{i+1}: {opportunity['symbol']}-{opportunity['interval']} | Tactic: {tactic_name} | Gốc: {raw_score_val:.2f} | Bối cảnh: {score:.2f} (Ngưỡng: {entry_score_threshold})", state=state)
@@ -1722,20 +2048,92 @@ def should_send_report(state: Dict, equity: Optional[float]) -> Optional[str]:
         return "dynamic"
     return None
 
+def compute_indicator_frame(symbol: str, interval: str, df: pd.DataFrame) -> Tuple[pd.DataFrame, Dict]:
+    """Phần CPU của tác vụ nặng (chạy trong tiến trình con): thêm cột ema/bb_width rồi tính bộ chỉ báo."""
+    if 'ema_20' not in df.columns or 'ema_50' not in df.columns:
+        df['ema_20'] = ta.trend.ema_indicator(df["close"], window=20)
+        df['ema_50'] = ta.trend.ema_indicator(df["close"], window=50)
+    if 'bb_width' not in df.columns:
+        df['bb_width'] = ta.volatility.BollingerBands(df["close"], window=20, window_dev=2).bollinger_wband()
+    return df, calculate_indicators(df.copy(), symbol, interval)
+
+def _compute_mp_context():
+    # Daemon: luồng websocket của PriceStream luôn chạy -> fork có thể chép sang con 1 lock đang bị giữ (stdout, logging)
+    return multiprocessing.get_context("forkserver" if DAEMON_MODE else "fork")
+
+def _terminate_pool(pool: ProcessPoolExecutor):
+    """Bỏ pool mà không chờ: kill các worker (có thể đang treo) rồi hủy các việc chưa chạy."""
+    for proc in list((getattr(pool, "_processes", None) or {}).values()): proc.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def load_market_data(symbols: List[str]):
+    """Pipeline 2 tầng cho price_dataframes / indicator_results:
+    ThreadPool (I/O, giới hạn HEAVY_IO_WORKERS) tải/cập nhật nến -> hàng đợi -> ProcessPool (CPU) tính chỉ báo,
+    nên trong lúc symbol A đang được tính thì symbol B vẫn đang tải."""
+    for symbol in symbols: indicator_results[symbol], price_dataframes[symbol] = {}, {}
+    jobs = [(symbol, interval) for symbol in symbols for interval in ALL_TIME_FRAMES]
+    fetched: "queue.Queue[Tuple[str, str, Optional[pd.DataFrame]]]" = queue.Queue()
+    compute_workers = GENERAL_CONFIG.get("HEAVY_COMPUTE_WORKERS", 0) or max(1, (os.cpu_count() or 2) - 1)
+    timeout = GENERAL_CONFIG.get("HEAVY_COMPUTE_TIMEOUT_SECONDS", 120)
+    proc_pool = None
+    try:
+        proc_pool = ProcessPoolExecutor(max_workers=compute_workers, mp_context=_compute_mp_context())
+        proc_pool.submit(os.getpid).result(timeout=timeout)  # Cron (fork): tạo đủ worker TRƯỚC khi có luồng I/O
+    except Exception as e:
+        log_error(f"Không tạo được process pool cho tác vụ nặng, tính chỉ báo tuần tự: {e!r}")
+        if proc_pool is not None: _terminate_pool(proc_pool)
+        proc_pool = None
+
+    def fetch(job: Tuple[str, str]):
+        df = None
+        try: df = get_price_data_with_cache(job[0], job[1], GENERAL_CONFIG["DATA_FETCH_LIMIT"])
+        except Exception: log_error(f"Lỗi tải dữ liệu {job[0]}-{job[1]}", error_details=traceback.format_exc())
+        finally: fetched.put((job[0], job[1], df))
+
+    def store(symbol: str, interval: str, df: pd.DataFrame, indicators: Dict):
+        indicator_results[symbol][interval], price_dataframes[symbol][interval] = indicators, df
+
+    pending = {}
+    with ThreadPoolExecutor(max_workers=GENERAL_CONFIG.get("HEAVY_IO_WORKERS", 6)) as io_pool:
+        for job in jobs: io_pool.submit(fetch, job)
+        for _ in jobs:
+            symbol, interval, df = fetched.get()
+            if df is None or df.empty: continue
+            if proc_pool is None: store(symbol, interval, *compute_indicator_frame(symbol, interval, df)); continue
+            pending[proc_pool.submit(compute_indicator_frame, symbol, interval, df)] = (symbol, interval, df)
+    deadline, hung = time.monotonic() + timeout, False
+    for future, (symbol, interval, df) in pending.items():
+        try: store(symbol, interval, *future.result(timeout=0 if hung else max(0.0, deadline - time.monotonic())))
+        except Exception as e:  # Worker chết / treo / lỗi pickle -> tính lại ngay trong tiến trình chính
+            if isinstance(e, FuturesTimeoutError) and not hung:
+                hung = True
+                log_error(f"Process pool tính chỉ báo quá {timeout}s, bỏ pool và tính tuần tự phần còn lại.", send_to_discord=True)
+            elif not hung: log_error(f"Lỗi tính chỉ báo {symbol}-{interval} trong process pool: {e!r}. Tính lại tuần tự.")
+            store(symbol, interval, *compute_indicator_frame(symbol, interval, df))
+    if proc_pool is not None:
+        if hung: _terminate_pool(proc_pool)
+        else: proc_pool.shutdown()
+
+@contextmanager
+def state_unlocked(state: Dict):
+    """Daemon có trigger engine: nhả khóa state trong đoạn chỉ tải nến + tính chỉ báo (không đụng state) để luồng trigger
+    đóng lệnh ngay cả khi phiên đang chạy. Lưu state trước khi nhả; lấy lại khóa rồi đọc lại state vào chính dict `state`
+    (gồm thay đổi của luồng trigger), giữ nguyên các khóa tạm của phiên."""
+    if not (DAEMON_MODE and _trigger_engine is not None):
+        yield; return
+    session_temp = {k: state[k] for k in SESSION_TEMP_KEYS if k in state}
+    save_state(state); release_lock()
+    try: yield
+    finally:
+        if not acquire_lock(timeout=None): raise RuntimeError("Không lấy lại được khóa state sau tác vụ nặng.")
+        fresh = load_state()
+        if fresh is not state: state.clear(); state.update(fresh)
+        state.update(session_temp)
+
 def run_heavy_tasks(bnc: BinanceConnector, state: Dict, available_usdt: float, total_usdt: float):
     symbols_to_load = list(set(SYMBOLS_TO_SCAN + [t['symbol'] for t in state.get('active_trades', [])] + ["BTCUSDT"]))
-    for symbol in symbols_to_load:
-        indicator_results[symbol], price_dataframes[symbol] = {}, {}
-        for interval in ALL_TIME_FRAMES:
-            df = get_price_data_with_cache(symbol, interval, GENERAL_CONFIG["DATA_FETCH_LIMIT"])
-            if df is not None and not df.empty:
-                if 'ema_20' not in df.columns or 'ema_50' not in df.columns:
-                    df['ema_20'] = ta.trend.ema_indicator(df["close"], window=20)
-                    df['ema_50'] = ta.trend.ema_indicator(df["close"], window=50)
-                if 'bb_width' not in df.columns:
-                    df['bb_width'] = ta.volatility.BollingerBands(df["close"], window=20, window_dev=2).bollinger_wband()
-                indicator_results[symbol][interval] = calculate_indicators(df.copy(), symbol, interval)
-                price_dataframes[symbol][interval] = df
+    with state_unlocked(state): load_market_data(symbols_to_load)
+    trade_zones = classify_market_zones([(t['symbol'], t['interval']) for t in state.get("active_trades", [])])
     for trade in state.get("active_trades", []):
         indicators = indicator_results.get(trade['symbol'], {}).get(trade['interval'])
         if indicators:
@@ -1757,17 +2155,19 @@ def run_heavy_tasks(bnc: BinanceConnector, state: Dict, available_usdt: float, t
             if trade.get('last_score') is not None and contextual_score != trade.get('last_score'):
                 log_message(f"  (i) Cập nhật điểm {trade['symbol']}-{trade['interval']}: {trade.get('last_score', 0.0):.2f} -> {contextual_score:.2f} (Gốc: {raw_score:.2f}, MTF: x{mtf_coeff:.2f}, EZ: x{ez_coeff:.2f}, PAM: x{pam_coeff:.2f})", state)
             trade['last_score'] = contextual_score
-            trade['last_zone'] = determine_market_zone_with_scoring(trade['symbol'], trade['interval'])
+            trade['last_zone'] = trade_zones[(trade['symbol'], trade['interval'])]
     find_and_open_new_trades(bnc, state, available_usdt, total_usdt)
 
 
 def reconcile_positions_with_binance(bnc: BinanceConnector, state: Dict):
     try:
-        balances = bnc.get_account_balance().get("balances", [])
+        # Điểm đối soát đầu phiên: đọc số dư thật từ sàn (bỏ qua nếu test_connection vừa đọc xong)
+        balances = bnc.refresh_balance(max_age=BALANCE_SNAPSHOT_MAX_AGE_SECONDS).get("balances", [])
         asset_balances = {item['asset']: float(item['free']) + float(item['locked']) for item in balances}
     except Exception as e:
         log_error("Không thể lấy số dư tài khoản để đối soát.", error_details=str(e), state=state)
         return
+    settle_exchange_protection(bnc, state)  # OCO đã khớp trên sàn = lệnh đã đóng, không phải "đóng thủ công"
     active_trades = state.get("active_trades", [])
     trades_to_remove = []
     threshold = GENERAL_CONFIG.get("RECONCILIATION_QTY_THRESHOLD", 0.95)
@@ -1817,19 +2217,19 @@ def reconcile_positions_with_binance(bnc: BinanceConnector, state: Dict):
 # ==============================================================================
 # ==================== VÒNG LẶP CHÍNH =================================
 # ==============================================================================
-def run_session():
+def run_session(bnc: Optional[BinanceConnector] = None):
+    """1 phiên giao dịch. Cron: tự tạo connector + kiểm tra kết nối. Daemon: dùng lại connector đã kết nối."""
     if not acquire_lock():
         return
     state = {}
+    own_connector = bnc is None
     try:
-        with BinanceConnector(network=TRADING_MODE) as bnc:
-            if not bnc.test_connection():
+        with (BinanceConnector(network=TRADING_MODE) if own_connector else nullcontext(bnc)) as bnc:
+            if own_connector and not bnc.test_connection():
                 log_error("Không thể kết nối đến Binance API.", send_to_discord=True)
                 return
-            state = load_json_file(STATE_FILE, {
-                "active_trades": [], "trade_history": [], "initial_capital": 0.0,
-                "money_spent_on_trades_last_session": 0.0, "pnl_closed_last_session": 0.0
-            })
+            state = load_state()
+            apply_engine_trailing(state)
 
             # --- [BẮT ĐẦU] TỰ ĐỘNG KHỞI TẠO THỐNG KÊ (NẾU CẦN) (v9.2) ---
             if 'trade_stats' not in state:
@@ -1891,7 +2291,7 @@ def run_session():
             current_equity = calculate_total_equity(state, total_usdt_at_start, realtime_prices_at_start)
             if current_equity is None:
                 log_message("⚠️ Không thể tính Equity do lỗi API giá. Tạm dừng phiên để đảm bảo an toàn.", state=state)
-                save_json_file(STATE_FILE, state)
+                save_state(state)
                 return
             manage_dynamic_capital(state, bnc, current_equity)
             now_vn = datetime.now(VIETNAM_TZ)
@@ -1919,6 +2319,7 @@ def run_session():
                 else:
                     missing_symbols = [s for s, p in current_prices_for_mgmt.items() if p is None]
                     log_message(f"⚠️ Tạm dừng quản lý vị thế do không lấy được giá cho: {', '.join(missing_symbols)}", state=state)
+            sync_exchange_protection(bnc, state)
             if state.get('temp_newly_opened_trades') or state.get('temp_newly_closed_trades'):
                 log_message(f"--- Cập nhật các sự kiện trong phiên ---", state=state)
                 for msg in state.get('temp_newly_opened_trades', []): log_message(f"  {msg}", state=state)
@@ -1941,7 +2342,7 @@ def run_session():
             state.pop('pnl_closed_last_session', None)
             state.pop('pnl_open_change_last_session', None)
             state.pop('equity_end_of_last_session', None)
-            save_json_file(STATE_FILE, state)
+            save_state(state)
     except Exception as e:
         error_msg = str(e)
         error_signature = error_msg.split(' for url:')[0] if ' for url:' in error_msg else error_msg[:100]
@@ -1957,7 +2358,7 @@ def run_session():
         if state:
             if should_alert_discord:
                  state['last_critical_error'] = {'signature': error_signature, 'timestamp': now_ts}
-            save_json_file(STATE_FILE, state)
+            save_state(state)
     finally:
         release_lock()
         if state and state.get('session_has_events', False):
@@ -1966,5 +2367,168 @@ def run_session():
             print(log_entry)
             with open(LOG_FILE, "a", encoding="utf-8") as f: f.write(log_entry + "\n")
 
+# ==============================================================================
+# ==================== CHẾ ĐỘ DAEMON (THAY CHO CRON MỖI PHÚT) ==================
+# ==============================================================================
+def _daemon_already_running() -> bool:
+    try:
+        with open(DAEMON_PID_FILE) as f: pid = int(f.read().strip())
+        if pid == os.getpid(): return False
+        os.kill(pid, 0)
+        return True
+    except (OSError, ValueError): return False
+
+def seconds_until_next_tick(now: Optional[float] = None) -> float:
+    now = time.time() if now is None else now
+    return max(0.0, (int(now // 60) + 1) * 60 + DAEMON_TICK_OFFSET_SECONDS - now)
+
+# --- TRIGGER ENGINE (daemon): SL/TP/Trailing theo giá websocket, không chờ tới phút kế tiếp ---
+_trigger_engine: Optional[TriggerEngine] = None
+
+def trade_trigger_levels(trades: List[Dict]) -> List[TradeLevels]:
+    """SL/TP + điểm kích hoạt trailing của từng lệnh, cùng công thức với check_and_manage_open_positions."""
+    levels = []
+    for trade in trades:
+        tactic_cfg = TACTICS_LAB.get(trade.get('opened_by_tactic'), {})
+        risk = trade.get('atr_risk_dist', 0)
+        if risk <= 0: risk = abs(trade.get('initial_entry', {}).get('price', 0) - trade.get('initial_sl', 0))
+        activation = None
+        if tactic_cfg.get("USE_TRAILING_SL", False) and risk > 0 and "TRAIL_ACTIVATION_RR" in tactic_cfg:
+            activation = trade['entry_price'] + risk * tactic_cfg["TRAIL_ACTIVATION_RR"]
+        levels.append(TradeLevels(trade['trade_id'], trade['symbol'], float(trade['sl']), float(trade['tp']),
+                                  activation, risk * tactic_cfg.get("TRAIL_DISTANCE_RR", 0.8)))
+    return levels
+
+def apply_engine_trailing(state: Dict):
+    """Ghi các mức SL mà trigger engine đã kéo theo giá (giữa 2 phiên) vào state."""
+    if _trigger_engine is None: return
+    trades = {t['trade_id']: t for t in state.get('active_trades', [])}
+    for trade_id, new_sl in _trigger_engine.pop_trailed().items():
+        trade = trades.get(trade_id)
+        if trade is None or new_sl <= trade['sl']: continue
+        state.setdefault('temp_newly_closed_trades', []).append(f"⚙️ TSL {trade['symbol']}: SL mới {new_sl:.4f} (cũ {trade['sl']:.4f})")
+        trade['sl'] = new_sl
+        if "Trailing_SL_Active" not in trade.get('tactic_used', []):
+            trade.setdefault('tactic_used', []).append("Trailing_SL_Active")
+
+def peek_active_trades() -> List[Dict]:
+    """Lệnh đang mở theo state hiện tại, không làm mất bản state daemon đang giữ trong RAM."""
+    saved = _saved_state.get("data")
+    if saved is not None and _saved_state.get("key") == _state_file_key(): return saved.get('active_trades', [])
+    if STATE_BACKEND == "sqlite": return get_state_store().load().get('active_trades', [])
+    return load_json_file(STATE_FILE, {}).get('active_trades', [])
+
+def run_trigger_exits(bnc: BinanceConnector, hits: List[TriggerHit]) -> bool:
+    """Đóng ngay các lệnh trigger engine báo chạm SL/TP (kiểm tra lại với state dưới khóa trước khi bán).
+    Trả về False nếu không lấy được khóa state (các hit chưa được xử lý)."""
+    if not acquire_lock(timeout=10): return False
+    state = {}
+    try:
+        state = load_state()
+        state['temp_newly_closed_trades'], state['temp_pnl_from_closed_trades'] = [], 0.0
+        state.setdefault('money_gained_from_trades_last_session', 0.0)
+        apply_engine_trailing(state)
+        trades = {t['trade_id']: t for t in state.get('active_trades', [])}
+        exits = []
+        for hit in hits:
+            trade = trades.pop(hit.trade_id, None)
+            if trade is None: continue
+            if hit.reason == "SL" and hit.level > trade['sl']:  # SL trailing của engine: lệnh đã bị gỡ khỏi sổ nên pop_trailed không trả về
+                trade['sl'] = hit.level
+                if "Trailing_SL_Active" not in trade.get('tactic_used', []): trade.setdefault('tactic_used', []).append("Trailing_SL_Active")
+            if (hit.reason == "SL" and hit.price <= trade['sl']) or (hit.reason == "TP" and hit.price >= trade['tp']):
+                log_message(f"⚡ Trigger {hit.reason} {hit.symbol}: giá {format_price_dynamically(hit.price)} chạm mức {format_price_dynamically(hit.level)}", state=state)
+                exits.append((trade, hit.reason))
+        if exits: close_trades_concurrently(bnc, exits, state)
+        sync_exchange_protection(bnc, state)
+        for msg in state.get('temp_newly_closed_trades', []): log_message(f"  {msg}", state=state)
+        save_state(state)  # Kể cả khi không đóng lệnh nào: giữ các mức trailing SL vừa ghi vào state
+    except Exception:
+        log_error("Lỗi khi đóng lệnh theo trigger engine", error_details=traceback.format_exc(), send_to_discord=True, state=state)
+    finally:
+        release_lock()
+    return True
+
+def run_daemon():
+    """Chạy run_session mỗi phút trong 1 tiến trình thường trú: không import lại thư viện, không tạo lại connector
+    (đồng bộ giờ + exchangeInfo), giữ state / price_dataframes / indicator_results trong RAM.
+    SIGTERM/SIGINT: chờ phiên đang chạy xong rồi thoát."""
+    global DAEMON_MODE
+    if _daemon_already_running():
+        print(f"❌ live_trade daemon đã chạy (pid file: {DAEMON_PID_FILE}). Thoát."); return
+    with open(DAEMON_PID_FILE, "w") as f: f.write(str(os.getpid()))
+    DAEMON_MODE = True
+    global _trigger_engine
+    stop_event = threading.Event()
+    def _request_stop(signum, frame):
+        if not stop_event.is_set(): print(f"⚠️ Nhận tín hiệu {signal.Signals(signum).name}: dừng sau khi phiên hiện tại kết thúc...")
+        stop_event.set()
+    signal.signal(signal.SIGTERM, _request_stop); signal.signal(signal.SIGINT, _request_stop)
+    log_message(f"🚀 Khởi động live_trade daemon (pid {os.getpid()}, chế độ {TRADING_MODE}).")
+    bnc, stream, trigger_thread = None, None, None
+    pending_hits: "queue.Queue[List[TriggerHit]]" = queue.Queue()
+    if TRIGGER_ENGINE_ENABLED:
+        _trigger_engine = TriggerEngine(on_hits=pending_hits.put)
+        try:
+            stream = PriceStream(TRADING_MODE, _trigger_engine.on_price, log=log_message); stream.start()
+        except ImportError as e:
+            log_message(f"⚠️ Tắt trigger engine: {e}"); _trigger_engine = None
+
+    def sync_triggers():
+        if _trigger_engine is None: return
+        try:
+            _trigger_engine.sync(trade_trigger_levels(peek_active_trades()))
+            stream.set_symbols(_trigger_engine.symbols())
+        except Exception: log_error("Lỗi đồng bộ trigger engine", error_details=traceback.format_exc())
+
+    def connect():
+        nonlocal bnc
+        if bnc is not None: return
+        try:
+            bnc = BinanceConnector(network=TRADING_MODE)
+            if not bnc.test_connection():
+                log_error("Không thể kết nối đến Binance API.", send_to_discord=True)
+                bnc.close(); bnc = None
+        except Exception as e:
+            log_error(f"Không thể khởi tạo BinanceConnector: {e}", error_details=traceback.format_exc(), send_to_discord=True)
+            bnc = None
+
+    def trigger_worker():
+        """Luồng riêng đóng lệnh ngay khi trigger engine báo, kể cả lúc phiên đang chạy (cùng khóa state, xem state_unlocked).
+        Hit chưa xử lý được (chưa có connector / không lấy được khóa) -> đồng bộ lại sổ để lệnh được bắt lại ở tick sau."""
+        while not stop_event.is_set():
+            try: hits = pending_hits.get(timeout=1)
+            except queue.Empty: continue
+            while not pending_hits.empty(): hits += pending_hits.get_nowait()
+            conn = bnc
+            handled = conn is not None and run_trigger_exits(conn, hits)
+            sync_triggers()
+            if not handled: stop_event.wait(TRIGGER_RETRY_SECONDS)  # Tránh vòng lặp hit -> đồng bộ -> hit liên tục
+
+    try:
+        connect()
+        sync_triggers()
+        if _trigger_engine is not None:
+            trigger_thread = threading.Thread(target=trigger_worker, name="trigger-exits", daemon=True); trigger_thread.start()
+        stop_event.wait(seconds_until_next_tick())
+        while not stop_event.is_set():
+            connect()
+            if bnc is not None:
+                t0 = time.perf_counter()
+                run_session(bnc)
+                sync_triggers()
+                print(f"[{datetime.now(VIETNAM_TZ).strftime('%H:%M:%S')}] (LiveTrade) tick {(time.perf_counter() - t0) * 1000:.0f}ms")
+            stop_event.wait(seconds_until_next_tick())
+    finally:
+        stop_event.set()
+        if stream is not None: stream.stop()
+        if trigger_thread is not None: trigger_thread.join(timeout=30)  # Chờ lượt đóng lệnh đang chạy trước khi đóng connector
+        if bnc is not None: bnc.close()
+        try:
+            if not _daemon_already_running(): os.remove(DAEMON_PID_FILE)
+        except OSError: pass
+        log_message("🛑 Đã dừng live_trade daemon.")
+
 if __name__ == "__main__":
-    run_session()
+    if "--daemon" in sys.argv[1:]: run_daemon()
+    else: run_session()
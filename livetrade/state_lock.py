@@ -0,0 +1,96 @@
+# livetrade/state_lock.py
+# -*- coding: utf-8 -*-
+"""
+State Lock - khóa tư vấn fcntl.flock cho state của live_trade / control_live
+
+- Khóa do kernel giữ trên file descriptor: tiến trình chết (kể cả kill -9) là khóa tự nhả,
+  không còn file lock "kẹt" và không cần xóa lock theo mtime.
+- Người chờ bị chặn trong flock() và được đánh thức ngay khi người giữ nhả khóa (không polling).
+- exclusive: phiên bot / thao tác sửa state. shared: chỉ đọc (dashboard, báo cáo), nhiều người cùng giữ được.
+- File lock không bao giờ bị xóa (xóa file đang bị flock sẽ tách người chờ sang 1 inode khác).
+"""
+import os
+import signal
+import threading
+import time
+import fcntl
+from typing import Optional
+
+POLL_SECONDS = 0.05  # Chỉ dùng khi chờ có timeout ngoài main thread (SIGALRM chỉ có ở main thread)
+
+class _LockTimeout(Exception):
+    pass
+
+def _on_alarm(signum, frame):
+    raise _LockTimeout()
+
+def _flock(fd: int, op: int, timeout: Optional[float]) -> bool:
+    try:
+        fcntl.flock(fd, op | fcntl.LOCK_NB); return True
+    except BlockingIOError:
+        if timeout is not None and timeout <= 0: return False
+    if timeout is None:
+        fcntl.flock(fd, op); return True
+    if threading.current_thread() is not threading.main_thread():
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            time.sleep(POLL_SECONDS)
+            try:
+                fcntl.flock(fd, op | fcntl.LOCK_NB); return True
+            except BlockingIOError: pass
+        return False
+    # Main thread: chặn trong flock, SIGALRM cắt ngang khi hết thời gian
+    old_handler = signal.signal(signal.SIGALRM, _on_alarm)
+    try:
+        try:
+            signal.setitimer(signal.ITIMER_REAL, timeout)
+            fcntl.flock(fd, op)
+        finally: signal.setitimer(signal.ITIMER_REAL, 0)
+        return True
+    except _LockTimeout:
+        return False  # Nếu alarm đến ngay sau khi vừa lấy được khóa, close(fd) ở acquire() sẽ nhả lại
+    finally: signal.signal(signal.SIGALRM, old_handler)
+
+class StateLock:
+    """Khóa (không tái nhập) trên 1 file lock. acquire() trả về False khi hết timeout."""
+    def __init__(self, path: str):
+        self.path = path
+        self._fd: Optional[int] = None
+        self.mode: Optional[str] = None
+
+    @property
+    def held(self) -> bool:
+        return self._fd is not None
+
+    def acquire(self, timeout: Optional[float] = None, shared: bool = False) -> bool:
+        """timeout=None: chờ vô hạn; 0: thử 1 lần; >0: chờ tối đa `timeout` giây."""
+        if self._fd is not None: raise RuntimeError(f"Đang giữ khóa {self.path} ({self.mode}).")
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            ok = _flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX, timeout)
+        except BaseException:
+            os.close(fd); raise
+        if not ok:
+            os.close(fd); return False
+        self._fd, self.mode = fd, "shared" if shared else "exclusive"
+        if not shared:  # PID người giữ chỉ để tham khảo (holder_pid), không dùng để xét khóa
+            os.ftruncate(fd, 0); os.pwrite(fd, str(os.getpid()).encode(), 0)
+        return True
+
+    def release(self):
+        if self._fd is None: return
+        fd, self._fd, self.mode = self._fd, None, None
+        try: fcntl.flock(fd, fcntl.LOCK_UN)
+        finally: os.close(fd)
+
+    def holder_pid(self) -> Optional[int]:
+        try:
+            with open(self.path) as f: return int(f.read().strip() or 0) or None
+        except (OSError, ValueError): return None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
@@ -0,0 +1,173 @@
+# livetrade/state_store.py
+# -*- coding: utf-8 -*-
+"""
+State Store - SQLite (WAL) cho live_trade / control_live
+
+Thay cho việc ghi lại toàn bộ live_trade_state.json mỗi phiên:
+- Mỗi phần của state là 1 bảng, mỗi phần tử là 1 dòng (key, ord, data JSON):
+    active_trades  (key = trade_id)      trade_history (key = trade_id)
+    cooldowns      (key = symbol)        stats         (key = tên chỉ số trong trade_stats)
+    kv             (mọi khóa cấp 1 còn lại: initial_capital, pending_trade_opportunity, ...)
+- load() dựng lại đúng dict state như file JSON cũ; save(state) so với bản đã đọc/ghi
+  lần trước và chỉ INSERT/UPDATE/DELETE các dòng thay đổi, trong 1 transaction.
+- 1 kết nối dùng chung được giữa các luồng (luồng trigger của daemon): mọi thao tác đi qua 1 RLock.
+- Lần đầu mở (DB rỗng) tự nhập từ file JSON cũ. export_json() ghi lại file JSON
+  theo định dạng cũ (sao lưu / công cụ ngoài).
+
+Dùng: python livetrade/state_store.py export [đường_dẫn.json]
+      python livetrade/state_store.py import [đường_dẫn.json]
+"""
+import os
+import sys
+import json
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+LIST_TABLES = {"active_trades": "active_trades", "trade_history": "trade_history"}  # khóa state -> bảng (giữ thứ tự)
+DICT_TABLES = {"cooldown_until": "cooldowns", "trade_stats": "stats"}
+KV_TABLE = "kv"
+ALL_TABLES = list(LIST_TABLES.values()) + list(DICT_TABLES.values()) + [KV_TABLE]
+
+Rows = Dict[str, Tuple[int, str]]  # key -> (ord, data JSON)
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str)
+
+def _list_keys(items: List[Any]) -> List[str]:
+    """trade_id làm khóa; trùng trade_id (hiếm) thì thêm hậu tố #n, thiếu trade_id thì dùng vị trí."""
+    keys, seen = [], {}
+    for i, item in enumerate(items):
+        base = str(item.get("trade_id")) if isinstance(item, dict) and item.get("trade_id") else f"#pos{i}"
+        n = seen.get(base, 0); seen[base] = n + 1
+        keys.append(base if n == 0 else f"{base}#{n}")
+    return keys
+
+class StateStore:
+    def __init__(self, db_path: str, legacy_json: Optional[str] = None):
+        self.db_path = db_path
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)  # autocommit, transaction tự quản lý
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        for table in ALL_TABLES:
+            self.conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, ord INTEGER NOT NULL DEFAULT 0, data TEXT NOT NULL)")
+        self._rows: Dict[str, Rows] = {t: {} for t in ALL_TABLES}
+        self._version: Optional[int] = None
+        if legacy_json and os.path.exists(legacy_json) and self.is_empty():
+            self.import_json(legacy_json)
+            print(f"✅ Đã chuyển state từ {os.path.basename(legacy_json)} sang {os.path.basename(db_path)}.")
+
+    def close(self):
+        self.conn.close()
+
+    def version(self) -> int:
+        """Tăng mỗi khi 1 kết nối KHÁC commit (PRAGMA data_version) -> biết state bị sửa từ bên ngoài."""
+        with self.lock: return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def is_empty(self) -> bool:
+        with self.lock: return all(self.conn.execute(f"SELECT 1 FROM {t} LIMIT 1").fetchone() is None for t in ALL_TABLES)
+
+    def _read_rows(self) -> Dict[str, Rows]:
+        return {t: {k: (o, d) for k, o, d in self.conn.execute(f"SELECT key, ord, data FROM {t}")} for t in ALL_TABLES}
+
+    # --------------------------------------------------
+    # ĐỌC / GHI
+    # --------------------------------------------------
+    def load(self, default: Optional[Dict] = None) -> Dict:
+        with self.lock: return self._load(default)
+
+    def _load(self, default: Optional[Dict]) -> Dict:
+        self._rows, self._version = self._read_rows(), self.version()
+        if not any(self._rows.values()): return dict(default) if default is not None else {"active_trades": [], "trade_history": []}
+        ordered = lambda rows: sorted(rows.values(), key=lambda r: r[0])
+        state = {}
+        for key, (_, data) in sorted(self._rows[KV_TABLE].items(), key=lambda kv: kv[1][0]): state[key] = json.loads(data)
+        for name, table in LIST_TABLES.items(): state[name] = [json.loads(data) for _, data in ordered(self._rows[table])]
+        for name, table in DICT_TABLES.items():
+            if self._rows[table]:  # Bảng rỗng = khóa không tồn tại (live_trade dựa vào đó để khởi tạo trade_stats)
+                state[name] = {key: json.loads(data) for key, (_, data) in sorted(self._rows[table].items(), key=lambda kv: kv[1][0])}
+        return state
+
+    def _rows_for(self, state: Dict, skip_keys: Iterable[str]) -> Dict[str, Rows]:
+        skip = set(skip_keys)
+        rows: Dict[str, Rows] = {}
+        for name, table in LIST_TABLES.items():
+            items = state.get(name) or []
+            keys = _list_keys(items)
+            old = self._rows[table]
+            # Giữ nguyên ord của dòng cũ (xóa đầu danh sách / thêm cuối không làm ghi lại cả bảng); sai thứ tự thì đánh số lại
+            ords = [old[k][0] if k in old else None for k in keys]
+            top = max((o for o in ords if o is not None), default=-1)
+            for i, o in enumerate(ords):
+                if o is None: top += 1; ords[i] = top
+            if any(b <= a for a, b in zip(ords, ords[1:])): ords = list(range(len(keys)))
+            rows[table] = {k: (o, _dumps(item)) for k, o, item in zip(keys, ords, items)}
+        for name, table in DICT_TABLES.items():
+            rows[table] = {str(k): (i, _dumps(v)) for i, (k, v) in enumerate((state.get(name) or {}).items())}
+        rows[KV_TABLE] = {k: (i, _dumps(v)) for i, (k, v) in enumerate(state.items())
+                          if k not in LIST_TABLES and k not in DICT_TABLES and k not in skip}
+        return rows
+
+    def save(self, state: Dict, skip_keys: Iterable[str] = ()) -> int:
+        """Ghi phần thay đổi so với lần load/save trước trong 1 transaction. Trả về số dòng đã ghi/xóa."""
+        with self.lock: return self._save(state, skip_keys)
+
+    def _save(self, state: Dict, skip_keys: Iterable[str]) -> int:
+        if self._version is None or self.version() != self._version:
+            self._rows = self._read_rows()  # Có tiến trình khác đã ghi -> so với dữ liệu thật trong DB
+        new_rows = self._rows_for(state, skip_keys)
+        changes = 0
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            for table, rows in new_rows.items():
+                old = self._rows[table]
+                removed = [(k,) for k in old if k not in rows]
+                upserts = [(k, o, d) for k, (o, d) in rows.items() if old.get(k) != (o, d)]
+                if removed: self.conn.executemany(f"DELETE FROM {table} WHERE key = ?", removed)
+                if upserts: self.conn.executemany(f"INSERT OR REPLACE INTO {table} (key, ord, data) VALUES (?, ?, ?)", upserts)
+                changes += len(removed) + len(upserts)
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        self._rows, self._version = new_rows, self.version()
+        return changes
+
+    # --------------------------------------------------
+    # TƯƠNG THÍCH FILE JSON CŨ
+    # --------------------------------------------------
+    def export_json(self, path: str):
+        temp_path = path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f: json.dump(self.load(), f, indent=4, ensure_ascii=False)
+        os.replace(temp_path, path)
+
+    def import_json(self, path: str) -> int:
+        with open(path, "r", encoding="utf-8") as f:
+            content = f.read()
+        state = json.loads(content) if content.strip() else {}
+        with self.lock: return self._import_state(state)
+
+    def _import_state(self, state: Dict) -> int:
+        self._rows, self._version = {t: {} for t in ALL_TABLES}, None
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            for table in ALL_TABLES: self.conn.execute(f"DELETE FROM {table}")
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return self._save(state, ())
+
+if __name__ == "__main__":
+    data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+    db_file, json_file = os.path.join(data_dir, "live_trade_state.db"), os.path.join(data_dir, "live_trade_state.json")
+    if len(sys.argv) < 2 or sys.argv[1] not in ("export", "import"):
+        sys.exit("Cách dùng: python livetrade/state_store.py export|import [đường_dẫn.json]")
+    target = sys.argv[2] if len(sys.argv) > 2 else json_file
+    store = StateStore(db_file)
+    if sys.argv[1] == "export":
+        store.export_json(target); print(f"✅ Đã xuất state ra {target}")
+    else:
+        print(f"✅ Đã nhập {store.import_json(target)} dòng từ {target}")
+    store.close()
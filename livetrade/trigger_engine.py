@@ -0,0 +1,198 @@
+# livetrade/trigger_engine.py
+# -*- coding: utf-8 -*-
+"""
+Trigger Engine - bắt SL/TP/Trailing SL theo luồng giá realtime (dùng trong `live_trade.py --daemon`)
+
+- Mỗi symbol có 1 "sổ" gồm các mảng đã sắp xếp (bisect):
+    sl     : (mức SL cố định, trade_id) tăng dần -> giá <= SL <=> các phần tử ở CUỐI mảng từ bisect(giá)
+    tp     : (mức TP, trade_id) tăng dần         -> giá >= TP <=> các phần tử ở ĐẦU mảng tới bisect(giá)
+    trail  : (giá kích hoạt trailing, trade_id) tăng dần, lệnh chưa kích hoạt
+    active : (khoảng trailing, trade_id) tăng dần, lệnh đã kích hoạt. SL trailing = đỉnh - khoảng (đỉnh chung
+             của symbol kể từ lần đồng bộ), nên giá <= SL trailing <=> khoảng <= đỉnh - giá: vẫn chỉ 1 lần bisect,
+             không phải cập nhật SL của từng lệnh mỗi khi giá lập đỉnh mới.
+  Mỗi tick chỉ tốn vài lần bisect; mỗi lệnh chuyển trail -> active đúng 1 lần.
+- Khi chạm mức, lệnh bị gỡ khỏi sổ (không bắn 2 lần) và on_hits() được gọi ngay trên luồng websocket;
+  việc đóng lệnh thật do live_trade thực hiện (dưới khóa state), sau đó sổ được đồng bộ lại từ state.
+- PriceStream: aggTrade của Binance qua websocket-client, tự kết nối lại, đổi danh sách symbol bằng SUBSCRIBE/UNSUBSCRIBE.
+"""
+import json
+import time
+import threading
+from bisect import bisect_left, bisect_right, insort
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional
+
+try:
+    import websocket  # websocket-client
+except ImportError:
+    websocket = None
+
+_MAX_ID = "\U0010ffff"  # trade_id lớn nhất có thể, để bisect_right theo (mức giá, trade_id)
+
+class TradeLevels(NamedTuple):
+    trade_id: str
+    symbol: str
+    sl: float
+    tp: float
+    trail_activation: Optional[float] = None  # Giá bắt đầu kéo SL (None = không trailing)
+    trail_distance: float = 0.0               # SL mới = giá - trail_distance
+
+class TriggerHit(NamedTuple):
+    trade_id: str
+    symbol: str
+    reason: str   # "SL" | "TP"
+    price: float  # Giá tick gây kích hoạt
+    level: float  # Mức SL/TP bị chạm
+
+class _SymbolBook:
+    def __init__(self):
+        self.sl: List[tuple] = []
+        self.tp: List[tuple] = []
+        self.trail: List[tuple] = []
+        self.active: List[tuple] = []
+        self.levels: Dict[str, TradeLevels] = {}
+        self.high = float("-inf")
+
+    def add(self, lv: TradeLevels):
+        self.levels[lv.trade_id] = lv
+        insort(self.sl, (lv.sl, lv.trade_id)); insort(self.tp, (lv.tp, lv.trade_id))
+        if lv.trail_activation is not None: insort(self.trail, (lv.trail_activation, lv.trade_id))
+
+    @staticmethod
+    def _discard(arr: List[tuple], key: tuple):
+        i = bisect_left(arr, key)
+        if i < len(arr) and arr[i] == key: del arr[i]
+
+    def remove(self, trade_id: str):
+        lv = self.levels.pop(trade_id, None)
+        if lv is None: return
+        self._discard(self.sl, (lv.sl, trade_id)); self._discard(self.tp, (lv.tp, trade_id))
+        if lv.trail_activation is not None:
+            self._discard(self.trail, (lv.trail_activation, trade_id)); self._discard(self.active, (lv.trail_distance, trade_id))
+
+    def trailed(self) -> Dict[str, float]:
+        """trade_id -> SL trailing hiện tại, chỉ những lệnh mà SL trailing đã vượt SL cố định."""
+        out = {}
+        for distance, tid in self.active:
+            new_sl = self.high - distance
+            if new_sl > self.levels[tid].sl: out[tid] = new_sl
+        return out
+
+    def raise_sl(self, trade_id: str, new_sl: float):
+        lv = self.levels[trade_id]
+        self._discard(self.sl, (lv.sl, trade_id)); insort(self.sl, (new_sl, trade_id))
+        self.levels[trade_id] = lv._replace(sl=new_sl)
+
+    def on_price(self, symbol: str, price: float) -> List[TriggerHit]:
+        hits = [TriggerHit(tid, symbol, "SL", price, level) for level, tid in self.sl[bisect_left(self.sl, (price, "")):]]
+        hit_ids = {h.trade_id for h in hits}
+        if self.active and price < self.high:
+            for distance, tid in self.active[:bisect_right(self.active, (self.high - price, _MAX_ID))]:
+                if tid not in hit_ids: hits.append(TriggerHit(tid, symbol, "SL", price, self.high - distance)); hit_ids.add(tid)
+        hits += [TriggerHit(tid, symbol, "TP", price, level) for level, tid in self.tp[:bisect_right(self.tp, (price, _MAX_ID))] if tid not in hit_ids]
+        for h in hits: self.remove(h.trade_id)
+        if price > self.high:
+            self.high = price
+            k = bisect_right(self.trail, (price, _MAX_ID))
+            for _, tid in self.trail[:k]: insort(self.active, (self.levels[tid].trail_distance, tid))
+            del self.trail[:k]
+        return hits
+
+class TriggerEngine:
+    """Sổ SL/TP của mọi lệnh đang mở, an toàn khi gọi on_price() từ luồng websocket và sync() từ luồng chính."""
+    def __init__(self, on_hits: Callable[[List[TriggerHit]], None]):
+        self.on_hits = on_hits
+        self._lock = threading.Lock()
+        self._books: Dict[str, _SymbolBook] = {}
+        self._hit_sl: Dict[str, float] = {}  # Mức SL (có thể đã trailing) của lệnh vừa bị gỡ khỏi sổ vì chạm SL
+        self.last_price: Dict[str, float] = {}
+
+    def sync(self, levels: Iterable[TradeLevels]):
+        """Dựng lại sổ từ state. SL đã kéo nhưng state chưa kịp ghi (kể cả lệnh đã chạm SL mà chưa đóng được) thì giữ mức cao hơn."""
+        books: Dict[str, _SymbolBook] = {}
+        with self._lock:
+            trailed = dict(self._hit_sl); self._hit_sl = {}
+            for book in self._books.values():
+                for tid, sl in book.trailed().items(): trailed[tid] = max(sl, trailed.get(tid, sl))
+            for lv in levels:
+                sl = max(lv.sl, trailed.get(lv.trade_id, float("-inf")))
+                books.setdefault(lv.symbol, _SymbolBook()).add(lv._replace(sl=sl))
+            self._books = books
+
+    def symbols(self) -> List[str]:
+        with self._lock: return sorted(self._books)
+
+    def pop_trailed(self) -> Dict[str, float]:
+        """SL trailing mới kể từ lần gọi trước (live_trade ghi vào state). Mức đã trả về được chốt thành SL cố định của sổ."""
+        out = {}
+        with self._lock:
+            for book in self._books.values():
+                for tid, new_sl in book.trailed().items():
+                    book.raise_sl(tid, new_sl); out[tid] = new_sl
+        return out
+
+    def on_price(self, symbol: str, price: float):
+        with self._lock:
+            self.last_price[symbol] = price
+            book = self._books.get(symbol)
+            hits = book.on_price(symbol, price) if book else []
+            for h in hits:
+                if h.reason == "SL": self._hit_sl[h.trade_id] = h.level
+        if hits: self.on_hits(hits)
+
+class PriceStream:
+    """aggTrade websocket cho các symbol của TriggerEngine. Chạy trên 1 luồng nền, tự kết nối lại khi rớt mạng."""
+    URLS = {"live": "wss://stream.binance.com:9443/ws", "testnet": "wss://stream.testnet.binance.vision/ws"}
+    RECONNECT_SECONDS = 5
+
+    def __init__(self, network: str, on_price: Callable[[str, float], None], log: Callable[[str], None] = print):
+        if websocket is None: raise ImportError("Thiếu thư viện websocket-client (pip install websocket-client).")
+        self.url = self.URLS[network]
+        self.on_price, self.log = on_price, log
+        self._symbols: set = set()
+        self._ws = None
+        self._msg_id = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.last_message_at = 0.0
+
+    def _send(self, method: str, symbols: Iterable[str]):
+        params = [f"{s.lower()}@aggTrade" for s in symbols]
+        if not params or self._ws is None: return
+        self._msg_id += 1
+        try: self._ws.send(json.dumps({"method": method, "params": params, "id": self._msg_id}))
+        except Exception as e: self.log(f"⚠️ PriceStream: không gửi được {method}: {e}")
+
+    def set_symbols(self, symbols: Iterable[str]):
+        with self._lock:
+            new = set(symbols)
+            added, removed = new - self._symbols, self._symbols - new
+            self._symbols = new
+            self._send("UNSUBSCRIBE", removed); self._send("SUBSCRIBE", added)
+
+    def _on_open(self, ws):
+        with self._lock: self._send("SUBSCRIBE", self._symbols)
+
+    def _on_message(self, ws, message: str):
+        self.last_message_at = time.time()
+        data = json.loads(message)
+        if data.get("e") == "aggTrade": self.on_price(data["s"], float(data["p"]))
+
+    def _run(self):
+        while not self._stopped.is_set():
+            ws = websocket.WebSocketApp(self.url, on_open=self._on_open, on_message=self._on_message,
+                                        on_error=lambda ws, e: self.log(f"⚠️ PriceStream lỗi: {e}"))
+            with self._lock: self._ws = ws
+            ws.run_forever(ping_interval=20, ping_timeout=10)
+            with self._lock: self._ws = None
+            if self._stopped.wait(self.RECONNECT_SECONDS): break
+            self.log("🔌 PriceStream mất kết nối, đang kết nối lại...")
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="price-stream", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        with self._lock: ws = self._ws
+        if ws is not None: ws.close()
@@ -7,21 +7,21 @@
 #   xóa đối tượng model và gọi bộ thu gom rác của Python & Keras.
 # ===================================================================
 
-import os, sys, json, time, requests, joblib, gc # <--- Thêm import gc
+import os, sys, json, time, requests, joblib, gc, glob, hashlib # <--- Thêm import gc
 import pandas as pd, numpy as np, ta
+from numpy.lib.stride_tricks import sliding_window_view
 from datetime import datetime, timezone
 from zoneinfo import ZoneInfo
 from dotenv import load_dotenv
 from typing import List, Dict, Optional
 from itertools import groupby
+from contextlib import contextmanager
 
-# --- TF & Keras Imports (Yên lặng) ---
+# --- TF & Keras Imports (Yên lặng, chỉ import khi thật sự cần load model) ---
 os.environ.setdefault("TF_CPP_MIN_LOG_LEVEL", "3")
 import warnings
 warnings.filterwarnings("ignore", category=UserWarning)
-import tensorflow as tf
-tf.get_logger().setLevel("ERROR")
-from keras.models import load_model
+from model_server import request_server, current_rss_mb
 
 # --------------------------------------------------
 # CONFIG & CONSTANTS (Không thay đổi)
@@ -37,10 +37,16 @@ ERROR_WEBHOOK = os.getenv("DISCORD_ERROR_WEBHOOK")
 ENSEMBLE_WEIGHTS = {"lightgbm": 0.25, "lstm": 0.35, "transformer": 0.40}
 SEQUENCE_LENGTH = 60
 API_LIMIT = SEQUENCE_LENGTH + 200
+POOLED_KEY = "POOLED"  # Bộ model gộp nhiều symbol của trainer.py --pooled: model_POOLED_<arch>_<kind>_<interval>.*
+USE_TFLITE = os.getenv("AI_USE_TFLITE", "1") == "1"  # Ưu tiên bản .tflite (đã qua kiểm tra sai lệch lúc train)
 
 DATA_DIR = os.path.join(BASE_DIR, "data")
 LOG_DIR = os.path.join(BASE_DIR, "ai_logs")
 STATE_FILE = os.path.join(BASE_DIR, "ml_state.json")
+INFERENCE_CACHE_FILE = os.path.join(BASE_DIR, "ml_inference_cache.json")
+METRICS_FILE = os.path.join(LOG_DIR, "ml_metrics.jsonl")             # 1 dòng / run
+METRICS_SUMMARY_FILE = os.path.join(LOG_DIR, "ml_metrics_summary.json")  # p50/p95 qua các run gần nhất
+METRICS_HISTORY = 200
 os.makedirs(LOG_DIR, exist_ok=True)
 
 COOLDOWN_BY_LEVEL = {"STRONG_BUY": 3600, "PANIC_SELL": 3600, "BUY": 7200, "SELL": 7200, "WEAK_BUY": 14400, "WEAK_SELL": 14400, "HOLD": 28800, "AVOID": 28800}
@@ -51,6 +57,76 @@ SUB_LEVEL_INFO = {"HOLD_BULLISH": {"icon": "📈", "name": "HOLD (Thiên Tăng)"
 # CÁC HÀM HELPER (Không thay đổi)
 # --------------------------------------------------
 def get_sub_info(key: str) -> dict: return SUB_LEVEL_INFO.get(key, SUB_LEVEL_INFO["DEFAULT"])
+
+# --------------------------------------------------
+# ĐO THỜI GIAN & RAM THEO TỪNG GIAI ĐOẠN
+# --------------------------------------------------
+_run_metrics: Dict[str, Dict[str, list]] = {}  # "SYM-iv" -> {stage: [ms, rss_delta_mb]}
+@contextmanager
+def timed(key: str, stage: str):
+    rss0, t0 = current_rss_mb(), time.perf_counter()
+    try: yield
+    finally:
+        _run_metrics.setdefault(key, {})[stage] = [round((time.perf_counter() - t0) * 1000, 1), round(current_rss_mb() - rss0, 1)]
+def pop_metrics(key: str) -> Dict[str, list]: return _run_metrics.pop(key, {})
+def percentile(values: list, q: float) -> float:
+    vals = sorted(values)
+    if not vals: return 0.0
+    k = (len(vals) - 1) * q; lo = int(k); hi = min(lo + 1, len(vals) - 1)
+    return vals[lo] + (vals[hi] - vals[lo]) * (k - lo)
+def write_run_metrics(run_started: float):
+    """Ghi 1 dòng metrics cho run này, giữ METRICS_HISTORY run gần nhất và cập nhật rollup p50/p95."""
+    record = {"ts": int(time.time()), "total_ms": round((time.perf_counter() - run_started) * 1000, 1),
+              "rss_mb": round(current_rss_mb(), 1), "tasks": {k: v for k, v in _run_metrics.items() if v}}
+    _run_metrics.clear()
+    lines = []
+    if os.path.exists(METRICS_FILE):
+        with open(METRICS_FILE, encoding="utf-8") as f: lines = f.read().splitlines()[-(METRICS_HISTORY - 1):]
+    lines.append(json.dumps(record, separators=(",", ":")))
+    tmp = METRICS_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f: f.write("\n".join(lines) + "\n")
+    os.replace(tmp, METRICS_FILE)
+
+    samples: Dict[str, Dict[str, list]] = {}
+    for line in lines:
+        try: run = json.loads(line)
+        except ValueError: continue
+        for key, stages in run.get("tasks", {}).items():
+            if not stages: continue  # Dòng cũ có thể chứa task rỗng (server trả no_model)
+            for stage, (ms, _) in stages.items(): samples.setdefault(key, {}).setdefault(stage, []).append(ms)
+            samples.setdefault(key, {}).setdefault("_total", []).append(sum(v[0] for v in stages.values()))
+    summary = {key: {stage: {"p50": round(percentile(v, 0.5), 1), "p95": round(percentile(v, 0.95), 1), "n": len(v)} for stage, v in stages.items()}
+               for key, stages in sorted(samples.items(), key=lambda kv: -percentile(kv[1]["_total"], 0.95))}
+    atomic_write_json(METRICS_SUMMARY_FILE, {"runs": len(lines), "updated": record["ts"], "tasks": summary})
+    slowest = list(summary.items())[:3]
+    if slowest: print("     ⏱️ Chậm nhất (p95): " + ", ".join(f"{k} {v['_total']['p95']:.0f}ms" for k, v in slowest))
+def interval_to_ms(interval: str) -> Optional[int]:
+    unit_ms = {"m": 60_000, "h": 3_600_000, "d": 86_400_000, "w": 604_800_000}
+    try: return int(interval[:-1]) * unit_ms[interval[-1]]
+    except (KeyError, ValueError): return None
+WEEK_OPEN_OFFSET_MS = 4 * 86_400_000  # 1970-01-01 (thứ Năm) -> 1970-01-05 (thứ Hai)
+def last_closed_candle_open_ms(interval: str, now_ms: Optional[int] = None) -> Optional[int]:
+    """Open time (ms) của nến đã đóng gần nhất, tính từ đồng hồ (không cần gọi API).
+    Nến tuần của Binance mở lúc 00:00 UTC thứ Hai, còn epoch Unix là thứ Năm -> lệch 4 ngày."""
+    step = interval_to_ms(interval)
+    if step is None: return None
+    now_ms = now_ms if now_ms is not None else int(time.time() * 1000)
+    offset = WEEK_OPEN_OFFSET_MS if interval.endswith("w") else 0
+    return ((now_ms - offset) // step) * step - step + offset
+def model_fingerprint(symbol: str, interval: str) -> str:
+    """Dấu vân tay bộ model (tên + kích thước + mtime của meta/scaler/model files). Đổi khi train lại."""
+    paths = sorted(glob.glob(os.path.join(DATA_DIR, f"model_{symbol}_*_{interval}.*")) + [os.path.join(DATA_DIR, f"meta_{symbol}_{interval}.json"), os.path.join(DATA_DIR, f"scaler_{symbol}_{interval}.pkl")])
+    h = hashlib.sha1()
+    for p in paths:
+        try: st = os.stat(p)
+        except OSError: continue
+        h.update(f"{os.path.basename(p)}:{st.st_size}:{st.st_mtime_ns};".encode())
+    return h.hexdigest()
+def get_live_price(symbol: str) -> Optional[float]:
+    try:
+        r = requests.get("https://api.binance.com/api/v3/ticker/price", params={"symbol": symbol}, timeout=10)
+        r.raise_for_status(); return float(r.json()["price"])
+    except Exception as e: print(f"[WARN] get_live_price {symbol}: {e}"); return None
 def get_price_data(symbol: str, interval: str, limit: int) -> pd.DataFrame:
     try:
         r = requests.get("https://api.binance.com/api/v3/klines", params={"symbol": symbol, "interval": interval, "limit": limit}, timeout=10)
@@ -70,49 +146,126 @@ def add_features(df: pd.DataFrame) -> pd.DataFrame:
     for n in [1, 2, 3, 5, 8, 13, 21]: out[f'pct_change_lag_{n}'] = close.pct_change(periods=n)
     out.replace([np.inf, -np.inf], np.nan, inplace=True); out.bfill(inplace=True); out.ffill(inplace=True); out.fillna(0, inplace=True)
     return out
+def load_model(path: str):
+    import tensorflow as tf
+    tf.get_logger().setLevel("ERROR")
+    from keras.models import load_model as _keras_load_model
+    return _keras_load_model(path, compile=False)
+def _tflite_interpreter_cls():
+    """tflite_runtime / ai_edge_litert nhẹ hơn nhiều; chỉ rơi về TensorFlow khi không có."""
+    try: from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        try: from ai_edge_litert.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+    return Interpreter
+class LiteModel:
+    """Bọc TFLite Interpreter với API giống Keras `.predict`. Model 2 đầu ra được xuất thành 1 tensor [n, 4]."""
+    def __init__(self, path: str, multi_head: bool = False):
+        self.interpreter = _tflite_interpreter_cls()(model_path=path)
+        self.multi_head = multi_head
+        self._in = self.interpreter.get_input_details()[0]['index']
+        self._out = self.interpreter.get_output_details()[0]['index']
+        self._shape = None
+    def predict(self, x: np.ndarray, verbose: int = 0, batch_size: Optional[int] = None):
+        x = np.ascontiguousarray(x, dtype=np.float32)
+        if x.shape != self._shape:
+            self.interpreter.resize_tensor_input(self._in, x.shape); self.interpreter.allocate_tensors(); self._shape = x.shape
+        self.interpreter.set_tensor(self._in, x); self.interpreter.invoke()
+        out = self.interpreter.get_tensor(self._out)
+        return [out[:, :3], out[:, 3:]] if self.multi_head else out
+def load_sequence_model(symbol: str, arch: str, kind: str, interval: str, meta: dict):
+    tflite_path = os.path.join(DATA_DIR, f"model_{symbol}_{arch}_{kind}_{interval}.tflite")
+    if USE_TFLITE and meta.get("tflite", {}).get(f"{arch}_{kind}", {}).get("ok") and os.path.exists(tflite_path):
+        return LiteModel(tflite_path, multi_head=(kind == "multi"))
+    return load_model(os.path.join(DATA_DIR, f"model_{symbol}_{arch}_{kind}_{interval}.keras"))
+def release_keras_memory():
+    if "tensorflow" in sys.modules: sys.modules["tensorflow"].keras.backend.clear_session()
 def create_sequences(data: pd.DataFrame, feature_cols: list, seq_length: int) -> np.ndarray:
-    X = []; num_features = len(feature_cols)
-    values = data[feature_cols].values
-    for i in range(len(data) - seq_length + 1): X.append(values[i:(i + seq_length)])
-    return np.array(X).reshape(-1, seq_length, num_features)
+    """Mọi cửa sổ seq_length nến dưới dạng view (không sao chép): shape (N - seq + 1, seq, F)."""
+    values = np.ascontiguousarray(data[feature_cols].to_numpy(dtype=np.float32))
+    if len(values) < seq_length: return np.empty((0, seq_length, len(feature_cols)), dtype=np.float32)
+    return sliding_window_view(values, seq_length, axis=0).transpose(0, 2, 1)
+class BoosterModel:
+    """lgb.Booster (load từ file text gốc hoặc đã unpickle), với API predict/predict_proba/classes_ như wrapper sklearn."""
+    def __init__(self, booster, classes: Optional[list] = None):
+        if isinstance(booster, str):
+            import lightgbm as lgb
+            booster = lgb.Booster(model_file=booster)
+        self.booster = booster
+        self.classes_ = np.asarray(classes if classes is not None else [])
+    def predict_proba(self, X: np.ndarray) -> np.ndarray: return self.booster.predict(X)
+    def predict(self, X: np.ndarray) -> np.ndarray: return self.booster.predict(X)
+def load_lgbm(symbol: str, kind: str, interval: str, meta: dict):
+    txt_path = os.path.join(DATA_DIR, f"model_{symbol}_lgbm_{kind}_{interval}.txt")
+    if os.path.exists(txt_path) and (kind == "reg" or meta.get("lgbm_classes")):
+        return BoosterModel(txt_path, meta.get("lgbm_classes") if kind == "clf" else None)
+    model = joblib.load(os.path.join(DATA_DIR, f"model_{symbol}_lgbm_{kind}_{interval}.pkl"))
+    # Model cũ: wrapper sklearn; model mới: pickle của lgb.Booster
+    return model if hasattr(model, "predict_proba") else BoosterModel(model, meta.get("lgbm_classes") if kind == "clf" else None)
 class AIModelBundle:
     def __init__(self, symbol: str, interval: str):
         self.clf_lgbm, self.reg_lgbm, self.clf_lstm, self.reg_lstm, self.clf_trans, self.reg_trans = (None,) * 6
         self.scaler, self.meta = None, None
+        self.multi = {}  # arch -> model 2 đầu ra (clf, reg) nếu được train với MULTI_HEAD=1
+        key = f"{symbol}-{interval}"
         try:
-            self.meta = json.load(open(os.path.join(DATA_DIR, f"meta_{symbol}_{interval}.json")))
-            self.scaler = joblib.load(os.path.join(DATA_DIR, f"scaler_{symbol}_{interval}.pkl"))
-            self.clf_lgbm = joblib.load(os.path.join(DATA_DIR, f"model_{symbol}_lgbm_clf_{interval}.pkl"))
-            self.reg_lgbm = joblib.load(os.path.join(DATA_DIR, f"model_{symbol}_lgbm_reg_{interval}.pkl"))
-            self.clf_lstm = load_model(os.path.join(DATA_DIR, f"model_{symbol}_lstm_clf_{interval}.keras"), compile=False)
-            self.reg_lstm = load_model(os.path.join(DATA_DIR, f"model_{symbol}_lstm_reg_{interval}.keras"), compile=False)
-            self.clf_trans = load_model(os.path.join(DATA_DIR, f"model_{symbol}_transformer_clf_{interval}.keras"), compile=False)
-            self.reg_trans = load_model(os.path.join(DATA_DIR, f"model_{symbol}_transformer_reg_{interval}.keras"), compile=False)
+            with timed(key, "load_meta_scaler"):
+                self.meta = json.load(open(os.path.join(DATA_DIR, f"meta_{symbol}_{interval}.json")))
+                self.scaler = joblib.load(os.path.join(DATA_DIR, f"scaler_{symbol}_{interval}.pkl"))
+            with timed(key, "load_lightgbm"):
+                self.clf_lgbm = load_lgbm(symbol, "clf", interval, self.meta)
+                self.reg_lgbm = load_lgbm(symbol, "reg", interval, self.meta)
+            for arch, attr in (("lstm", "lstm"), ("transformer", "trans")):
+                with timed(key, f"load_{arch}"):
+                    if self.meta.get("multi_head"):
+                        self.multi[arch] = load_sequence_model(symbol, arch, "multi", interval, self.meta); continue
+                    # Bố cục cũ: 2 file riêng cho classifier và regressor
+                    setattr(self, f"clf_{attr}", load_sequence_model(symbol, arch, "clf", interval, self.meta))
+                    setattr(self, f"reg_{attr}", load_sequence_model(symbol, arch, "reg", interval, self.meta))
         except Exception: self.meta = None
     def is_valid(self): return self.meta is not None
+    def predict_seq(self, arch: str, seq: np.ndarray, batch_size: int = 512):
+        """Trả về (xác suất 3 lớp [n, 3], % dự đoán [n]) của 1 kiến trúc chuỗi ('lstm' / 'transformer')."""
+        if arch in self.multi:
+            clf_prob, reg_pred = self.multi[arch].predict(seq, verbose=0, batch_size=batch_size)  # 1 lượt forward cho cả 2 đầu ra
+        else:
+            attr = "lstm" if arch == "lstm" else "trans"
+            clf_prob = getattr(self, f"clf_{attr}").predict(seq, verbose=0, batch_size=batch_size)
+            reg_pred = getattr(self, f"reg_{attr}").predict(seq, verbose=0, batch_size=batch_size)
+        return np.asarray(clf_prob), np.asarray(reg_pred).reshape(-1)
 def analyze_ensemble(symbol: str, interval: str, bundle: AIModelBundle) -> Optional[Dict]:
-    df = get_price_data(symbol, interval, API_LIMIT)
-    if df.empty or len(df) < SEQUENCE_LENGTH + 50: return None
-    features_df = add_features(df)
+    key = f"{symbol}-{interval}"
+    with timed(key, "fetch_klines"): df = get_price_data(symbol, interval, API_LIMIT)
+    if df.empty: return None
+    live_price = float(df['close'].iloc[-1])
+    # Chỉ chấm điểm trên nến ĐÃ ĐÓNG để kết quả ổn định giữa 2 lần đóng nến (cho phép cache)
+    closed_open = last_closed_candle_open_ms(interval)
+    if closed_open is not None: df = df[df.index <= pd.Timestamp(closed_open, unit="ms", tz="UTC")]
+    if len(df) < SEQUENCE_LENGTH + 50: return None
+    with timed(key, "add_features"): features_df = add_features(df)
     features_to_use = bundle.meta['features']
     opinions = {}
-    latest_row = features_df[features_to_use].iloc[[-1]]
-    lgbm_clf_prob = bundle.clf_lgbm.predict_proba(latest_row)[0]
-    lgbm_reg_pred = bundle.reg_lgbm.predict(latest_row)[0]
+    latest_row = features_df[features_to_use].to_numpy(dtype=np.float32)[-1:]
+    with timed(key, "infer_lightgbm"):
+        lgbm_clf_prob = bundle.clf_lgbm.predict_proba(latest_row)[0]
+        lgbm_reg_pred = bundle.reg_lgbm.predict(latest_row)[0]
     lgbm_classes = bundle.clf_lgbm.classes_.tolist()
     prob_sell_lgbm = lgbm_clf_prob[lgbm_classes.index(0)] if 0 in lgbm_classes else 0
     prob_buy_lgbm = lgbm_clf_prob[lgbm_classes.index(2)] if 2 in lgbm_classes else 0
     opinions['lightgbm'] = {"prob_sell": prob_sell_lgbm * 100, "prob_buy": prob_buy_lgbm * 100, "pct": float(lgbm_reg_pred)}
-    scaled_df = features_df.copy(); scaled_df[features_to_use] = bundle.scaler.transform(features_df[features_to_use])
-    sequence = create_sequences(scaled_df, features_to_use, SEQUENCE_LENGTH)
+    with timed(key, "scale_window"):
+        scaled_df = features_df.copy(); scaled_df[features_to_use] = bundle.scaler.transform(features_df[features_to_use])
+        sequence = create_sequences(scaled_df, features_to_use, SEQUENCE_LENGTH)
     if len(sequence) > 0:
         seq_to_predict = sequence[[-1]]
-        lstm_clf_prob = bundle.clf_lstm.predict(seq_to_predict, verbose=0)[0]
-        lstm_reg_pred = bundle.reg_lstm.predict(seq_to_predict, verbose=0)[0][0]
-        opinions['lstm'] = {"prob_sell": float(lstm_clf_prob[0]) * 100, "prob_buy": float(lstm_clf_prob[2]) * 100, "pct": float(lstm_reg_pred)}
-        trans_clf_prob = bundle.clf_trans.predict(seq_to_predict, verbose=0)[0]
-        trans_reg_pred = bundle.reg_trans.predict(seq_to_predict, verbose=0)[0][0]
-        opinions['transformer'] = {"prob_sell": float(trans_clf_prob[0]) * 100, "prob_buy": float(trans_clf_prob[2]) * 100, "pct": float(trans_reg_pred)}
+        for arch in ('lstm', 'transformer'):
+            with timed(key, f"infer_{arch}"): clf_prob, reg_pred = bundle.predict_seq(arch, seq_to_predict)
+            opinions[arch] = {"prob_sell": float(clf_prob[0][0]) * 100, "prob_buy": float(clf_prob[0][2]) * 100, "pct": float(reg_pred[0])}
+    return build_result(symbol, interval, opinions, live_price, int(features_df.index[-1].timestamp() * 1000))
+def build_result(symbol: str, interval: str, opinions: Dict[str, Dict], live_price: float, candle_open: int) -> Optional[Dict]:
+    """Trộn ý kiến các model theo ENSEMBLE_WEIGHTS, phân loại level và tính TP/SL."""
     if not opinions: return None
     final_prob_buy, final_prob_sell, final_pct, total_weight = 0.0, 0.0, 0.0, sum(ENSEMBLE_WEIGHTS[k] for k in opinions)
     if total_weight == 0: return None
@@ -123,16 +276,89 @@ def analyze_ensemble(symbol: str, interval: str, bundle: AIModelBundle) -> Optio
     if len(opinions) > 2:
         buys = sum(1 for op in opinions.values() if op['pct'] > 0.1); sells = sum(1 for op in opinions.values() if op['pct'] < -0.1)
         if buys > 0 and sells > 0 and lv['level'] in ['BUY', 'SELL']: lv = {"level": "AVOID", "sub_level": "AVOID_CONFLICT"}
-    price = features_df.iloc[-1]['close']
-    risk = {"STRONG_BUY":1/3,"BUY":1/2.5,"WEAK_BUY":1/2,"HOLD":1/1.5,"AVOID":1/1.5,"WEAK_SELL":1/2,"SELL":1/2.5,"PANIC_SELL":1/3}.get(lv['level'],1/1.5)
-    dir_ = 1 if final_pct >= 0 else -1; tp_pct = max(abs(final_pct), 0.5); sl_pct = tp_pct * risk
     return {
         "symbol": symbol, "interval": interval,
         "prob_buy": round(final_prob_buy, 1), "prob_sell": round(final_prob_sell, 1), "pct": final_pct,
-        "price": price, "tp": price * (1 + dir_ * tp_pct / 100), "sl": price * (1 - dir_ * sl_pct / 100),
+        **price_targets(live_price, final_pct, lv['level']),
         "level": lv['level'], "sub_level": lv['sub_level'],
+        "candle_open": candle_open,
         "expert_opinions": {name: {"pct": round(op['pct'], 4), "prob_buy": round(op['prob_buy'], 1), "prob_sell": round(op['prob_sell'], 1)} for name, op in opinions.items()}
     }
+def pooled_symbols(interval: str) -> List[str]:
+    """Các symbol được phủ bởi model gộp của interval (train bằng `trainer.py --pooled`)."""
+    try: return json.load(open(os.path.join(DATA_DIR, f"meta_{POOLED_KEY}_{interval}.json"))).get("symbols", [])
+    except (OSError, ValueError): return []
+def analyze_pooled(interval: str, bundle: AIModelBundle, symbols: List[str]) -> Dict[str, Dict]:
+    """Chấm điểm nhiều symbol bằng model gộp: mỗi model chạy 1 lần trên batch gồm mọi symbol.
+    bundle = AIModelBundle(POOLED_KEY, interval); bundle.scaler là dict {symbol: StandardScaler}."""
+    key = f"{POOLED_KEY}-{interval}"
+    features_to_use = bundle.meta['features']
+    symbol_ids = {s: i for i, s in enumerate(bundle.meta['symbols'])}
+    closed_open = last_closed_candle_open_ms(interval)
+    rows, windows, ids, info = [], [], [], []
+    with timed(key, "fetch_and_features"):
+        for symbol in symbols:
+            if symbol not in symbol_ids: continue
+            df = get_price_data(symbol, interval, API_LIMIT)
+            if df.empty: continue
+            live_price = float(df['close'].iloc[-1])
+            if closed_open is not None: df = df[df.index <= pd.Timestamp(closed_open, unit="ms", tz="UTC")]
+            if len(df) < SEQUENCE_LENGTH + 50: continue
+            features_df = add_features(df)
+            scaled = bundle.scaler[symbol].transform(features_df[features_to_use]).astype(np.float32)
+            rows.append(np.append(scaled[-1], symbol_ids[symbol])); windows.append(scaled[-SEQUENCE_LENGTH:]); ids.append(symbol_ids[symbol])
+            info.append((symbol, live_price, int(features_df.index[-1].timestamp() * 1000)))
+    if not info: return {}
+    X_rows = np.asarray(rows, dtype=np.float32)
+    X_seq, X_ids = np.stack(windows), np.asarray(ids, dtype=np.int32)[:, None]
+    with timed(key, "infer_lightgbm"):
+        lgbm_prob, lgbm_reg = bundle.clf_lgbm.predict_proba(X_rows), bundle.reg_lgbm.predict(X_rows)
+    lgbm_classes = bundle.clf_lgbm.classes_.tolist()
+    seq_out = {}
+    for arch in ('lstm', 'transformer'):
+        with timed(key, f"infer_{arch}"): seq_out[arch] = bundle.predict_seq(arch, [X_seq, X_ids])
+    results = {}
+    for j, (symbol, live_price, candle_open) in enumerate(info):
+        opinions = {'lightgbm': {"prob_sell": (lgbm_prob[j][lgbm_classes.index(0)] if 0 in lgbm_classes else 0) * 100,
+                                 "prob_buy": (lgbm_prob[j][lgbm_classes.index(2)] if 2 in lgbm_classes else 0) * 100, "pct": float(lgbm_reg[j])}}
+        for arch, (clf_prob, reg_pred) in seq_out.items():
+            opinions[arch] = {"prob_sell": float(clf_prob[j][0]) * 100, "prob_buy": float(clf_prob[j][2]) * 100, "pct": float(reg_pred[j])}
+        results[symbol] = build_result(symbol, interval, opinions, live_price, candle_open)
+    return results
+def price_targets(price: float, final_pct: float, level: str) -> Dict[str, float]:
+    risk = {"STRONG_BUY":1/3,"BUY":1/2.5,"WEAK_BUY":1/2,"HOLD":1/1.5,"AVOID":1/1.5,"WEAK_SELL":1/2,"SELL":1/2.5,"PANIC_SELL":1/3}.get(level,1/1.5)
+    dir_ = 1 if final_pct >= 0 else -1; tp_pct = max(abs(final_pct), 0.5); sl_pct = tp_pct * risk
+    return {"price": price, "tp": price * (1 + dir_ * tp_pct / 100), "sl": price * (1 - dir_ * sl_pct / 100)}
+def predict_history(bundle: AIModelBundle, features_df: pd.DataFrame, chunk_size: int = 2048) -> pd.DataFrame:
+    """Chạy ensemble trên toàn bộ nến lịch sử (dùng cho backtest). Chuỗi cho nến i là [i-SEQ, i).
+    Mọi cửa sổ là view strided; mỗi model chạy theo batch lớn thay vì từng nến, rồi trộn bằng trọng số vector."""
+    out = pd.DataFrame({'ai_prob_buy': 50.0, 'ai_prob_sell': 0.0, 'ai_pct': 0.0}, index=features_df.index)
+    if len(features_df) <= SEQUENCE_LENGTH: return out
+    features_to_use = bundle.meta['features']
+    X = features_df[features_to_use]
+    scaled = np.ascontiguousarray(bundle.scaler.transform(X), dtype=np.float32)
+    windows = sliding_window_view(scaled, SEQUENCE_LENGTH, axis=0).transpose(0, 2, 1)[:-1]  # windows[j] -> nến SEQ + j
+
+    # Mỗi model -> ma trận [n, 3] gồm (prob_buy, prob_sell, pct)
+    lgbm_rows = X.to_numpy(dtype=np.float32)[SEQUENCE_LENGTH:]
+    lgbm_prob = bundle.clf_lgbm.predict_proba(lgbm_rows)
+    lgbm_classes = bundle.clf_lgbm.classes_.tolist()
+    zeros = np.zeros(len(lgbm_rows))
+    preds = {'lightgbm': np.column_stack([
+        lgbm_prob[:, lgbm_classes.index(2)] if 2 in lgbm_classes else zeros,
+        lgbm_prob[:, lgbm_classes.index(0)] if 0 in lgbm_classes else zeros,
+        bundle.reg_lgbm.predict(lgbm_rows)])}
+    for arch in ('lstm', 'transformer'):
+        parts = []
+        for start in range(0, len(windows), chunk_size):
+            clf_prob, reg_pred = bundle.predict_seq(arch, np.ascontiguousarray(windows[start:start + chunk_size]))
+            parts.append(np.column_stack([clf_prob[:, 2], clf_prob[:, 0], reg_pred]))
+        preds[arch] = np.concatenate(parts)
+
+    weights = np.array([ENSEMBLE_WEIGHTS[k] for k in preds])
+    blended = np.tensordot(weights, np.stack([preds[k] for k in preds]), axes=1) * np.array([100.0, 100.0, 1.0])
+    out.iloc[SEQUENCE_LENGTH:, :] = blended
+    return out
 def classify_level(pb: float, ps: float, pct: float, interval: str) -> Dict[str, str]:
     if pb > 70 and pb > ps * 2: return {"level": "STRONG_BUY", "sub_level": "STRONG_BUY"}
     if ps > 70 and ps > pb * 2: return {"level": "PANIC_SELL", "sub_level": "PANIC_SELL"}
@@ -157,6 +383,32 @@ def send_discord(payload: Dict):
         requests.post(WEBHOOK_URL, json=payload, timeout=15).raise_for_status()
         time.sleep(1)
     except Exception as e: print(f"[ERROR] Discord send failed: {e}")
+def load_inference_cache() -> dict:
+    if not os.path.exists(INFERENCE_CACHE_FILE): return {}
+    try: return json.load(open(INFERENCE_CACHE_FILE))
+    except Exception: return {}
+def is_cached(cache: dict, key: str, candle_open: Optional[int], fingerprint: str) -> bool:
+    entry = cache.get(key)
+    return candle_open is not None and bool(entry) and entry.get("candle_open") == candle_open and entry.get("fingerprint") == fingerprint
+def cached_result(cache: dict, key: str, candle_open: Optional[int], fingerprint: str) -> Optional[Dict]:
+    """Trả kết quả đã cache nếu chưa có nến mới đóng và model không đổi; giá/TP/SL được làm mới theo giá hiện tại."""
+    if not is_cached(cache, key, candle_open, fingerprint): return None
+    res = dict(cache[key]["result"])
+    price = get_live_price(res["symbol"])
+    if price is not None: res.update(price_targets(price, res["pct"], res["level"]))
+    return res
+def score_pooled(interval: str, symbols: List[str], use_server: bool) -> Dict[str, Dict]:
+    resp = request_server({"op": "analyze_pooled", "interval": interval, "symbols": symbols}) if use_server else None
+    if resp is not None:
+        if resp.get("metrics"): _run_metrics.setdefault(f"{POOLED_KEY}-{interval}", {}).update(resp["metrics"])
+        return resp.get("result") or {}
+    bundle = AIModelBundle(POOLED_KEY, interval)
+    if not bundle.is_valid(): return {}
+    results = analyze_pooled(interval, bundle, symbols)
+    del bundle
+    release_keras_memory()
+    gc.collect()
+    return results
 def load_state():
     if not os.path.exists(STATE_FILE): return {}
     try: return json.load(open(STATE_FILE))
@@ -224,29 +476,67 @@ def main():
     all_tasks = [(s, i) for s in SYMBOLS for i in INTERVALS]
     results = []
     now_utc_ts = datetime.now(timezone.utc).timestamp()
+    run_started = time.perf_counter()
+    use_server = request_server({"op": "ping"}, timeout=2.0) is not None
+    print(f"     (Chế độ: {'model_server' if use_server else 'load model tại chỗ'})")
+    inference_cache = load_inference_cache()
+
+    # Model gộp (nếu có): load 1 lần / interval, chấm điểm mọi symbol chưa có cache trong 1 batch
+    pooled_covered, pooled_fp, pooled_results = {}, {}, {}
+    for interval in INTERVALS:
+        covered = set(pooled_symbols(interval)) & set(SYMBOLS)
+        if not covered: continue
+        pooled_covered[interval], pooled_fp[interval] = covered, model_fingerprint(POOLED_KEY, interval)
+        candle_open = last_closed_candle_open_ms(interval)
+        todo = [s for s in SYMBOLS if s in covered and not is_cached(inference_cache, f"{s}-{interval}", candle_open, pooled_fp[interval])]
+        print(f"     (Model gộp {interval}: {len(covered)} symbol, cần chấm lại {len(todo)})")
+        pooled_results[interval] = score_pooled(interval, todo, use_server) if todo else {}
 
     # Bước 2: Vòng lặp chính, xử lý từng tác vụ một
     for symbol, interval in all_tasks:
         key = f"{symbol}-{interval}"
         print(f"\n  -> Đang xử lý: {key}")
         
-        # Tải model CHỈ cho tác vụ hiện tại
-        bundle = AIModelBundle(symbol, interval)
-        
-        if not bundle.is_valid():
-            print(f"     - Bỏ qua (Không tìm thấy model cho {key})")
-            del bundle
-            gc.collect()
-            continue
+        # Chưa có nến mới đóng và model không đổi -> dùng lại kết quả, không load model
+        is_pooled = symbol in pooled_covered.get(interval, ())
+        candle_open = last_closed_candle_open_ms(interval)
+        fingerprint = pooled_fp[interval] if is_pooled else model_fingerprint(symbol, interval)
+        with timed(key, "cache_lookup"): res = cached_result(inference_cache, key, candle_open, fingerprint)
+        from_cache = res is not None
+        if from_cache:
+            print("     - Dùng kết quả cache (chưa có nến mới đóng)")
+        elif is_pooled:
+            res = pooled_results[interval].get(symbol)
+        else:
+            # Ưu tiên model_server (model đã load sẵn), nếu không có thì load tại chỗ
+            resp = request_server({"op": "analyze", "symbol": symbol, "interval": interval}) if use_server else None
+            if resp is not None:
+                res = resp.get("result")
+                if resp.get("metrics"): _run_metrics.setdefault(key, {}).update(resp["metrics"])  # Các giai đoạn đo bên trong server
+                if resp.get("reason") == "no_model":
+                    print(f"     - Bỏ qua (Không tìm thấy model cho {key})")
+                    continue
+            else:
+                # Tải model CHỈ cho tác vụ hiện tại
+                bundle = AIModelBundle(symbol, interval)
+
+                if not bundle.is_valid():
+                    print(f"     - Bỏ qua (Không tìm thấy model cho {key})")
+                    del bundle
+                    gc.collect()
+                    continue
+
+                # Phân tích
+                res = analyze_ensemble(symbol, interval, bundle)
+
+                # Dọn dẹp bộ nhớ NGAY LẬP TỨC sau khi phân tích xong
+                del bundle
+                release_keras_memory()
+                gc.collect()
+
+        if not from_cache and res and res.get("candle_open") == candle_open:
+            inference_cache[key] = {"candle_open": candle_open, "fingerprint": fingerprint, "result": res}
 
-        # Phân tích
-        res = analyze_ensemble(symbol, interval, bundle)
-        
-        # Dọn dẹp bộ nhớ NGAY LẬP TỨC sau khi phân tích xong
-        del bundle
-        tf.keras.backend.clear_session()
-        gc.collect()
-        
         if not res:
             print(f"     - Bỏ qua (Không đủ dữ liệu giá cho {key})")
             continue
@@ -296,6 +586,8 @@ def main():
 
     # Bước 4: Lưu lại toàn bộ trạng thái cuối cùng
     atomic_write_json(STATE_FILE, state)
+    atomic_write_json(INFERENCE_CACHE_FILE, inference_cache)
+    write_run_metrics(run_started)
     print("\n--- ✅ Hoàn tất chu trình phân tích tuần tự ---")
 
 if __name__ == "__main__":
@@ -0,0 +1,203 @@
+# ===================================================================
+# model_server.py - MÁY CHỦ SUY LUẬN AI THƯỜNG TRÚ (UNIX SOCKET)
+# ===================================================================
+# - Giữ các AIModelBundle đã load sẵn trong RAM (LRU) để ml_report,
+#   backtest_engine_v9 và trade_advisor không phải import TensorFlow
+#   và deserialize model ở mỗi lần chạy.
+# - LRU bị giới hạn bởi ngân sách bộ nhớ (AI_SERVER_MEMORY_MB), kích thước
+#   mỗi bundle được đo bằng chênh lệch RSS lúc load.
+# - Giao thức: mỗi kết nối gửi 1 dòng JSON, nhận lại 1 dòng JSON.
+#     {"op": "ping"}
+#     {"op": "analyze", "symbol": "ETHUSDT", "interval": "1h"}
+#     {"op": "history", "symbol": "ETHUSDT", "interval": "1h", "rows": [[...], ...]}
+#     {"op": "analyze_pooled", "interval": "1h", "symbols": ["ETHUSDT", ...]}  (model gộp)
+#     {"op": "stats"} / {"op": "evict", "symbol": ..., "interval": ...}
+# - Mỗi kết nối 1 luồng, chia 2 làn: "history" (backtest, có thể chạy rất lâu) và
+#   "live" (analyze/analyze_pooled của ml_report / trade_advisor). Mỗi làn xử lý tuần tự,
+#   nên 1 request history dài không chặn các request analyze của phiên live (trừ khi cùng
+#   bundle: suy luận trên 1 bundle luôn tuần tự vì TFLite Interpreter không an toàn đa luồng).
+# - Phần client (request_server) chỉ dùng thư viện chuẩn, không import TF.
+#
+# Chạy: python model_server.py
+# ===================================================================
+
+import os, sys, json, time, socket, socketserver, gc, threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BASE_DIR)
+
+SOCKET_PATH = os.getenv("AI_SERVER_SOCKET", os.path.join(BASE_DIR, "ai_server.sock"))
+MEMORY_BUDGET_MB = float(os.getenv("AI_SERVER_MEMORY_MB", "1500"))
+CLIENT_TIMEOUT = float(os.getenv("AI_SERVER_TIMEOUT", "60"))
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+# --------------------------------------------------
+# CLIENT (dùng chung cho ml_report / backtest / trade_advisor)
+# --------------------------------------------------
+def request_server(payload: Dict, timeout: float = CLIENT_TIMEOUT) -> Optional[Dict]:
+    """Gửi 1 yêu cầu tới server. Trả về None nếu server không chạy hoặc lỗi."""
+    if not os.path.exists(SOCKET_PATH): return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.settimeout(timeout)
+            s.connect(SOCKET_PATH)
+            s.sendall(json.dumps(payload, default=float).encode("utf-8") + b"\n")
+            chunks = []
+            while True:
+                chunk = s.recv(65536)
+                if not chunk: break
+                chunks.append(chunk)
+                if chunk.endswith(b"\n"): break
+        resp = json.loads(b"".join(chunks).decode("utf-8"))
+        if not resp.get("ok"):
+            print(f"[WARN] model_server trả lỗi cho {payload.get('op')}: {resp.get('error')}")
+            return None
+        return resp
+    except (OSError, ValueError) as e:
+        print(f"[WARN] Không thể kết nối model_server ({SOCKET_PATH}): {e}")
+        return None
+
+def is_server_alive(timeout: float = 2.0) -> bool:
+    return request_server({"op": "ping"}, timeout=timeout) is not None
+
+# --------------------------------------------------
+# SERVER
+# --------------------------------------------------
+def current_rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f: return int(f.read().split()[1]) * _PAGE_SIZE / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+class BundleCache:
+    """LRU các AIModelBundle, giới hạn theo tổng RSS ước lượng của từng bundle."""
+    def __init__(self, budget_mb: float):
+        self.budget_mb = budget_mb
+        self._items: "OrderedDict[tuple, dict]" = OrderedDict()
+        self.hits, self.misses = 0, 0
+        self.lock = threading.RLock()  # 2 làn dùng chung LRU
+        self._infer_locks: Dict[tuple, threading.Lock] = {}
+
+    def _meta_mtime(self, symbol: str, interval: str) -> float:
+        from ml_report import DATA_DIR
+        try: return os.path.getmtime(os.path.join(DATA_DIR, f"meta_{symbol}_{interval}.json"))
+        except OSError: return 0.0
+
+    def get(self, symbol: str, interval: str):
+        with self.lock: return self._get(symbol, interval)
+
+    def _get(self, symbol: str, interval: str):
+        from ml_report import AIModelBundle
+        key = (symbol, interval)
+        mtime = self._meta_mtime(symbol, interval)
+        entry = self._items.get(key)
+        # Model được train lại (meta thay đổi) -> load lại
+        if entry and entry["mtime"] == mtime:
+            self._items.move_to_end(key); self.hits += 1
+            return entry["bundle"]
+        if entry: self.evict(symbol, interval)
+        self.misses += 1
+        rss_before = current_rss_mb(); t0 = time.perf_counter()
+        bundle = AIModelBundle(symbol, interval)
+        if not bundle.is_valid(): return None
+        size_mb = max(current_rss_mb() - rss_before, 1.0)
+        self._items[key] = {"bundle": bundle, "size_mb": size_mb, "mtime": mtime}
+        print(f"  [LOAD] {symbol}-{interval}: {size_mb:.0f}MB trong {time.perf_counter() - t0:.2f}s")
+        self._enforce_budget()
+        return bundle
+
+    def inference_lock(self, symbol: str, interval: str) -> threading.Lock:
+        """Khóa suy luận theo bundle: TFLite Interpreter (resize/set_tensor/invoke) không an toàn khi 2 làn dùng chung."""
+        with self.lock: return self._infer_locks.setdefault((symbol, interval), threading.Lock())
+
+    def used_mb(self) -> float: return sum(e["size_mb"] for e in self._items.values())
+
+    def _enforce_budget(self):
+        while len(self._items) > 1 and self.used_mb() > self.budget_mb:
+            (symbol, interval), entry = self._items.popitem(last=False)
+            print(f"  [EVICT] {symbol}-{interval} (~{entry['size_mb']:.0f}MB) để giữ ngân sách {self.budget_mb:.0f}MB")
+            del entry
+        gc.collect()
+
+    def evict(self, symbol: str, interval: str) -> bool:
+        with self.lock: entry = self._items.pop((symbol, interval), None)
+        if entry is None: return False
+        del entry; gc.collect()
+        return True
+
+    def stats(self) -> Dict:
+        with self.lock: return {"loaded": [f"{s}-{i}" for s, i in self._items], "used_mb": round(self.used_mb(), 1),
+                "budget_mb": self.budget_mb, "rss_mb": round(current_rss_mb(), 1), "hits": self.hits, "misses": self.misses}
+
+_LANE_LOCKS = {"history": threading.Lock(), "live": threading.Lock()}
+
+def handle_request(cache: BundleCache, req: Dict) -> Dict:
+    op = req.get("op")
+    if op in ("analyze", "analyze_pooled", "history"):
+        with _LANE_LOCKS["history" if op == "history" else "live"]: return _handle_model_request(cache, req)
+    return _handle_model_request(cache, req)
+
+def _handle_model_request(cache: BundleCache, req: Dict) -> Dict:
+    op = req.get("op")
+    if op == "ping": return {"ok": True}
+    if op == "stats": return {"ok": True, "stats": cache.stats()}
+    if op == "evict": return {"ok": True, "evicted": cache.evict(req["symbol"], req["interval"])}
+    if op == "analyze_pooled":
+        from ml_report import analyze_pooled, pop_metrics, POOLED_KEY
+        interval = req["interval"]
+        bundle = cache.get(POOLED_KEY, interval)
+        if bundle is None: return {"ok": True, "result": None, "reason": "no_model"}
+        with cache.inference_lock(POOLED_KEY, interval): result = analyze_pooled(interval, bundle, req["symbols"])
+        return {"ok": True, "result": result, "metrics": pop_metrics(f"{POOLED_KEY}-{interval}")}
+    if op in ("analyze", "history"):
+        symbol, interval = req["symbol"], req["interval"]
+        bundle = cache.get(symbol, interval)
+        if bundle is None: return {"ok": True, "result": None, "reason": "no_model"}
+        if op == "analyze":
+            from ml_report import analyze_ensemble, pop_metrics
+            with cache.inference_lock(symbol, interval): result = analyze_ensemble(symbol, interval, bundle)
+            return {"ok": True, "result": result, "metrics": pop_metrics(f"{symbol}-{interval}")}
+        import pandas as pd
+        from ml_report import predict_history
+        features_df = pd.DataFrame(req["rows"], columns=bundle.meta["features"])
+        with cache.inference_lock(symbol, interval): preds = predict_history(bundle, features_df)
+        return {"ok": True, "result": {c: preds[c].tolist() for c in preds.columns}}
+    return {"ok": False, "error": f"op không hợp lệ: {op}"}
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line: return
+        try:
+            resp = handle_request(self.server.cache, json.loads(line.decode("utf-8")))
+        except Exception as e:
+            import traceback
+            print(traceback.format_exc())
+            resp = {"ok": False, "error": str(e)}
+        self.wfile.write(json.dumps(resp, default=float).encode("utf-8") + b"\n")
+
+class _Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+def serve():
+    import ml_report  # Import TF một lần duy nhất khi server khởi động
+    if os.path.exists(SOCKET_PATH):
+        if is_server_alive():
+            print(f"❌ model_server đã chạy tại {SOCKET_PATH}. Thoát."); return
+        os.remove(SOCKET_PATH)
+    # Mỗi kết nối 1 luồng; trong cùng 1 làn các request vẫn tuần tự (xem _LANE_LOCKS)
+    with _Server(SOCKET_PATH, _Handler) as server:
+        server.cache = BundleCache(MEMORY_BUDGET_MB)
+        os.chmod(SOCKET_PATH, 0o660)
+        print(f"--- 🧠 model_server sẵn sàng tại {SOCKET_PATH} (ngân sách {MEMORY_BUDGET_MB:.0f}MB) ---")
+        try: server.serve_forever()
+        except KeyboardInterrupt: print("\n--- Dừng model_server ---")
+        finally:
+            try: os.remove(SOCKET_PATH)
+            except OSError: pass
+
+if __name__ == "__main__":
+    serve()
@@ -1,6 +1,7 @@
 # /root/ricealert/trade_advisor.py
 import os
 import json
+import time
 from datetime import datetime
 from typing import Dict, Tuple, Optional
 from signal_logic import check_signal
@@ -39,6 +40,13 @@ NEWS_DIR = os.path.join(BASE_DIR, "ricenews/lognew")
 AI_DIR = os.path.join(BASE_DIR, "ai_logs")
 MARKET_CONTEXT_PATH = os.path.join(BASE_DIR, "ricenews/lognew/market_context.json")
 
+# Kết quả AI lấy từ model_server khi chưa có file ai_logs (TTL 30 phút)
+AI_SERVER_CACHE_TTL_SECONDS = 1800
+AI_SERVER_TIMEOUT_SECONDS = float(os.getenv("AI_ADVISOR_TIMEOUT", "1.0"))  # Phiên live không chờ model_server lâu cho mỗi cặp
+AI_SERVER_BACKOFF_SECONDS = 60  # Server lỗi / quá hạn (vd. đang load bundle) -> không hỏi lại trong khoảng này
+_ai_server_cache: Dict[Tuple[str, str], Tuple[float, Dict]] = {}
+_ai_server_backoff_until = 0.0
+
 def load_json(path: str, default):
     try:
         with open(path, "r", encoding="utf-8") as f: return json.load(f)
@@ -95,8 +103,25 @@ def get_live_context_and_ai(symbol: str, interval: str, config: dict) -> Tuple[D
     final_context["news_factor"] = news_factor
     
     ai_data = load_json(os.path.join(AI_DIR, f"{symbol}_{interval}.json"), {})
+    if not ai_data:
+        ai_data = get_ai_from_server(symbol, interval)
     return final_context, ai_data
 
+def get_ai_from_server(symbol: str, interval: str) -> Dict:
+    """Hỏi model_server khi ml_report chưa ghi file ai_logs cho cặp này."""
+    global _ai_server_backoff_until
+    cached = _ai_server_cache.get((symbol, interval))
+    if cached and time.time() - cached[0] < AI_SERVER_CACHE_TTL_SECONDS: return cached[1]
+    if time.time() < _ai_server_backoff_until: return {}
+    from model_server import request_server
+    resp = request_server({"op": "analyze", "symbol": symbol, "interval": interval}, timeout=AI_SERVER_TIMEOUT_SECONDS)
+    if resp is None:  # Server bận / không chạy: không cache kết quả, tạm ngừng hỏi để server load xong
+        _ai_server_backoff_until = time.time() + AI_SERVER_BACKOFF_SECONDS
+        return {}
+    ai_data = resp.get("result") or {}
+    _ai_server_cache[(symbol, interval)] = (time.time(), ai_data)
+    return ai_data
+
 def generate_combined_trade_plan(base_plan: dict, score: float, config: dict) -> dict:
     entry = base_plan.get('price', 0)
     if entry == 0: return {"entry": 0, "tp": 0, "sl": 0}
@@ -110,6 +135,31 @@ def generate_combined_trade_plan(base_plan: dict, score: float, config: dict) ->
     new_sl = entry - risk_distance
     return {"entry": round(entry, 8), "tp": round(new_tp, 8), "sl": round(new_sl, 8)}
 
+def combine_score(tech_scaled: float, context_scaled: float, ai_skew: float, weights: Dict) -> float:
+    final_rating = (weights['tech'] * tech_scaled) + \
+                   (weights['context'] * context_scaled) + \
+                   (weights['ai'] * ai_skew)
+    return round(min(max((final_rating + 1) * 5, 0), 10), 1)
+
+def classify_decision(final_score: float, config: dict) -> str:
+    thresholds = config['DECISION_THRESHOLDS']
+    if final_score >= thresholds['buy']: return "OPPORTUNITY_BUY"
+    if final_score <= thresholds['sell']: return "OPPORTUNITY_SELL"
+    return "NEUTRAL"
+
+def rescore_decision(decision: Dict, config: dict, weights_override: Optional[Dict] = None) -> Dict:
+    """Chấm lại 1 quyết định với bộ trọng số khác (vd: WEIGHTS của từng tactic) từ các thành phần đã tính
+    (tech/context/AI), không gọi lại check_signal và không đọc lại context/AI. Kết quả giống hệt
+    get_advisor_decision(..., weights_override=...) trên cùng dữ liệu."""
+    debug = decision["debug_info"]
+    weights = weights_override if weights_override is not None else config['WEIGHTS']
+    final_score = combine_score(debug["tech_scaled_value"], debug["context_scaled_value"], debug["ai_skew_value"], weights)
+    return {
+        **decision, "decision_type": classify_decision(final_score, config), "final_score": final_score,
+        "combined_trade_plan": generate_combined_trade_plan({"price": decision["full_indicators"].get("price", 0)}, final_score, config),
+        "debug_info": {**debug, "weights_used": weights}
+    }
+
 # <<< NÂNG CẤP V8.0: Sửa một dòng để sử dụng logic chuẩn hóa mới >>>
 def get_advisor_decision(
     symbol: str, interval: str, indicators: dict, config: dict,
@@ -151,18 +201,8 @@ def get_advisor_decision(
     context_scaled = round(min(max((market_score + normalized_news_factor) / 2, -1.0), 1.0), 2)
 
     weights = weights_override if weights_override is not None else config['WEIGHTS']
-    final_rating = (weights['tech'] * tech_scaled) + \
-                   (weights['context'] * context_scaled) + \
-                   (weights['ai'] * ai_skew)
-
-    final_score = round(min(max((final_rating + 1) * 5, 0), 10), 1)
-
-    thresholds = config['DECISION_THRESHOLDS']
-    decision_type = "NEUTRAL"
-    if final_score >= thresholds['buy']:
-        decision_type = "OPPORTUNITY_BUY"
-    elif final_score <= thresholds['sell']:
-        decision_type = "OPPORTUNITY_SELL"
+    final_score = combine_score(tech_scaled, context_scaled, ai_skew, weights)
+    decision_type = classify_decision(final_score, config)
 
     base_trade_plan = {"price": indicators.get("price", 0)}
     combined_trade_plan = generate_combined_trade_plan(base_trade_plan, final_score, config)
@@ -24,6 +24,9 @@ VPS_REMOTE_PATH="/root/ricealert/"
 CRON_WEEKLY_INTERVALS="1h,4h"
 CRON_MONTHLY_INTERVALS="1h,4h,1d"
 
+# POOLED=1: train 1 bộ model gộp cho mỗi interval (trainer.py --pooled) thay vì 1 bộ cho mỗi symbol
+POOLED="${POOLED:-0}"
+
 # --- HÀM THỰC THI ---
 run_training_process() {
     local debug_env="$1"
@@ -48,6 +51,11 @@ run_training_process() {
     echo "   - Log sẽ được lưu vào: $LOGFILE"
     echo "---"
 
+    # Chế độ model gộp: mỗi interval chỉ 1 tiến trình train, bất kể số symbol
+    if [[ "$POOLED" == "1" ]]; then
+        SYMBOLS_ARR=("--pooled")
+    fi
+
     # Vòng lặp chính
     for sym in "${SYMBOLS_ARR[@]}"; do
         for iv in "${INTERVALS_ARR[@]}"; do
@@ -0,0 +1,174 @@
+# ===================================================================
+# train_orchestrator.py - CHẠY SONG SONG NHIỀU JOB trainer.py TRÊN 1 MÁY
+# ===================================================================
+# - Mỗi job (SYMBOL, INTERVAL) là 1 tiến trình trainer.py riêng (giữ nguyên
+#   nguyên tắc cô lập bộ nhớ), nhưng nhiều job chạy cùng lúc.
+# - Mỗi "slot" được gán 1 nhóm core cố định (sched_setaffinity) và số luồng
+#   tương ứng (TRAINER_THREADS / OMP_NUM_THREADS) để các job không tranh CPU.
+# - Ngân sách RAM: job chỉ được khởi chạy nếu tổng RSS đỉnh ƯỚC LƯỢNG của các
+#   job đang chạy + job mới <= --memory-mb. Ước lượng lấy từ RSS đỉnh đo được
+#   (VmHWM) ở các lần chạy trước, lưu trong manifest.
+# - Manifest JSON ghi trạng thái từng job sau mỗi thay đổi. Mặc định mỗi lần chạy
+#   là 1 đợt train mới (bỏ trạng thái job cũ, giữ số đo RSS); --resume để chạy tiếp
+#   sau khi crash: bỏ qua job đã xong và chạy lại job đang dở.
+#
+# Chạy: python train_orchestrator.py --intervals 1h,4h [--workers 4] [--memory-mb 12000]
+#       python train_orchestrator.py --intervals 1h --pooled       (1 job gộp / interval)
+#       python train_orchestrator.py --intervals 1h,4h --resume    (tiếp tục đợt bị dừng)
+# ===================================================================
+
+import os, sys, json, time, signal, argparse, subprocess
+from datetime import datetime, timezone
+from typing import Dict, List
+from dotenv import load_dotenv
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+LOG_DIR = os.path.join(BASE_DIR, "log")
+DEFAULT_MANIFEST = os.path.join(BASE_DIR, "data", "train_manifest.json")
+DEFAULT_JOB_MB = 3000      # Ước lượng RSS đỉnh cho job chưa từng đo
+POLL_SECONDS = 1.0
+POOLED_KEY = "POOLED"       # Job model gộp (trainer.py --pooled), cùng tên với POOLED_KEY của trainer.py: key POOLED-1h, log train_POOLED-1h.log
+load_dotenv()
+
+# --------------------------------------------------
+# MANIFEST
+# --------------------------------------------------
+def load_manifest(path: str) -> Dict:
+    if not os.path.exists(path): return {"jobs": {}, "peak_rss_mb": {}}
+    try: return json.load(open(path))
+    except Exception: return {"jobs": {}, "peak_rss_mb": {}}
+
+def save_manifest(path: str, manifest: Dict):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f: json.dump(manifest, f, indent=2)
+    os.replace(tmp, path)
+
+def job_key(symbol: str, interval: str) -> str: return f"{symbol}-{interval}"
+
+def read_peak_rss_mb(pid: int) -> float:
+    """VmHWM = RSS đỉnh của tiến trình từ khi khởi động."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"): return int(line.split()[1]) / 1024
+    except (OSError, ValueError): pass
+    return 0.0
+
+def estimate_mb(manifest: Dict, key: str, interval: str) -> float:
+    """RSS đỉnh đã đo của chính job này, nếu chưa có thì lấy lớn nhất cùng interval, cuối cùng là mặc định."""
+    peaks = manifest.get("peak_rss_mb", {})
+    if key in peaks: return peaks[key]
+    same_iv = [v for k, v in peaks.items() if k.endswith(f"-{interval}")]
+    return max(same_iv) if same_iv else DEFAULT_JOB_MB
+
+# --------------------------------------------------
+# SLOT & JOB
+# --------------------------------------------------
+def plan_slots(workers: int, threads: int) -> List[List[int]]:
+    """Chia các core được phép dùng thành `workers` nhóm rời nhau, mỗi nhóm `threads` core."""
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+    return [cores[i * threads:(i + 1) * threads] or cores for i in range(workers)]
+
+def start_job(symbol: str, interval: str, cores: List[int], log_path: str) -> subprocess.Popen:
+    env = dict(os.environ)
+    n = str(len(cores))
+    env.update({"TRAINER_THREADS": n, "OMP_NUM_THREADS": n, "OPENBLAS_NUM_THREADS": n, "MKL_NUM_THREADS": n, "PYTHONUNBUFFERED": "1"})
+    args = [sys.executable, "-u", os.path.join(BASE_DIR, "trainer.py"), "--pooled" if symbol == POOLED_KEY else symbol, interval]
+    def pin():  # Chạy trong tiến trình con trước khi exec
+        if hasattr(os, "sched_setaffinity"): os.sched_setaffinity(0, cores)
+    log = open(log_path, "a")
+    log.write(f"--- [{datetime.now(timezone.utc).isoformat()}] {' '.join(args[2:])} | cores={cores} ---\n"); log.flush()
+    return subprocess.Popen(args, cwd=BASE_DIR, env=env, stdout=log, stderr=subprocess.STDOUT, preexec_fn=pin)
+
+def run(jobs: List[tuple], workers: int, threads: int, memory_mb: float, manifest_path: str, retries: int) -> int:
+    manifest = load_manifest(manifest_path)
+    for symbol, interval in jobs:
+        entry = manifest["jobs"].setdefault(job_key(symbol, interval), {"status": "pending", "attempts": 0})
+        if entry["status"] == "running": entry["status"] = "pending"  # Lần trước bị ngắt giữa chừng
+        if entry["status"] == "failed" and entry["attempts"] <= retries: entry["status"] = "pending"
+    save_manifest(manifest_path, manifest)
+
+    queue = [(s, i) for s, i in jobs if manifest["jobs"][job_key(s, i)]["status"] == "pending"]
+    done = len(jobs) - len(queue)
+    print(f"--- 🏭 Orchestrator: {len(jobs)} job ({done} đã xong từ trước), {workers} slot x {threads} luồng, ngân sách {memory_mb:.0f}MB ---")
+    slots = plan_slots(workers, threads)
+    running: Dict[int, dict] = {}  # slot -> {"proc", "key", "interval", "est", "peak", "t0"}
+    stopping = False
+    def _stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        print("\n⚠️ Nhận tín hiệu dừng: không khởi chạy job mới, chờ các job đang chạy kết thúc...")
+    signal.signal(signal.SIGINT, _stop); signal.signal(signal.SIGTERM, _stop)
+
+    while queue or running:
+        # 1) Thu các job đã kết thúc, cập nhật RSS đỉnh đo được
+        for slot, job in list(running.items()):
+            job["peak"] = max(job["peak"], read_peak_rss_mb(job["proc"].pid))
+            rc = job["proc"].poll()
+            if rc is None: continue
+            entry = manifest["jobs"][job["key"]]
+            entry.update({"status": "done" if rc == 0 else "failed", "exit_code": rc,
+                          "duration_s": round(time.time() - job["t0"], 1), "finished_at": datetime.now(timezone.utc).isoformat()})
+            if job["peak"] > 0:
+                entry["peak_rss_mb"] = round(job["peak"], 1)
+                manifest.setdefault("peak_rss_mb", {})[job["key"]] = round(job["peak"], 1)
+            save_manifest(manifest_path, manifest)
+            print(f"  {'✅' if rc == 0 else '❌'} {job['key']} ({entry['duration_s']}s, RSS đỉnh {job['peak']:.0f}MB, exit={rc})")
+            if rc != 0 and entry["attempts"] <= retries and not stopping:
+                queue.append((job["key"].rsplit("-", 1)[0], job["interval"])); entry["status"] = "pending"
+            del running[slot]
+
+        # 2) Khởi chạy job mới khi còn slot trống và còn ngân sách RAM
+        free_slots = [s for s in range(len(slots)) if s not in running]
+        while queue and free_slots and not stopping:
+            symbol, interval = queue[0]
+            key = job_key(symbol, interval)
+            est = estimate_mb(manifest, key, interval)
+            in_use = sum(j["est"] for j in running.values())
+            if running and in_use + est > memory_mb: break  # Chờ giải phóng RAM; luôn cho phép ít nhất 1 job
+            queue.pop(0)
+            slot = free_slots.pop(0)
+            entry = manifest["jobs"][key]
+            entry.update({"status": "running", "attempts": entry.get("attempts", 0) + 1, "started_at": datetime.now(timezone.utc).isoformat()})
+            save_manifest(manifest_path, manifest)
+            log_path = os.path.join(LOG_DIR, f"train_{key}.log")
+            proc = start_job(symbol, interval, slots[slot], log_path)
+            running[slot] = {"proc": proc, "key": key, "interval": interval, "est": est, "peak": 0.0, "t0": time.time()}
+            print(f"  ▶️ {key} (slot {slot}, cores {slots[slot]}, ước lượng {est:.0f}MB, đang dùng {in_use + est:.0f}/{memory_mb:.0f}MB)")
+
+        if stopping and not running: break
+        time.sleep(POLL_SECONDS)
+
+    failed = [k for k, v in manifest["jobs"].items() if v["status"] == "failed"]
+    print(f"--- 🎯 Xong. {sum(1 for v in manifest['jobs'].values() if v['status'] == 'done')} job thành công, {len(failed)} lỗi {failed if failed else ''} ---")
+    return 1 if failed else 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Chạy song song các job trainer.py với giới hạn core/RAM và manifest để resume.")
+    parser.add_argument("--intervals", default=os.getenv("INTERVALS", "1h,4h,1d"))
+    parser.add_argument("--symbols", default=os.getenv("SYMBOLS", "ETHUSDT,BTCUSDT"))
+    parser.add_argument("--pooled", action="store_true", help="1 job model gộp cho mỗi interval (trainer.py --pooled)")
+    parser.add_argument("--workers", type=int, default=0, help="Số job chạy đồng thời (mặc định: số core / --threads)")
+    parser.add_argument("--threads", type=int, default=2, help="Số core/luồng cho mỗi job")
+    parser.add_argument("--memory-mb", type=float, default=0, help="Ngân sách RSS tổng (mặc định: 80%% RAM máy)")
+    parser.add_argument("--manifest", default=DEFAULT_MANIFEST)
+    parser.add_argument("--resume", action="store_true", help="Tiếp tục đợt trước: bỏ qua job đã xong trong manifest")
+    parser.add_argument("--retries", type=int, default=1)
+    args = parser.parse_args()
+
+    os.makedirs(LOG_DIR, exist_ok=True); os.makedirs(os.path.dirname(args.manifest), exist_ok=True)
+    n_cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    threads = max(1, min(args.threads, n_cores))
+    workers = args.workers or max(1, n_cores // threads)
+    memory_mb = args.memory_mb or os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / (1024 * 1024) * 0.8
+
+    intervals = [i.strip().lower() for i in args.intervals.split(",") if i.strip()]
+    symbols = [POOLED_KEY] if args.pooled else [s.strip().upper() for s in args.symbols.split(",") if s.strip()]
+    jobs = [(s, i) for i in intervals for s in symbols]
+    if not args.resume and os.path.exists(args.manifest):  # Đợt mới: bỏ trạng thái job cũ (vẫn giữ số đo RSS)
+        manifest = load_manifest(args.manifest); manifest["jobs"] = {}
+        save_manifest(args.manifest, manifest)
+    sys.exit(run(jobs, workers, threads, memory_mb, args.manifest, args.retries))
+
+if __name__ == "__main__":
+    main()
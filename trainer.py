@@ -5,9 +5,10 @@
 # - Đảm bảo giải phóng 100% bộ nhớ sau khi hoàn thành.
 # ======================================================================================
 
-import os, sys, re, warnings, json, random, time, threading, select
+import os, sys, re, warnings, json, random, time, threading, select, hashlib, inspect, shutil, tempfile
 from datetime import datetime, timedelta, timezone
 from time import sleep
+from contextlib import contextmanager
 
 # --- ENV để giảm rác TF/XLA (GIỮ NGUYÊN) ---
 os.environ.setdefault("TF_CPP_MIN_LOG_LEVEL", "3")
@@ -16,6 +17,10 @@ os.environ.setdefault("TF_XLA_FLAGS", "--tf_xla_auto_jit=0 --tf_xla_enable_xla_d
 os.environ.setdefault("XLA_FLAGS", "--xla_gpu_use_runtime_fusion=false --xla_gpu_enable_triton=false")
 
 DEBUG = os.getenv("DEBUG", "0") == "1"
+# Số luồng cho mỗi tiến trình train (train_orchestrator.py đặt khi chạy song song nhiều job); 0 = dùng hết
+TRAINER_THREADS = int(os.getenv("TRAINER_THREADS", "0"))
+if TRAINER_THREADS:
+    for _var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"): os.environ.setdefault(_var, str(TRAINER_THREADS))
 VERBOSE = 2 if DEBUG else 0
 
 # --- Bộ lọc log C-level mạnh mẽ (ĐÃ CẬP NHẬT) ---
@@ -77,6 +82,7 @@ attach_fd_filter(2, allow_epoch=DEBUG)
 
 warnings.filterwarnings("ignore", category=UserWarning)
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 import pandas as pd
 import requests
 import joblib
@@ -84,6 +90,9 @@ import lightgbm as lgb
 import ta
 import tensorflow as tf
 tf.config.optimizer.set_jit(False)
+if TRAINER_THREADS:
+    tf.config.threading.set_intra_op_parallelism_threads(TRAINER_THREADS)
+    tf.config.threading.set_inter_op_parallelism_threads(min(2, TRAINER_THREADS))
 try:
     import absl.logging as absl_logging
     absl_logging.set_verbosity(absl_logging.ERROR)
@@ -91,7 +100,6 @@ except ImportError:
     pass
 tf.get_logger().setLevel("ERROR")
 from dotenv import load_dotenv
-from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler
 
 # THAY ĐỔI: Import trực tiếp từ gói 'keras' thay vì 'tensorflow.keras'
@@ -123,15 +131,46 @@ MIN_MAP  = _load_map("MIN_SAMPLE_MAP",     {"1h":400, "4h":300, "1d":200})
 SEQUENCE_LENGTH = 60
 TRANSFORMER_HEADS = 8
 TRANSFORMER_LAYERS = 4
-BATCH_SIZE = 512
+BATCH_SIZE = int(os.getenv("TRAIN_BATCH_SIZE", "512"))
+LSTM_UNROLL = os.getenv("LSTM_UNROLL", "1") == "1"
+# MULTI_HEAD=1: mỗi kiến trúc (LSTM/Transformer) là 1 model chung thân, 2 đầu ra (clf softmax + reg linear)
+MULTI_HEAD = os.getenv("MULTI_HEAD", "0") == "1"
+MULTI_HEAD_REG_WEIGHT = float(os.getenv("MULTI_HEAD_REG_WEIGHT", "0.1"))  # Cân bằng MSE (% giá) với crossentropy
+# Xuất thêm bản TFLite cho suy luận CPU nhẹ (ml_report ưu tiên dùng nếu qua kiểm tra sai lệch)
+TFLITE_EXPORT = os.getenv("TFLITE_EXPORT", "1") == "1"
+TFLITE_QUANTIZE = os.getenv("TFLITE_QUANTIZE", "0") == "1"  # Lượng tử hoá dynamic-range (trọng số int8)
+TFLITE_PARITY_TOL = float(os.getenv("TFLITE_PARITY_TOL", "0.05" if TFLITE_QUANTIZE else "0.01"))
+TFLITE_PARITY_SAMPLES = 256
+# INCREMENTAL=1: fine-tune từ model lần trước trên nến mới + 1 mẫu replay dữ liệu cũ (rơi về train đầy đủ nếu bộ feature đổi)
+INCREMENTAL = os.getenv("INCREMENTAL", "0") == "1"
+INCREMENTAL_EPOCHS = int(os.getenv("INCREMENTAL_EPOCHS", "5"))
+INCREMENTAL_REPLAY = int(os.getenv("INCREMENTAL_REPLAY", "1000"))     # Số mẫu cũ trộn lại để tránh quên
+INCREMENTAL_LGBM_ROUNDS = int(os.getenv("INCREMENTAL_LGBM_ROUNDS", "200"))
+POOLED_KEY = "POOLED"        # Tên file cho bộ model gộp nhiều symbol: model_POOLED_<arch>_<kind>_<interval>.*
+SYMBOL_EMBED_DIM = 4
+# Tham số LightGBM theo từng mục tiêu; 2 model dùng chung 1 Dataset đã bin hoá, chỉ đổi nhãn
+LGBM_COMMON_PARAMS = {"learning_rate": 0.05, "verbose": -1, "num_threads": TRAINER_THREADS}  # 0 = mặc định OpenMP
+LGBM_PARAMS = {"clf": {"objective": "multiclass", "num_class": 3, "is_unbalance": True}, "reg": {"objective": "regression_l1"}}
+LGBM_CLASSES = [0, 1, 2]
+# --profile: đo thời gian từng giai đoạn, thời gian/epoch, mẫu/giây, RSS đỉnh mỗi model -> JSON (xem bench_training.py).
+# Model được ghi vào thư mục tạm (không đè model thật) và chỉ train PROFILE_EPOCHS epoch.
+PROFILE = "--profile" in sys.argv[1:]
+PROFILE_EPOCHS = int(os.getenv("PROFILE_EPOCHS", "3"))
+PROFILE_OUT = os.getenv("PROFILE_OUT", "")
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DATA_DIR = os.path.join(BASE_DIR, "data")
+DATA_DIR = os.getenv("TRAINER_DATA_DIR") or (tempfile.mkdtemp(prefix="trainer_profile_") if PROFILE else os.path.join(BASE_DIR, "data"))
 os.makedirs(DATA_DIR, exist_ok=True)
+# Cache lịch sử nến thô + dataset đã gắn nhãn: lần chạy sau chỉ tải nến mới và tính lại phần đuôi
+DATASET_CACHE = os.getenv("DATASET_CACHE", "1") == "1"
+# Ngoài data/: train_and_push.sh scp cả data/ lên VPS, cache chỉ dùng trên máy train
+DATASET_CACHE_DIR = os.getenv("DATASET_CACHE_DIR") or os.path.join(BASE_DIR, "train_cache")
+FEATURE_WARMUP = 500  # Số nến cũ đi kèm khi tính lại chỉ báo cho phần đuôi (EMA/RSI/ADX hội tụ)
 
-def get_price_data(symbol: str, interval: str, limit: int, end_time: datetime = None) -> pd.DataFrame:
+def get_price_data(symbol: str, interval: str, limit: int, end_time: datetime = None, start_time: datetime = None) -> pd.DataFrame:
     url = "https://api.binance.com/api/v3/klines"
     params = {"symbol": symbol, "interval": interval, "limit": limit}
     if end_time: params["endTime"] = int(end_time.timestamp() * 1000)
+    if start_time: params["startTime"] = int(start_time.timestamp() * 1000)
     try:
         resp = requests.get(url, params=params, timeout=10)
         resp.raise_for_status()
@@ -159,6 +198,24 @@ def get_full_price_history(symbol: str, interval: str, total: int, step: int) ->
     if not chunks: return pd.DataFrame()
     return pd.concat(chunks).drop_duplicates().sort_index().iloc[-total:]
 
+def get_price_history_since(symbol: str, interval: str, start_time: datetime, step: int) -> pd.DataFrame:
+    """Tải tiến về phía trước từ start_time (tính cả nến mở tại start_time) tới hiện tại."""
+    chunks = []
+    while True:
+        part = get_price_data(symbol, interval, step, start_time=start_time)
+        if part.empty: break
+        chunks.append(part)
+        if len(part) < step: break
+        start_time = part.index[-1] + timedelta(milliseconds=1)
+        sleep(0.25)
+    if not chunks: return pd.DataFrame()
+    return pd.concat(chunks).drop_duplicates().sort_index()
+
+def closed_candles(df: pd.DataFrame, interval: str) -> pd.DataFrame:
+    """Bỏ nến đang chạy: giá đóng của nó còn thay đổi nên không được đưa vào cache/nhãn."""
+    if df.empty: return df
+    return df[df.index + pd.Timedelta(interval) <= pd.Timestamp.now(tz="UTC")]
+
 def add_features(df: pd.DataFrame) -> pd.DataFrame:
     out = df.copy()
     close, high, low, volume = out["close"], out["high"], out["low"], out["volume"]
@@ -199,22 +256,76 @@ def create_labels_and_targets(df: pd.DataFrame, fut_off: int, atr_factor: float)
     return df_copy.dropna()
 
 
-def create_sequences(data: pd.DataFrame, feature_cols: list, label_clf_col: str, label_reg_col: str, seq_length: int):
-    X, y_clf, y_reg = [], [], []
-    for i in range(len(data) - seq_length):
-        X.append(data[feature_cols].iloc[i:(i + seq_length)].values)
-        y_clf.append(data[label_clf_col].iloc[i + seq_length])
-        y_reg.append(data[label_reg_col].iloc[i + seq_length])
-    return np.array(X), np.array(y_clf), np.array(y_reg)
+def create_sequences(values: np.ndarray, y_clf: np.ndarray, y_reg: np.ndarray, seq_length: int):
+    """Cửa sổ i = values[i:i+seq], nhãn tại i+seq. X là view (strided) trên `values`, không sao chép dữ liệu."""
+    X = sliding_window_view(values, seq_length, axis=0).transpose(0, 2, 1)[:-1]
+    return X, y_clf[seq_length:], y_reg[seq_length:]
+
+def make_window_dataset(features: tf.Tensor, targets, indices: np.ndarray, seq_length: int, shuffle: bool = False, symbol_ids: np.ndarray = None):
+    """tf.data cắt cửa sổ theo chỉ số từ 1 tensor đặc (N, F) ngay trong từng batch, không vật chất hoá toàn bộ X.
+    Với model gộp (symbol_ids != None), đầu vào là (cửa sổ, symbol_id của cửa sổ)."""
+    offsets = tf.range(seq_length, dtype=tf.int64)
+    targets = tf.nest.map_structure(tf.constant, targets)
+    ids = tf.constant(symbol_ids.astype(np.int32)) if symbol_ids is not None else None
+    ds = tf.data.Dataset.from_tensor_slices(indices.astype(np.int64))
+    if shuffle: ds = ds.shuffle(buffer_size=len(indices))
+    def _gather(idx):
+        windows = tf.gather(features, idx[:, None] + offsets)
+        x = (windows, tf.gather(ids, idx)[:, None]) if ids is not None else windows
+        return x, tf.nest.map_structure(lambda t: tf.gather(t, idx), targets)
+    return ds.batch(BATCH_SIZE).map(_gather, num_parallel_calls=tf.data.AUTOTUNE).prefetch(buffer_size=tf.data.AUTOTUNE)
+
+def _attach_symbol_embedding(inputs, trunk, num_symbols: int):
+    """Model gộp: thêm đầu vào symbol_id (int) -> embedding, nối vào thân trước các đầu ra."""
+    if num_symbols <= 0: return inputs, trunk
+    symbol_in = layers.Input(shape=(1,), dtype="int32", name="symbol")
+    emb = layers.Flatten()(layers.Embedding(num_symbols, SYMBOL_EMBED_DIM)(symbol_in))
+    return [inputs, symbol_in], layers.Concatenate()([trunk, emb])
+
+def _compile_multi_head(inputs, trunk):
+    """Gắn 2 đầu ra lên thân chung: 'clf' (softmax 3 lớp) và 'reg' (% thay đổi giá), train đồng thời."""
+    out_clf = layers.Dense(3, activation='softmax', name='clf')(trunk)
+    out_reg = layers.Dense(1, activation='linear', name='reg')(trunk)
+    model = models.Model(inputs, [out_clf, out_reg])
+    model.compile(optimizer='adam', loss=['categorical_crossentropy', 'mean_squared_error'],
+                  loss_weights=[1.0, MULTI_HEAD_REG_WEIGHT], metrics=[['accuracy'], ['mae']])
+    return model
 
-def build_lstm_model(input_shape: tuple, model_type: str = 'classifier'):
+def export_tflite(model, path: str, sample: np.ndarray) -> dict:
+    """Xuất model sang TFLite rồi so sánh đầu ra với Keras trên `sample`. File bị xoá nếu lệch quá TFLITE_PARITY_TOL.
+    Model nhiều đầu ra được nối thành 1 tensor [n, 3 + 1] để runtime không phụ thuộc thứ tự/tên output."""
+    @tf.function(input_signature=[tf.TensorSpec([None, *sample.shape[1:]], tf.float32)])
+    def serve(x):
+        out = model(x, training=False)
+        return tf.concat(out, axis=-1) if isinstance(out, (list, tuple)) else out
+    converter = tf.lite.TFLiteConverter.from_concrete_functions([serve.get_concrete_function()], model)
+    if TFLITE_QUANTIZE: converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    with open(path, "wb") as f: f.write(converter.convert())
+
+    expected = serve(tf.constant(sample)).numpy()
+    interpreter = tf.lite.Interpreter(model_path=path)
+    inp = interpreter.get_input_details()[0]
+    interpreter.resize_tensor_input(inp['index'], sample.shape); interpreter.allocate_tensors()
+    interpreter.set_tensor(inp['index'], sample); interpreter.invoke()
+    got = interpreter.get_tensor(interpreter.get_output_details()[0]['index'])
+    # Sai lệch tuyệt đối cho xác suất, tương đối theo biên độ cho cột % giá
+    max_diff = float(np.max(np.abs(got - expected) / np.maximum(1.0, np.abs(expected).max(axis=0))))
+    report = {"ok": max_diff <= TFLITE_PARITY_TOL, "max_diff": round(max_diff, 6), "quantized": TFLITE_QUANTIZE,
+              "size_kb": round(os.path.getsize(path) / 1024, 1)}
+    if not report["ok"]: os.remove(path)
+    return report
+
+def build_lstm_model(input_shape: tuple, model_type: str = 'classifier', num_symbols: int = 0):
     inputs = layers.Input(shape=input_shape)
-    x = layers.LSTM(units=100, return_sequences=True, unroll=True)(inputs)
+    x = layers.LSTM(units=100, return_sequences=True, unroll=LSTM_UNROLL)(inputs)
     x = layers.Dropout(0.2)(x)
-    x = layers.LSTM(units=50, return_sequences=False, unroll=True)(x)
+    x = layers.LSTM(units=50, return_sequences=False, unroll=LSTM_UNROLL)(x)
     x = layers.Dropout(0.2)(x)
     x = layers.Dense(units=25)(x)
     x = layers.BatchNormalization()(x)
+    inputs, x = _attach_symbol_embedding(inputs, x, num_symbols)
+    if model_type == 'multi':
+        return _compile_multi_head(inputs, x)
     if model_type == 'classifier':
         outputs = layers.Dense(units=3, activation='softmax')(x)
         model = models.Model(inputs, outputs)
@@ -236,7 +347,7 @@ def transformer_encoder_block(inputs, head_size, num_heads, ff_dim, dropout=0):
     x = layers.Dense(units=inputs.shape[-1])(x)
     return layers.Add()([x, res])
 
-def build_transformer_model(input_shape, head_size, num_heads, ff_dim, num_layers, dropout=0, model_type='classifier'):
+def build_transformer_model(input_shape, head_size, num_heads, ff_dim, num_layers, dropout=0, model_type='classifier', num_symbols=0):
     inputs = layers.Input(shape=input_shape)
     x = inputs
     for _ in range(num_layers):
@@ -244,6 +355,9 @@ def build_transformer_model(input_shape, head_size, num_heads, ff_dim, num_layer
     x = layers.GlobalAveragePooling1D(data_format="channels_last")(x)
     x = layers.Dense(20, activation="relu")(x)
     x = layers.Dropout(0.1)(x)
+    inputs, x = _attach_symbol_embedding(inputs, x, num_symbols)
+    if model_type == 'multi':
+        return _compile_multi_head(inputs, x)
     if model_type == 'classifier':
         outputs = layers.Dense(3, activation="softmax")(x)
         model = models.Model(inputs, outputs)
@@ -254,52 +368,189 @@ def build_transformer_model(input_shape, head_size, num_heads, ff_dim, num_layer
         model.compile(optimizer="adam", loss="mean_squared_error", metrics=["mae"])
     return model
 
+@contextmanager
+def stage(times: dict, name: str):
+    """Ghi thời gian (giây) của 1 giai đoạn vào `times`."""
+    t0 = time.perf_counter()
+    try: yield
+    finally: times[name] = round(time.perf_counter() - t0, 2)
+
+def format_stages(times: dict) -> str: return " | ".join(f"{k} {v}s" for k, v in times.items())
+
+def train_lgbm_pair(X_train: pd.DataFrame, X_valid: pd.DataFrame, y_train: dict, y_valid: dict, num_rounds: int,
+                    init_models: dict = None, categorical_feature="auto"):
+    """Bin hoá (dựng histogram) tập train + valid MỘT lần rồi train lần lượt clf và reg trên cùng Dataset, chỉ đổi nhãn.
+    y_train / y_valid / init_models: dict theo 'clf' / 'reg'. Trả ({kind: lgb.Booster}, {giai đoạn: giây})."""
+    times, boosters, init_models = {}, {}, init_models or {}
+    with stage(times, "lgbm_dataset"):
+        # free_raw_data=False: cần dữ liệu gốc để tính init_score khi warm-start từ booster cũ
+        train_set = lgb.Dataset(X_train, label=y_train["clf"], categorical_feature=categorical_feature, params=LGBM_COMMON_PARAMS, free_raw_data=False).construct()
+        valid_set = lgb.Dataset(X_valid, label=y_valid["clf"], reference=train_set, free_raw_data=False).construct()
+    for kind, params in LGBM_PARAMS.items():
+        train_set.set_label(y_train[kind]); valid_set.set_label(y_valid[kind])
+        with stage(times, f"lgbm_{kind}"):
+            boosters[kind] = lgb.train({**LGBM_COMMON_PARAMS, **params}, train_set, num_boost_round=num_rounds, valid_sets=[valid_set],
+                                       init_model=init_models.get(kind), callbacks=[lgb.early_stopping(50, verbose=False)])
+    return boosters, times
+
+def save_lgbm_boosters(boosters: dict, symbol: str, interval: str):
+    for kind, booster in boosters.items():
+        booster.save_model(os.path.join(DATA_DIR, f"model_{symbol}_lgbm_{kind}_{interval}.txt"), num_iteration=booster.best_iteration or None)
+        # Vẫn ghi bản pickle (joblib, compress=3) cùng booster: model cũ / bench_inference --lgbm, ml_report ưu tiên .txt
+        joblib.dump(booster, os.path.join(DATA_DIR, f"model_{symbol}_lgbm_{kind}_{interval}.pkl"), compress=3)
+
+# --------------------------------------------------
+# PROFILE
+# --------------------------------------------------
+PROFILE_REPORT = {"stages": {}, "models": {}}
+
+def reset_peak_rss():
+    """Đặt lại VmHWM về RSS hiện tại để đo RSS đỉnh riêng cho từng model."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f: f.write("5")
+    except OSError: pass
+
+def peak_rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"): return round(int(line.split()[1]) / 1024, 1)
+    except (OSError, ValueError): pass
+    return 0.0
+
+class EpochTimer(callbacks.Callback):
+    def __init__(self):
+        super().__init__()
+        self.durations = []
+    def on_epoch_begin(self, epoch, logs=None): self._t0 = time.perf_counter()
+    def on_epoch_end(self, epoch, logs=None): self.durations.append(time.perf_counter() - self._t0)
+
+def profiled_fit(name: str, model, train_ds, n_samples: int, **fit_kwargs):
+    """model.fit; ở chế độ --profile ghi thêm thời gian từng epoch, mẫu/giây (bỏ epoch đầu vì có trace/compile) và RSS đỉnh."""
+    if not PROFILE: return model.fit(train_ds, **fit_kwargs)
+    timer = EpochTimer()
+    fit_kwargs["callbacks"] = list(fit_kwargs.get("callbacks") or []) + [timer]
+    reset_peak_rss(); t0 = time.perf_counter()
+    history = model.fit(train_ds, **fit_kwargs)
+    fit_s, durations = time.perf_counter() - t0, timer.durations
+    steady = float(np.mean(durations[1:] or durations)) if durations else 0.0
+    PROFILE_REPORT["models"][name] = {"fit_s": round(fit_s, 2), "epochs": len(durations), "epoch_s": [round(d, 3) for d in durations],
+                                      "steady_epoch_s": round(steady, 3), "samples_per_sec": round(n_samples / steady, 1) if steady else 0.0,
+                                      "peak_rss_mb": peak_rss_mb()}
+    print(f"      ⏱️ {name}: {len(durations)} epoch, {steady:.2f}s/epoch, {PROFILE_REPORT['models'][name]['samples_per_sec']} mẫu/s, RSS đỉnh {peak_rss_mb()}MB")
+    return history
+
+def write_profile_report(symbol: str, interval: str, stage_times: dict):
+    report = {"symbol": symbol, "interval": interval, "created_at": datetime.now(timezone.utc).isoformat(),
+              "config": {"threads": TRAINER_THREADS or (len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()),
+                         "batch_size": BATCH_SIZE, "lstm_unroll": LSTM_UNROLL, "onednn": os.environ.get("TF_ENABLE_ONEDNN_OPTS"),
+                         "xla_jit": bool(tf.config.optimizer.get_jit()), "multi_head": MULTI_HEAD, "epochs": PROFILE_EPOCHS},
+              "stages": {**PROFILE_REPORT["stages"], **stage_times}, "models": PROFILE_REPORT["models"],
+              "peak_rss_mb": max([m["peak_rss_mb"] for m in PROFILE_REPORT["models"].values()] + [peak_rss_mb()])}
+    path = PROFILE_OUT or os.path.join(BASE_DIR, "log", f"profile_{symbol}_{interval}.json")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f: json.dump(report, f, indent=2)
+    print(f"📊 Báo cáo profile: {path}")
+
+def load_previous_run(symbol: str, interval: str, features_to_use: list, df: pd.DataFrame):
+    """Điều kiện warm-start: có meta + scaler cũ, cùng bộ feature & bố cục model. Trả (meta cũ, vị trí nến mới đầu tiên) hoặc None."""
+    meta_path = os.path.join(DATA_DIR, f"meta_{symbol}_{interval}.json")
+    scaler_path = os.path.join(DATA_DIR, f"scaler_{symbol}_{interval}.pkl")
+    if not (os.path.exists(meta_path) and os.path.exists(scaler_path)):
+        print("  -> [INCREMENTAL] Chưa có model cũ → train đầy đủ."); return None
+    prev = json.load(open(meta_path))
+    if prev.get("features") != features_to_use or bool(prev.get("multi_head")) != MULTI_HEAD or prev.get("sequence_length") != SEQUENCE_LENGTH:
+        print("  -> [INCREMENTAL] Bộ feature/bố cục model đã đổi → train đầy đủ."); return None
+    # Nến cuối đã có nhãn ở lần train trước (meta cũ không có thì suy từ trained_at - future_offset)
+    last_labeled = prev.get("last_label_time")
+    cutoff = pd.Timestamp(last_labeled) if last_labeled else pd.Timestamp(prev["trained_at"]) - pd.Timedelta(interval) * prev.get("future_offset", 0)
+    new_start = int(df.index.searchsorted(cutoff, side="right"))
+    if new_start >= len(df):
+        print("  -> [INCREMENTAL] Không có nến mới kể từ lần train trước → giữ nguyên model."); return prev, None
+    print(f"  -> [INCREMENTAL] Warm-start từ {prev['trained_at']}: {len(df) - new_start} nến mới + replay {INCREMENTAL_REPLAY}.")
+    return prev, new_start
+
+def incremental_split(n_new_from: int, n_total: int, rng: np.random.Generator):
+    """Chỉ số train = toàn bộ phần mới (trừ 15% cuối làm validation) + mẫu replay ngẫu nhiên từ phần cũ."""
+    new_idx = np.arange(n_new_from, n_total)
+    val_size = max(1, int(len(new_idx) * 0.15)) if len(new_idx) > 1 else 0
+    replay = rng.choice(n_new_from, size=min(INCREMENTAL_REPLAY, n_new_from), replace=False) if n_new_from > 0 else np.array([], dtype=np.int64)
+    train_idx = np.sort(np.concatenate([replay, new_idx[:len(new_idx) - val_size]]))
+    val_idx = new_idx[len(new_idx) - val_size:] if val_size else new_idx
+    return train_idx, val_idx
+
 def train_and_save_all_models(symbol: str, interval: str, df: pd.DataFrame):
     print(f"--- Bắt đầu xử lý {symbol} [{interval}] ---")
     base_features = ['open', 'high', 'low', 'close', 'price']
     label_cols = ['label', 'reg_target']
     features_to_use = [c for c in df.columns if c not in base_features + label_cols]
-    scaler = StandardScaler()
-    df_scaled = df.copy()
-    df_scaled[features_to_use] = scaler.fit_transform(df[features_to_use]).astype(np.float32)
+    lgbm_classes, stage_times = None, {}
+    prev_run = load_previous_run(symbol, interval, features_to_use, df) if INCREMENTAL else None
+    if prev_run and prev_run[1] is None: return  # Không có gì mới để học
+    warm = prev_run is not None
+    rng = np.random.default_rng(SEED)
+    if warm:
+        # Giữ nguyên scaler cũ để trọng số đã học vẫn khớp với phân phối đầu vào
+        scaler = joblib.load(os.path.join(DATA_DIR, f"scaler_{symbol}_{interval}.pkl"))
+        df_scaled = df.copy()
+        df_scaled[features_to_use] = scaler.transform(df[features_to_use]).astype(np.float32)
+    else:
+        scaler = StandardScaler()
+        df_scaled = df.copy()
+        df_scaled[features_to_use] = scaler.fit_transform(df[features_to_use]).astype(np.float32)
 
     print("  -> (1/3) LightGBM...")
     try:
-        X_lgbm, y_clf_lgbm, y_reg_lgbm = df[features_to_use], df['label'], df['reg_target']
-        X_train_lgbm, X_test_lgbm, y_train_clf, y_test_clf, y_train_reg, y_test_reg = train_test_split(
-            X_lgbm, y_clf_lgbm, y_reg_lgbm, test_size=0.15, shuffle=False)
-        clf_lgbm = lgb.LGBMClassifier(objective='multiclass', num_class=3, is_unbalance=True, n_estimators=1000,
-                                      learning_rate=0.05, verbose=-1, n_jobs=-1)
-        clf_lgbm.fit(X_train_lgbm, y_train_clf, eval_set=[(X_test_lgbm, y_test_clf)],
-                     callbacks=[lgb.early_stopping(50, verbose=False)])
-        reg_lgbm = lgb.LGBMRegressor(objective='regression_l1', n_estimators=1000,
-                                     learning_rate=0.05, verbose=-1, n_jobs=-1)
-        reg_lgbm.fit(X_train_lgbm, y_train_reg, eval_set=[(X_test_lgbm, y_test_reg)],
-                     callbacks=[lgb.early_stopping(50, verbose=False)])
-        joblib.dump(clf_lgbm, os.path.join(DATA_DIR, f"model_{symbol}_lgbm_clf_{interval}.pkl"), compress=3)
-        joblib.dump(reg_lgbm, os.path.join(DATA_DIR, f"model_{symbol}_lgbm_reg_{interval}.pkl"), compress=3)
-        print("      ✅ LightGBM xong.")
+        X_lgbm, y_lgbm = df[features_to_use], {"clf": df['label'].to_numpy(), "reg": df['reg_target'].to_numpy()}
+        num_rounds, init_models = 1000, None
+        prev_boosters = {k: os.path.join(DATA_DIR, f"model_{symbol}_lgbm_{k}_{interval}.txt") for k in ("clf", "reg")}
+        if warm and all(os.path.exists(p) for p in prev_boosters.values()):
+            # Thêm cây mới lên booster cũ, chỉ học trên nến mới + replay
+            tr_idx, va_idx = incremental_split(prev_run[1], len(df), rng)
+            num_rounds, init_models = INCREMENTAL_LGBM_ROUNDS, prev_boosters
+        else:
+            split = len(df) - int(np.ceil(len(df) * 0.15))  # 15% nến cuối làm validation (không xáo trộn)
+            tr_idx, va_idx = np.arange(split), np.arange(split, len(df))
+        if PROFILE: reset_peak_rss()  # Chỉ khi profile: train_orchestrator đọc VmHWM của cả tiến trình
+        boosters, lgbm_times = train_lgbm_pair(X_lgbm.iloc[tr_idx], X_lgbm.iloc[va_idx], {k: v[tr_idx] for k, v in y_lgbm.items()},
+                                               {k: v[va_idx] for k, v in y_lgbm.items()}, num_rounds, init_models)
+        if PROFILE:
+            PROFILE_REPORT["models"]["lgbm"] = {"fit_s": round(sum(lgbm_times.values()), 2), "rounds": {k: b.current_iteration() for k, b in boosters.items()},
+                                                "samples_per_sec": round(len(tr_idx) * 2 / max(lgbm_times['lgbm_clf'] + lgbm_times['lgbm_reg'], 1e-9), 1), "peak_rss_mb": peak_rss_mb()}
+        # File booster gốc (text): load nhanh hơn nhiều so với giải nén + unpickle wrapper sklearn
+        save_lgbm_boosters(boosters, symbol, interval)
+        lgbm_classes = LGBM_CLASSES
+        stage_times.update(lgbm_times)
+        print(f"      ✅ LightGBM xong. ⏱️ {format_stages(lgbm_times)}")
     except Exception as e:
         print(f"      ❌ LGBM lỗi: {e}")
 
     print("  -> Dựng dữ liệu chuỗi và pipeline tf.data cho DL...")
     try:
-        X_seq, y_clf_seq, y_reg_seq = create_sequences(df_scaled, features_to_use, 'label', 'reg_target', SEQUENCE_LENGTH)
-        X_seq = X_seq.astype(np.float32)
+        # 1 bản dữ liệu float32 liên tục duy nhất; các cửa sổ chỉ là view/chỉ số trên nó
+        seq_values = np.ascontiguousarray(df_scaled[features_to_use].to_numpy(dtype=np.float32))
+        X_seq, y_clf_seq, y_reg_seq = create_sequences(seq_values, df_scaled['label'].to_numpy(), df_scaled['reg_target'].to_numpy(), SEQUENCE_LENGTH)
         y_clf_seq_cat = utils.to_categorical(y_clf_seq.astype(np.int32), num_classes=3).astype(np.float32)
         y_reg_seq = y_reg_seq.astype(np.float32)
         if len(X_seq) < 100: raise ValueError(f"Không đủ chuỗi ({len(X_seq)}).")
         
         val_size = int(len(X_seq) * 0.15)
         train_size = len(X_seq) - val_size
+        train_idx, val_idx = np.arange(train_size), np.arange(train_size, len(X_seq))
+        if warm:
+            # Cửa sổ i có nhãn tại dòng i + SEQ -> cửa sổ "mới" là các cửa sổ có nhãn thuộc phần nến mới
+            train_idx, val_idx = incremental_split(max(prev_run[1] - SEQUENCE_LENGTH, 0), len(X_seq), rng)
+            train_size = val_idx[0]
+        seq_tensor = tf.constant(seq_values)
         
-        ds_clf = tf.data.Dataset.from_tensor_slices((X_seq, y_clf_seq_cat))
-        train_ds_clf = ds_clf.take(train_size).shuffle(buffer_size=train_size).batch(BATCH_SIZE).prefetch(buffer_size=tf.data.AUTOTUNE)
-        val_ds_clf = ds_clf.skip(train_size).batch(BATCH_SIZE).prefetch(buffer_size=tf.data.AUTOTUNE)
+        train_ds_clf = make_window_dataset(seq_tensor, y_clf_seq_cat, train_idx, SEQUENCE_LENGTH, shuffle=True)
+        val_ds_clf = make_window_dataset(seq_tensor, y_clf_seq_cat, val_idx, SEQUENCE_LENGTH)
         
-        ds_reg = tf.data.Dataset.from_tensor_slices((X_seq, y_reg_seq))
-        train_ds_reg = ds_reg.take(train_size).shuffle(buffer_size=train_size).batch(BATCH_SIZE).prefetch(buffer_size=tf.data.AUTOTUNE)
-        val_ds_reg = ds_reg.skip(train_size).batch(BATCH_SIZE).prefetch(buffer_size=tf.data.AUTOTUNE)
+        train_ds_reg = make_window_dataset(seq_tensor, y_reg_seq, train_idx, SEQUENCE_LENGTH, shuffle=True)
+        val_ds_reg = make_window_dataset(seq_tensor, y_reg_seq, val_idx, SEQUENCE_LENGTH)
+
+        train_ds_multi = make_window_dataset(seq_tensor, (y_clf_seq_cat, y_reg_seq), train_idx, SEQUENCE_LENGTH, shuffle=True)
+        val_ds_multi = make_window_dataset(seq_tensor, (y_clf_seq_cat, y_reg_seq), val_idx, SEQUENCE_LENGTH)
     except Exception as e:
         print(f"      ❌ Tạo chuỗi/pipeline lỗi: {e}. Bỏ qua DL.")
         meta = {"features": features_to_use, "trained_at": datetime.now(timezone.utc).isoformat(), "atr_factor_threshold": LABEL_MAP.get(interval, 0.75), "future_offset": OFFS_MAP.get(interval, 4), "sequence_length": SEQUENCE_LENGTH}
@@ -310,50 +561,266 @@ def train_and_save_all_models(symbol: str, interval: str, df: pd.DataFrame):
     input_shape = (X_seq.shape[1], X_seq.shape[2])
     es_callback_clf = callbacks.EarlyStopping(patience=10, monitor='val_accuracy', mode='max', restore_best_weights=True)
     es_callback_reg = callbacks.EarlyStopping(patience=10, monitor='val_loss', mode='min', restore_best_weights=True)
+    if MULTI_HEAD: print(f"  -> Chế độ MULTI_HEAD (reg_weight={MULTI_HEAD_REG_WEIGHT}): 1 model/kiến trúc.")
+
+    tflite_report = {}
+    parity_sample = np.ascontiguousarray(X_seq[train_size:][-TFLITE_PARITY_SAMPLES:])
+
+    def save_model(model, arch: str, kind: str):
+        model.save(os.path.join(DATA_DIR, f"model_{symbol}_{arch}_{kind}_{interval}.keras"))
+        tflite_path = os.path.join(DATA_DIR, f"model_{symbol}_{arch}_{kind}_{interval}.tflite")
+        if os.path.exists(tflite_path): os.remove(tflite_path)  # Không để bản TFLite cũ lệch với model mới
+        if not TFLITE_EXPORT: return
+        try:
+            tflite_report[f"{arch}_{kind}"] = report = export_tflite(model, tflite_path, parity_sample)
+            print(f"      {'✅' if report['ok'] else '⚠️'} TFLite {arch}_{kind}: lệch {report['max_diff']} ({report['size_kb']}KB)")
+        except Exception as e:
+            tflite_report[f"{arch}_{kind}"] = {"ok": False, "error": str(e)}
+            print(f"      ⚠️ Xuất TFLite {arch}_{kind} lỗi: {e}")
+
+    epochs = PROFILE_EPOCHS if PROFILE else (INCREMENTAL_EPOCHS if warm else 50)
+    n_train = len(train_idx)
+
+    def get_model(build, arch: str, kind: str, model_type: str):
+        """Warm-start: load model lần trước (kèm trạng thái optimizer) nếu có, ngược lại dựng mới."""
+        path = os.path.join(DATA_DIR, f"model_{symbol}_{arch}_{kind}_{interval}.keras")
+        if warm and os.path.exists(path): return keras.models.load_model(path)
+        return build(model_type)
+
+    def fit_and_save(arch: str, build):
+        if MULTI_HEAD:
+            multi = get_model(build, arch, 'multi', 'multi')
+            profiled_fit(f"{arch}_multi", multi, train_ds_multi, n_train, validation_data=val_ds_multi, epochs=epochs, callbacks=[es_callback_reg], verbose=VERBOSE)
+            save_model(multi, arch, 'multi')
+            return
+        clf = get_model(build, arch, 'clf', 'classifier')
+        profiled_fit(f"{arch}_clf", clf, train_ds_clf, n_train, validation_data=val_ds_clf, epochs=epochs, callbacks=[es_callback_clf], verbose=VERBOSE)
+        save_model(clf, arch, 'clf')
+
+        reg = get_model(build, arch, 'reg', 'regressor')
+        profiled_fit(f"{arch}_reg", reg, train_ds_reg, n_train, validation_data=val_ds_reg, epochs=epochs, callbacks=[es_callback_reg], verbose=VERBOSE)
+        save_model(reg, arch, 'reg')
 
     print("  -> (2/3) LSTM...")
     try:
-        clf_lstm = build_lstm_model(input_shape, model_type='classifier')
-        clf_lstm.fit(train_ds_clf, validation_data=val_ds_clf, epochs=50, callbacks=[es_callback_clf], verbose=VERBOSE)
-        clf_lstm.save(os.path.join(DATA_DIR, f"model_{symbol}_lstm_clf_{interval}.keras"))
-
-        reg_lstm = build_lstm_model(input_shape, model_type='regressor')
-        reg_lstm.fit(train_ds_reg, validation_data=val_ds_reg, epochs=50, callbacks=[es_callback_reg], verbose=VERBOSE)
-        reg_lstm.save(os.path.join(DATA_DIR, f"model_{symbol}_lstm_reg_{interval}.keras"))
-        print("      ✅ LSTM xong.")
+        with stage(stage_times, "lstm"): fit_and_save("lstm", lambda t: build_lstm_model(input_shape, model_type=t))
+        print(f"      ✅ LSTM xong. ⏱️ {stage_times['lstm']}s")
     except Exception as e:
         print(f"      ❌ LSTM lỗi: {e}")
 
     print("  -> (3/3) Transformer...")
     try:
-        clf_trans = build_transformer_model(input_shape, head_size=256, num_heads=TRANSFORMER_HEADS, ff_dim=4, num_layers=TRANSFORMER_LAYERS, model_type='classifier')
-        clf_trans.fit(train_ds_clf, validation_data=val_ds_clf, epochs=50, callbacks=[es_callback_clf], verbose=VERBOSE)
-        clf_trans.save(os.path.join(DATA_DIR, f"model_{symbol}_transformer_clf_{interval}.keras"))
-
-        reg_trans = build_transformer_model(input_shape, head_size=256, num_heads=TRANSFORMER_HEADS, ff_dim=4, num_layers=TRANSFORMER_LAYERS, model_type='regressor')
-        reg_trans.fit(train_ds_reg, validation_data=val_ds_reg, epochs=50, callbacks=[es_callback_reg], verbose=VERBOSE)
-        reg_trans.save(os.path.join(DATA_DIR, f"model_{symbol}_transformer_reg_{interval}.keras"))
-        print("      ✅ Transformer xong.")
+        with stage(stage_times, "transformer"):
+            fit_and_save("transformer", lambda t: build_transformer_model(input_shape, head_size=256, num_heads=TRANSFORMER_HEADS, ff_dim=4, num_layers=TRANSFORMER_LAYERS, model_type=t))
+        print(f"      ✅ Transformer xong. ⏱️ {stage_times['transformer']}s")
     except Exception as e:
         print(f"      ❌ Transformer lỗi: {e}")
 
-    meta = {"features": features_to_use, "trained_at": datetime.now(timezone.utc).isoformat(), "atr_factor_threshold": LABEL_MAP.get(interval, 0.75), "future_offset": OFFS_MAP.get(interval, 4), "sequence_length": SEQUENCE_LENGTH}
+    meta = {"features": features_to_use, "trained_at": datetime.now(timezone.utc).isoformat(), "atr_factor_threshold": LABEL_MAP.get(interval, 0.75), "future_offset": OFFS_MAP.get(interval, 4), "sequence_length": SEQUENCE_LENGTH, "multi_head": MULTI_HEAD, "tflite": tflite_report, "lgbm_classes": lgbm_classes,
+            "last_label_time": df.index[-1].isoformat(), "incremental_from": prev_run[0]["trained_at"] if warm else None}
     joblib.dump(scaler, os.path.join(DATA_DIR, f"scaler_{symbol}_{interval}.pkl"))
     with open(os.path.join(DATA_DIR, f"meta_{symbol}_{interval}.json"), "w") as f: json.dump(meta, f, indent=2)
     counts = pd.Series(df['label']).value_counts()
-    print(f"--- ✅ Xong {symbol} [{interval}] | Tổng: {len(df)} (S:{counts.get(0,0)}, H:{counts.get(1,0)}, B:{counts.get(2,0)}) ---\n")
+    print(f"--- ✅ Xong {symbol} [{interval}] | Tổng: {len(df)} (S:{counts.get(0,0)}, H:{counts.get(1,0)}, B:{counts.get(2,0)}) ---")
+    print(f"    ⏱️ {format_stages(stage_times)}\n")
+    if PROFILE: write_profile_report(symbol, interval, stage_times)
+
+def train_pooled_models(interval: str, datasets: dict):
+    """1 bộ model cho cả interval: dữ liệu mọi symbol được gộp, chuẩn hoá RIÊNG theo từng symbol và gắn symbol_id
+    (cột categorical cho LightGBM, embedding cho LSTM/Transformer). Cửa sổ chuỗi không bao giờ vắt qua 2 symbol."""
+    symbols = sorted(datasets)
+    print(f"--- Bắt đầu xử lý MODEL GỘP [{interval}] cho {len(symbols)} symbol ---")
+    base_features = ['open', 'high', 'low', 'close', 'price']
+    label_cols = ['label', 'reg_target']
+    features_to_use = [c for c in datasets[symbols[0]].columns if c not in base_features + label_cols]
+    lgbm_classes = None
+
+    scalers, values_parts, id_parts, clf_parts, reg_parts = {}, [], [], [], []
+    lgbm_train, lgbm_valid, train_idx, val_idx = [], [], [], []
+    offset = 0
+    for sid, sym in enumerate(symbols):
+        df = datasets[sym]
+        scalers[sym] = StandardScaler().fit(df[features_to_use])
+        vals = scalers[sym].transform(df[features_to_use]).astype(np.float32)
+        n = len(vals)
+        lgbm_df = pd.DataFrame(vals, columns=features_to_use)
+        lgbm_df['symbol_id'] = sid
+        lgbm_df['label'], lgbm_df['reg_target'] = df['label'].to_numpy(), df['reg_target'].to_numpy()
+        split = n - int(n * 0.15)  # 15% cuối của MỖI symbol làm validation (theo thời gian)
+        lgbm_train.append(lgbm_df.iloc[:split]); lgbm_valid.append(lgbm_df.iloc[split:])
+
+        # Nhãn của cửa sổ bắt đầu tại i (toàn cục) được đặt tại vị trí i -> make_window_dataset gather theo cùng chỉ số
+        n_win = n - SEQUENCE_LENGTH
+        y_clf = np.zeros((n, 3), dtype=np.float32); y_reg = np.zeros(n, dtype=np.float32)
+        if n_win > 0:
+            y_clf[:n_win] = utils.to_categorical(df['label'].to_numpy()[SEQUENCE_LENGTH:].astype(np.int32), num_classes=3)
+            y_reg[:n_win] = df['reg_target'].to_numpy()[SEQUENCE_LENGTH:]
+            win_split = n_win - int(n_win * 0.15)
+            train_idx.append(offset + np.arange(win_split)); val_idx.append(offset + np.arange(win_split, n_win))
+        values_parts.append(vals); id_parts.append(np.full(n, sid, dtype=np.int32)); clf_parts.append(y_clf); reg_parts.append(y_reg)
+        offset += n
+
+    print("  -> (1/3) LightGBM...")
+    try:
+        train_df, valid_df = pd.concat(lgbm_train, ignore_index=True), pd.concat(lgbm_valid, ignore_index=True)
+        lgbm_cols = features_to_use + ['symbol_id']
+        boosters, lgbm_times = train_lgbm_pair(train_df[lgbm_cols], valid_df[lgbm_cols], {"clf": train_df['label'].to_numpy(), "reg": train_df['reg_target'].to_numpy()},
+                                               {"clf": valid_df['label'].to_numpy(), "reg": valid_df['reg_target'].to_numpy()}, 1000, categorical_feature=['symbol_id'])
+        save_lgbm_boosters(boosters, POOLED_KEY, interval)
+        lgbm_classes = LGBM_CLASSES
+        print(f"      ✅ LightGBM xong. ⏱️ {format_stages(lgbm_times)}")
+    except Exception as e:
+        print(f"      ❌ LGBM lỗi: {e}")
+
+    seq_tensor = tf.constant(np.concatenate(values_parts))
+    symbol_ids = np.concatenate(id_parts)
+    y_clf_all, y_reg_all = np.concatenate(clf_parts), np.concatenate(reg_parts)
+    train_idx, val_idx = np.concatenate(train_idx), np.concatenate(val_idx)
+    del values_parts, clf_parts, reg_parts
+    def dataset(targets, idx, shuffle=False):
+        return make_window_dataset(seq_tensor, targets, idx, SEQUENCE_LENGTH, shuffle=shuffle, symbol_ids=symbol_ids)
+
+    input_shape = (SEQUENCE_LENGTH, len(features_to_use))
+    es_callback_clf = callbacks.EarlyStopping(patience=10, monitor='val_accuracy', mode='max', restore_best_weights=True)
+    es_callback_reg = callbacks.EarlyStopping(patience=10, monitor='val_loss', mode='min', restore_best_weights=True)
+    builders = {
+        "lstm": lambda t: build_lstm_model(input_shape, model_type=t, num_symbols=len(symbols)),
+        "transformer": lambda t: build_transformer_model(input_shape, head_size=256, num_heads=TRANSFORMER_HEADS, ff_dim=4, num_layers=TRANSFORMER_LAYERS, model_type=t, num_symbols=len(symbols)),
+    }
+    for step, (arch, build) in enumerate(builders.items(), start=2):
+        print(f"  -> ({step}/3) {arch}...")
+        try:
+            if MULTI_HEAD:
+                jobs = [('multi', (y_clf_all, y_reg_all), es_callback_reg)]
+            else:
+                jobs = [('clf', y_clf_all, es_callback_clf), ('reg', y_reg_all, es_callback_reg)]
+            for kind, targets, es in jobs:
+                model = build({'clf': 'classifier', 'reg': 'regressor'}.get(kind, kind))
+                model.fit(dataset(targets, train_idx, shuffle=True), validation_data=dataset(targets, val_idx), epochs=50, callbacks=[es], verbose=VERBOSE)
+                model.save(os.path.join(DATA_DIR, f"model_{POOLED_KEY}_{arch}_{kind}_{interval}.keras"))
+            print(f"      ✅ {arch} xong.")
+        except Exception as e:
+            print(f"      ❌ {arch} lỗi: {e}")
+
+    # Model gộp có 2 đầu vào (cửa sổ + symbol_id) nên không xuất TFLite
+    meta = {"features": features_to_use, "trained_at": datetime.now(timezone.utc).isoformat(), "atr_factor_threshold": LABEL_MAP.get(interval, 0.75), "future_offset": OFFS_MAP.get(interval, 4), "sequence_length": SEQUENCE_LENGTH, "multi_head": MULTI_HEAD, "tflite": {}, "lgbm_classes": lgbm_classes,
+            "pooled": True, "symbols": symbols}
+    joblib.dump(scalers, os.path.join(DATA_DIR, f"scaler_{POOLED_KEY}_{interval}.pkl"))
+    with open(os.path.join(DATA_DIR, f"meta_{POOLED_KEY}_{interval}.json"), "w") as f: json.dump(meta, f, indent=2)
+    print(f"--- ✅ Xong MODEL GỘP [{interval}] | {len(symbols)} symbol, {offset} mẫu ---\n")
+
+def dataset_signature(fut_off: int, atr_factor: float) -> str:
+    """Đổi tham số nhãn hoặc code tính đặc trưng/nhãn -> cache dataset cũ không còn dùng được."""
+    src = inspect.getsource(add_features) + inspect.getsource(create_labels_and_targets)
+    return hashlib.sha1(f"{src}|{fut_off}|{atr_factor}|{FEATURE_WARMUP}".encode()).hexdigest()[:16]
+
+def dataset_cache_paths(symbol: str, interval: str) -> dict:
+    return {k: os.path.join(DATASET_CACHE_DIR, f"{k}_{symbol}_{interval}.{ext}") for k, ext in (("raw", "parquet"), ("dataset", "parquet"), ("meta", "json"))}
+
+def load_dataset_cache(symbol: str, interval: str, signature: str):
+    """(nến thô, dataset đã gắn nhãn) từ lần chạy trước, hoặc None nếu chưa có / không khớp."""
+    paths = dataset_cache_paths(symbol, interval)
+    if not DATASET_CACHE or not all(os.path.exists(p) for p in paths.values()): return None
+    try:
+        meta = json.load(open(paths["meta"]))
+        if meta.get("signature") != signature:
+            print("  -> [CACHE] Tham số/code đặc trưng đã đổi → dựng lại toàn bộ."); return None
+        df_raw, df_dataset = pd.read_parquet(paths["raw"]), pd.read_parquet(paths["dataset"])
+    except Exception as e:
+        print(f"  -> [CACHE] Không đọc được cache ({e}) → dựng lại toàn bộ."); return None
+    # Job khác vừa ghi cache giữa chừng lúc đang đọc -> 3 file không cùng 1 lần ghi
+    if (meta.get("raw_rows"), meta.get("rows")) != (len(df_raw), len(df_dataset)):
+        print("  -> [CACHE] Cache đang được job khác ghi → dựng lại toàn bộ."); return None
+    return (df_raw, df_dataset) if not df_raw.empty and not df_dataset.empty else None
+
+def _write_atomic(path: str, write):
+    """Ghi ra file tạm cùng thư mục rồi os.replace: job train khác (pooled / từng symbol) đọc cùng lúc không thấy file dở."""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try: write(tmp); os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp): os.remove(tmp)
+
+def save_dataset_cache(symbol: str, interval: str, signature: str, df_raw: pd.DataFrame, df_dataset: pd.DataFrame):
+    if not DATASET_CACHE: return
+    paths = dataset_cache_paths(symbol, interval)
+    meta = {"signature": signature, "updated_at": datetime.now(timezone.utc).isoformat(), "raw_rows": len(df_raw), "rows": len(df_dataset)}
+    def write_meta(tmp):
+        with open(tmp, "w") as f: json.dump(meta, f)
+    try:
+        os.makedirs(DATASET_CACHE_DIR, exist_ok=True)
+        _write_atomic(paths["raw"], df_raw.to_parquet); _write_atomic(paths["dataset"], df_dataset.to_parquet)
+        _write_atomic(paths["meta"], write_meta)
+    except Exception as e:
+        print(f"[WARN] Không ghi được cache dataset {symbol} [{interval}]: {e}")
+
+def refresh_dataset(cached: tuple, symbol: str, interval: str, total: int, step: int, fut_off: int, atr_factor: float):
+    """Chỉ tải nến sau nến cuối trong cache, tính lại đặc trưng/nhãn cho phần đuôi chưa có nhãn + nến mới
+    (kèm FEATURE_WARMUP nến trước đó để chỉ báo hội tụ). Trả (nến thô, dataset) hoặc None nếu phải dựng lại toàn bộ."""
+    old_raw, old_dataset = cached
+    last_open = old_raw.index[-1]
+    if pd.Timestamp.now(tz="UTC") - last_open > pd.Timedelta(interval) * total:
+        print("  -> [CACHE] Cache quá cũ → dựng lại toàn bộ."); return None
+    new_raw = closed_candles(get_price_history_since(symbol, interval, last_open + pd.Timedelta(interval), step), interval)
+    df_raw = pd.concat([old_raw, new_raw]) if not new_raw.empty else old_raw
+    df_raw = df_raw[~df_raw.index.duplicated(keep="last")].sort_index().iloc[-total:]
+    # Các dòng sau dòng có nhãn cuối cùng: fut_off dòng cuối cache (chưa có nhãn) + nến mới
+    start = int(df_raw.index.searchsorted(old_dataset.index[-1], side="right"))
+    if start < FEATURE_WARMUP and len(df_raw) > start:
+        print("  -> [CACHE] Không đủ nến khởi động chỉ báo → dựng lại toàn bộ."); return None
+    tail_features = add_features(df_raw.iloc[max(start - FEATURE_WARMUP, 0):]).loc[df_raw.index[start:]]
+    tail_dataset = create_labels_and_targets(tail_features, fut_off, atr_factor)
+    df_dataset = pd.concat([old_dataset, tail_dataset])
+    df_dataset = df_dataset[df_dataset.index >= df_raw.index[0]]
+    print(f"  -> [CACHE] +{len(new_raw)} nến mới, tính lại {len(df_raw) - start} dòng đuôi (+{len(tail_dataset)} mẫu có nhãn).")
+    return df_raw, df_dataset
+
+def build_dataset(symbol: str, interval: str):
+    """Tải lịch sử giá, tính đặc trưng và nhãn (dùng lại cache của lần trước nếu có). Trả None nếu không đủ dữ liệu."""
+    hist_len   = HIST_MAP.get(interval, 3000)
+    fut_off    = OFFS_MAP.get(interval, 4)
+    atr_factor = LABEL_MAP.get(interval, 0.75)
+    step_size  = STEP_MAP.get(interval, 1000)
+    min_rows   = MIN_MAP.get(interval, 500)
+    total      = hist_len + fut_off + SEQUENCE_LENGTH
+    signature  = dataset_signature(fut_off, atr_factor)
+
+    print(f"\n🔄 Dựng dữ liệu cho {symbol} [{interval}]...")
+    cached = load_dataset_cache(symbol, interval, signature)
+    refreshed = refresh_dataset(cached, symbol, interval, total, step_size, fut_off, atr_factor) if cached else None
+    if refreshed:
+        df_raw, df_dataset = refreshed
+    else:
+        df_raw = closed_candles(get_full_price_history(symbol, interval, total + 1, step_size), interval).iloc[-total:]
+        if len(df_raw) < min_rows:
+            print(f"❌ Bỏ qua {symbol} [{interval}] – chỉ có {len(df_raw)} nến (< {min_rows}).")
+            return None
+        df_features = add_features(df_raw)
+        df_dataset  = create_labels_and_targets(df_features, fut_off, atr_factor)
+    save_dataset_cache(symbol, interval, signature, df_raw, df_dataset)
+
+    if len(df_dataset) < (min_rows // 2):
+        print(f"⚠️ Bỏ qua {symbol} [{interval}] – mẫu hợp lệ sau khi tạo nhãn quá ít: {len(df_dataset)}.")
+        return None
+    return df_dataset
 
 # ======================== KHỐI MAIN ĐÃ ĐƯỢC THAY THẾ HOÀN TOÀN ========================
 if __name__ == "__main__":
-    # Script bây giờ sẽ nhận chính xác 2 tham số: SYMBOL và INTERVAL
-    if len(sys.argv) != 3:
+    # Script nhận 2 tham số: SYMBOL và INTERVAL, hoặc --pooled INTERVAL (1 bộ model cho mọi SYMBOLS)
+    argv = [a for a in sys.argv[1:] if a != "--profile"]
+    if PROFILE and argv[:1] == ["--pooled"]:
+        print("Lỗi: --profile không hỗ trợ chế độ --pooled. Hãy profile từng cặp: python trainer.py <SYMBOL> <INTERVAL> --profile")
+        sys.exit(1)
+    if len(argv) != 2:
         print("Lỗi: Cần cung cấp chính xác 2 tham số: SYMBOL và INTERVAL")
-        print("Cách dùng: python trainer.py <SYMBOL> <INTERVAL>")
+        print("Cách dùng: python trainer.py <SYMBOL> <INTERVAL> [--profile]")
+        print("           python trainer.py --pooled <INTERVAL>   (model gộp cho mọi SYMBOLS)")
         print("Ví dụ: python trainer.py ETHUSDT 1h")
         sys.exit(1)
 
-    target_symbol = sys.argv[1].strip().upper()
-    target_interval = sys.argv[2].strip().lower()
+    pooled_mode = argv[0].strip() == "--pooled"
+    target_symbol = POOLED_KEY if pooled_mode else argv[0].strip().upper()
+    target_interval = argv[1].strip().lower()
+    if PROFILE: print(f"📊 Chế độ PROFILE: {PROFILE_EPOCHS} epoch/model, model ghi vào {DATA_DIR}")
 
     print(f"--- BẮT ĐẦU QUÁ TRÌNH HUẤN LUYỆN CHO {target_symbol} [{target_interval}] ---")
     gpus = tf.config.list_physical_devices('GPU')
@@ -367,34 +834,28 @@ if __name__ == "__main__":
     else:
         print("⚠️ Không phát hiện GPU. Sẽ chạy trên CPU (rất chậm).")
 
-    # Lấy cấu hình cho đúng interval
-    hist_len   = HIST_MAP.get(target_interval, 3000)
-    fut_off    = OFFS_MAP.get(target_interval, 4)
-    atr_factor = LABEL_MAP.get(target_interval, 0.75)
-    step_size  = STEP_MAP.get(target_interval, 1000)
-    min_rows   = MIN_MAP.get(target_interval, 500)
-    
     try:
-        print(f"\n🔄 Dựng dữ liệu cho {target_symbol} [{target_interval}]...")
-        df_raw = get_full_price_history(target_symbol, target_interval, hist_len + fut_off + SEQUENCE_LENGTH, step_size)
-        if len(df_raw) < min_rows:
-            print(f"❌ Bỏ qua {target_symbol} [{target_interval}] – chỉ có {len(df_raw)} nến (< {min_rows}).")
-            sys.exit(0)
-
-        df_features = add_features(df_raw)
-        df_dataset  = create_labels_and_targets(df_features, fut_off, atr_factor)
-        
-        if len(df_dataset) < (min_rows // 2):
-            print(f"⚠️ Bỏ qua {target_symbol} [{target_interval}] – mẫu hợp lệ sau khi tạo nhãn quá ít: {len(df_dataset)}.")
-            sys.exit(0)
-
-        # Bây giờ, không cần dọn dẹp thủ công nữa vì tiến trình sẽ tự kết thúc
-        train_and_save_all_models(target_symbol, target_interval, df_dataset)
+        if pooled_mode:
+            datasets = {}
+            for sym in (s.strip().upper() for s in SYMBOLS if s.strip()):
+                df_dataset = build_dataset(sym, target_interval)
+                if df_dataset is not None: datasets[sym] = df_dataset
+            if not datasets:
+                print(f"❌ Không có symbol nào đủ dữ liệu cho [{target_interval}]."); sys.exit(0)
+            train_pooled_models(target_interval, datasets)
+        else:
+            with stage(PROFILE_REPORT["stages"], "build_dataset"): df_dataset = build_dataset(target_symbol, target_interval)
+            if df_dataset is None: sys.exit(0)
+
+            # Bây giờ, không cần dọn dẹp thủ công nữa vì tiến trình sẽ tự kết thúc
+            train_and_save_all_models(target_symbol, target_interval, df_dataset)
 
     except Exception as e:
         print(f"[CRITICAL] Lỗi nghiêm trọng khi xử lý {target_symbol} [{target_interval}]: {e}")
         import traceback
         print(traceback.format_exc())
         sys.exit(1)
+    finally:
+        if PROFILE and not os.getenv("TRAINER_DATA_DIR"): shutil.rmtree(DATA_DIR, ignore_errors=True)
 
     print(f"\n🎯 HOÀN TẤT HUẤN LUYỆN CHO {target_symbol} [{target_interval}]. Tiến trình sẽ thoát và giải phóng bộ nhớ.")
@@ -0,0 +1,236 @@
+# ===================================================================
+# walk_forward.py - ĐÁNH GIÁ WALK-FORWARD CHO BỘ ENSEMBLE LightGBM/LSTM/Transformer
+# ===================================================================
+# - Dựng dataset 1 lần (trainer.build_dataset, dùng cache nến) rồi ghi ma trận
+#   đặc trưng + nhãn ra file .npy; mọi fold mở chung qua np.load(mmap_mode="r").
+# - Cửa sổ trượt: train `--train` dòng -> bỏ `gap` dòng (= future_offset, tránh
+#   nhãn của train nhìn vào giai đoạn test) -> test `--test` dòng, trượt đúng
+#   bằng `--test`. --expanding: train luôn bắt đầu từ dòng 0.
+# - Các fold chạy song song trong tiến trình con (spawn), mỗi tiến trình
+#   `--threads` luồng. Scaler chỉ fit trên phần train của fold.
+# - Dự đoán out-of-fold (prob_buy, prob_sell, pct) của từng model được lưu vào
+#   oof.npz -> --eval-only chấm lại trọng số ensemble mà không cần train lại.
+#
+# Chạy: python walk_forward.py ETHUSDT 1h [--train 1500 --test 250 --workers 2 --threads 2]
+#       python walk_forward.py ETHUSDT 1h --eval-only [--step 0.05 --objective logloss]
+# ===================================================================
+
+import os, sys, json, time, argparse, itertools
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timezone
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BASE_DIR)
+WF_DIR = os.path.join(BASE_DIR, "data", "walk_forward")
+MODEL_NAMES = ("lightgbm", "lstm", "transformer")
+OBJECTIVES = {"logloss": False, "mae": False, "accuracy": True, "signal_return": True}  # True = càng cao càng tốt
+
+def run_paths(symbol: str, interval: str) -> dict:
+    d = os.path.join(WF_DIR, f"{symbol}_{interval}")
+    return {"dir": d, "features": os.path.join(d, "features.npy"), "y_clf": os.path.join(d, "y_clf.npy"), "y_reg": os.path.join(d, "y_reg.npy"),
+            "meta": os.path.join(d, "meta.json"), "oof": os.path.join(d, "oof.npz"), "report": os.path.join(d, "report.json")}
+
+# --------------------------------------------------
+# DỰNG DỮ LIỆU & CHIA FOLD
+# --------------------------------------------------
+def write_memmap(path: str, values: np.ndarray):
+    """Ghi mảng ra .npy (định dạng chuẩn) để các tiến trình con mở bằng mmap, không sao chép vào từng tiến trình."""
+    out = np.lib.format.open_memmap(path, mode="w+", dtype=values.dtype, shape=values.shape)
+    out[:] = values; out.flush(); del out
+
+def prepare_data(symbol: str, interval: str, paths: dict) -> dict:
+    import trainer
+    df = trainer.build_dataset(symbol, interval)
+    if df is None: raise SystemExit(f"❌ Không dựng được dataset cho {symbol} [{interval}].")
+    features = [c for c in df.columns if c not in ['open', 'high', 'low', 'close', 'price', 'label', 'reg_target']]
+    os.makedirs(paths["dir"], exist_ok=True)
+    write_memmap(paths["features"], np.ascontiguousarray(df[features].to_numpy(dtype=np.float32)))
+    write_memmap(paths["y_clf"], df['label'].to_numpy(dtype=np.int8))
+    write_memmap(paths["y_reg"], df['reg_target'].to_numpy(dtype=np.float32))
+    meta = {"features": features, "rows": len(df), "first": df.index[0].isoformat(), "last": df.index[-1].isoformat(),
+            "future_offset": trainer.OFFS_MAP.get(interval, 4), "sequence_length": trainer.SEQUENCE_LENGTH}
+    with open(paths["meta"], "w") as f: json.dump(meta, f, indent=2)
+    return meta
+
+def plan_folds(n_rows: int, train: int, test: int, gap: int, expanding: bool, max_folds: int = 0) -> list:
+    folds, start = [], 0
+    while True:
+        train_start = 0 if expanding else start
+        train_end = start + train
+        test_start, test_end = train_end + gap, train_end + gap + test
+        if test_end > n_rows: break
+        folds.append({"fold": len(folds), "train_start": train_start, "train_end": train_end, "test_start": test_start, "test_end": test_end})
+        start += test
+    return folds[-max_folds:] if max_folds else folds
+
+# --------------------------------------------------
+# 1 FOLD (chạy trong tiến trình con)
+# --------------------------------------------------
+def _init_worker(threads: int):
+    # Phải đặt trước khi tiến trình con import trainer/TensorFlow
+    for var in ("TRAINER_THREADS", "OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"): os.environ[var] = str(threads)
+
+def run_fold(fold: dict, paths: dict, epochs: int) -> dict:
+    """Train LightGBM + LSTM + Transformer trên phần train của fold, dự đoán phần test. Kết quả ghi ra fold_XX.npz."""
+    t0 = time.perf_counter()
+    import pandas as pd
+    import trainer as T
+    from numpy.lib.stride_tricks import sliding_window_view
+    from sklearn.preprocessing import StandardScaler
+    from keras import callbacks, utils
+    meta = json.load(open(paths["meta"]))
+    X = np.load(paths["features"], mmap_mode="r"); y_clf = np.load(paths["y_clf"], mmap_mode="r"); y_reg = np.load(paths["y_reg"], mmap_mode="r")
+    seq = meta["sequence_length"]
+    s, tr_end, te_start, te_end = fold["train_start"], fold["train_end"], fold["test_start"], fold["test_end"]
+    n_tr = tr_end - s
+    val_split = n_tr - int(np.ceil(n_tr * 0.15))  # 15% cuối phần train: validation cho early stopping
+    preds = {}
+
+    # --- LightGBM: đặc trưng gốc, như trainer ---
+    X_df = pd.DataFrame(np.asarray(X[s:te_end]), columns=meta["features"])
+    boosters, _ = T.train_lgbm_pair(X_df.iloc[:val_split], X_df.iloc[val_split:n_tr],
+                                    {"clf": y_clf[s:s + val_split], "reg": y_reg[s:s + val_split]},
+                                    {"clf": y_clf[s + val_split:tr_end], "reg": y_reg[s + val_split:tr_end]}, 1000)
+    X_test = X_df.iloc[te_start - s:te_end - s]
+    prob = boosters["clf"].predict(X_test, num_iteration=boosters["clf"].best_iteration or None)
+    preds["lightgbm"] = np.column_stack([prob[:, 2], prob[:, 0], boosters["reg"].predict(X_test, num_iteration=boosters["reg"].best_iteration or None)])
+
+    # --- LSTM / Transformer: cửa sổ i = dòng [i, i+seq) (toạ độ trong fold), nhãn tại dòng i+seq ---
+    scaler = StandardScaler().fit(X[s:tr_end])
+    scaled = np.ascontiguousarray(scaler.transform(X[s:te_end]), dtype=np.float32)
+    y_clf_win = utils.to_categorical(np.asarray(y_clf[s + seq:te_end], dtype=np.int32), num_classes=3).astype(np.float32)
+    y_reg_win = np.asarray(y_reg[s + seq:te_end], dtype=np.float32)
+    train_idx, val_idx = np.arange(0, val_split - seq), np.arange(val_split - seq, n_tr - seq)
+    test_idx = np.arange(te_start - s - seq, te_end - s - seq)
+    test_windows = np.ascontiguousarray(sliding_window_view(scaled, seq, axis=0).transpose(0, 2, 1)[test_idx])
+    seq_tensor = T.tf.constant(scaled)
+    input_shape = (seq, scaled.shape[1])
+    builders = {
+        "lstm": lambda t: T.build_lstm_model(input_shape, model_type=t),
+        "transformer": lambda t: T.build_transformer_model(input_shape, head_size=256, num_heads=T.TRANSFORMER_HEADS, ff_dim=4, num_layers=T.TRANSFORMER_LAYERS, model_type=t),
+    }
+    def fit(model, targets, monitor, mode):
+        es = callbacks.EarlyStopping(patience=10, monitor=monitor, mode=mode, restore_best_weights=True)
+        model.fit(T.make_window_dataset(seq_tensor, targets, train_idx, seq, shuffle=True), validation_data=T.make_window_dataset(seq_tensor, targets, val_idx, seq),
+                  epochs=epochs, callbacks=[es], verbose=0)
+        return model
+    for arch, build in builders.items():
+        if T.MULTI_HEAD:
+            clf_prob, reg_pred = fit(build('multi'), (y_clf_win, y_reg_win), 'val_loss', 'min').predict(test_windows, verbose=0, batch_size=T.BATCH_SIZE)
+        else:
+            clf_prob = fit(build('classifier'), y_clf_win, 'val_accuracy', 'max').predict(test_windows, verbose=0, batch_size=T.BATCH_SIZE)
+            reg_pred = fit(build('regressor'), y_reg_win, 'val_loss', 'min').predict(test_windows, verbose=0, batch_size=T.BATCH_SIZE)
+        preds[arch] = np.column_stack([clf_prob[:, 2], clf_prob[:, 0], np.ravel(reg_pred)])
+        T.keras.backend.clear_session()
+
+    out_path = os.path.join(paths["dir"], f"fold_{fold['fold']:02d}.npz")
+    np.savez(out_path, rows=np.arange(te_start, te_end), **{k: v.astype(np.float32) for k, v in preds.items()})
+    return {"fold": fold["fold"], "path": out_path, "seconds": round(time.perf_counter() - t0, 1)}
+
+def collect_oof(paths: dict, folds: list):
+    y_clf, y_reg = np.load(paths["y_clf"], mmap_mode="r"), np.load(paths["y_reg"], mmap_mode="r")
+    parts = [np.load(os.path.join(paths["dir"], f"fold_{f['fold']:02d}.npz")) for f in folds]
+    rows = np.concatenate([p["rows"] for p in parts])
+    oof = {"rows": rows, "y_clf": np.asarray(y_clf[rows]), "y_reg": np.asarray(y_reg[rows]),
+           "fold": np.concatenate([np.full(len(p["rows"]), f["fold"]) for p, f in zip(parts, folds)])}
+    oof.update({k: np.concatenate([p[k] for p in parts]) for k in MODEL_NAMES})
+    np.savez(paths["oof"], **oof)
+
+# --------------------------------------------------
+# CHẤM TRỌNG SỐ ENSEMBLE TRÊN DỰ ĐOÁN OUT-OF-FOLD
+# --------------------------------------------------
+def evaluate_weights(oof, weights: dict, interval: str) -> dict:
+    """Trộn như ml_report.build_result (chưa gồm luật AVOID_CONFLICT) rồi chấm: accuracy/logloss 3 lớp,
+    MAE của %, và lợi nhuận trung bình (% theo reg_target) của các tín hiệu BUY/SELL theo classify_level."""
+    from ml_report import classify_level
+    names = [k for k in MODEL_NAMES if weights.get(k, 0) > 0]
+    w = np.array([weights[k] for k in names]); w = w / w.sum()
+    pb, ps, pct = np.tensordot(w, np.stack([oof[k] for k in names]), axes=1).T
+    y_clf, y_reg = oof["y_clf"].astype(int), oof["y_reg"]
+    probs = np.column_stack([ps, np.clip(1 - pb - ps, 0, None), pb])  # lớp 0 = SELL, 1 = HOLD, 2 = BUY
+    probs = np.clip(probs / probs.sum(axis=1, keepdims=True), 1e-9, 1)
+    side = np.array([1 if "BUY" in lv else -1 if "SELL" in lv else 0
+                     for lv in (classify_level(b * 100, s * 100, p, interval)["level"] for b, s, p in zip(pb, ps, pct))])
+    signal = side != 0
+    signal_ret = side[signal] * y_reg[signal]
+    return {"weights": {k: round(float(v), 3) for k, v in zip(names, w)},
+            "accuracy": round(float(np.mean(probs.argmax(axis=1) == y_clf)), 4),
+            "logloss": round(float(-np.mean(np.log(probs[np.arange(len(y_clf)), y_clf]))), 4),
+            "mae": round(float(np.mean(np.abs(pct - y_reg))), 4),
+            "signals": int(signal.sum()),
+            "hit_rate": round(float(np.mean(signal_ret > 0)), 4) if signal.any() else None,
+            "signal_return": round(float(np.mean(signal_ret)), 4) if signal.any() else 0.0}
+
+def weight_grid(step: float) -> list:
+    n = int(round(1 / step))
+    return [dict(zip(MODEL_NAMES, (a * step, b * step, (n - a - b) * step))) for a, b in itertools.product(range(n + 1), repeat=2) if a + b <= n]
+
+def evaluate_ensemble(paths: dict, interval: str, step: float, objective: str, top: int = 5) -> dict:
+    from ml_report import ENSEMBLE_WEIGHTS
+    oof = dict(np.load(paths["oof"]))
+    current = evaluate_weights(oof, ENSEMBLE_WEIGHTS, interval)
+    singles = {k: evaluate_weights(oof, {k: 1.0}, interval) for k in MODEL_NAMES}
+    results = [evaluate_weights(oof, w, interval) for w in weight_grid(step)]
+    results.sort(key=lambda r: r[objective] if r[objective] is not None else float("-inf"), reverse=OBJECTIVES[objective])
+    per_fold = {int(f): evaluate_weights({k: v[oof["fold"] == f] for k, v in oof.items()}, ENSEMBLE_WEIGHTS, interval) for f in np.unique(oof["fold"])}
+    return {"objective": objective, "samples": int(len(oof["rows"])), "current": current, "single_models": singles,
+            "best": results[:top], "current_per_fold": per_fold}
+
+def print_evaluation(ev: dict):
+    obj = ev["objective"]
+    fmt = lambda r: (f"{json.dumps(r['weights'])} | acc {r['accuracy']} logloss {r['logloss']} mae {r['mae']} | "
+                     f"{r['signals']} tín hiệu, hit {r['hit_rate']}, lãi TB {r['signal_return']}%")
+    print(f"--- 📈 Ensemble trên {ev['samples']} mẫu out-of-fold (xếp theo {obj}) ---")
+    print(f"  Hiện tại (ENSEMBLE_WEIGHTS): {fmt(ev['current'])}")
+    for name, r in ev["single_models"].items(): print(f"  Chỉ {name:<12}: {fmt(r)}")
+    for i, r in enumerate(ev["best"], 1): print(f"  #{i}: {fmt(r)}")
+
+# --------------------------------------------------
+# MAIN
+# --------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Walk-forward cho ensemble LightGBM/LSTM/Transformer + chấm trọng số trên dự đoán out-of-fold.")
+    parser.add_argument("symbol"); parser.add_argument("interval")
+    parser.add_argument("--train", type=int, default=1500, help="Số dòng train mỗi fold")
+    parser.add_argument("--test", type=int, default=250, help="Số dòng test mỗi fold (= bước trượt)")
+    parser.add_argument("--expanding", action="store_true", help="Cửa sổ train mở rộng từ dòng 0 thay vì trượt")
+    parser.add_argument("--max-folds", type=int, default=0, help="Chỉ giữ N fold gần nhất (0 = tất cả)")
+    parser.add_argument("--epochs", type=int, default=30)
+    parser.add_argument("--workers", type=int, default=0, help="Số fold chạy song song (mặc định: số core / --threads)")
+    parser.add_argument("--threads", type=int, default=2, help="Số luồng mỗi tiến trình fold")
+    parser.add_argument("--eval-only", action="store_true", help="Chỉ chấm lại trọng số từ oof.npz đã có")
+    parser.add_argument("--step", type=float, default=0.05, help="Bước lưới trọng số ensemble")
+    parser.add_argument("--objective", choices=list(OBJECTIVES), default="logloss")
+    args = parser.parse_args()
+    symbol, interval = args.symbol.upper(), args.interval.lower()
+    paths = run_paths(symbol, interval)
+
+    if not args.eval_only:
+        t0 = time.perf_counter()
+        meta = prepare_data(symbol, interval, paths)
+        folds = plan_folds(meta["rows"], args.train, args.test, meta["future_offset"], args.expanding, args.max_folds)
+        if not folds: raise SystemExit(f"❌ Chỉ có {meta['rows']} dòng, không đủ cho 1 fold (train {args.train} + test {args.test}).")
+        n_cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+        workers = min(len(folds), args.workers or max(1, n_cores // args.threads))
+        print(f"--- 🔁 Walk-forward {symbol} [{interval}]: {len(folds)} fold, {workers} tiến trình x {args.threads} luồng ---")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn"), initializer=_init_worker, initargs=(args.threads,)) as pool:
+            futures = {pool.submit(run_fold, f, paths, args.epochs): f for f in folds}
+            for fut in as_completed(futures):
+                f = futures[fut]
+                r = fut.result()
+                print(f"  ✅ Fold {r['fold']}: train [{f['train_start']}, {f['train_end']}) test [{f['test_start']}, {f['test_end']}) trong {r['seconds']}s")
+        collect_oof(paths, folds)
+        meta.update({"folds": folds, "epochs": args.epochs, "seconds": round(time.perf_counter() - t0, 1)})
+        with open(paths["meta"], "w") as f: json.dump(meta, f, indent=2)
+    elif not os.path.exists(paths["oof"]):
+        raise SystemExit(f"❌ Chưa có {paths['oof']} — chạy walk-forward trước (bỏ --eval-only).")
+
+    ev = evaluate_ensemble(paths, interval, args.step, args.objective)
+    print_evaluation(ev)
+    with open(paths["report"], "w") as f: json.dump({"symbol": symbol, "interval": interval, "created_at": datetime.now(timezone.utc).isoformat(), **ev}, f, indent=2)
+    print(f"📊 Báo cáo: {paths['report']}")
+
+if __name__ == "__main__":
+    main()